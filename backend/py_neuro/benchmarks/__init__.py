@@ -0,0 +1 @@
+# Makes py_neuro/benchmarks a package (run scripts with `python -m py_neuro.benchmarks.<name>`)
@@ -0,0 +1,107 @@
+"""
+Benchmark: Gemini request size before and after image preprocessing.
+
+Builds a set of synthetic document images (large scanned figures, photos, transparent
+diagrams) and measures the serialized size of the multimodal request:
+  * before: full-size PIL images, as generate_hierarchical_study_guide used to send them
+  * after:  images downscaled and re-encoded by image_processing.prepare_images_for_gemini
+
+Run from the backend/ directory:
+    python -m py_neuro.benchmarks.bench_gemini_payload --images 24
+"""
+import os
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw
+from google.generativeai.types import content_types
+
+from .. import models
+from ..config import settings
+from ..process_pool import process_pool
+from ..image_processing import prepare_images_for_gemini
+
+PROMPT_TEXT = "Study guide prompt and document text. " * 2000 # ~75 KB, same in both requests
+
+def build_images(image_dir: str, count: int) -> list[models.ExtractedImageInfo]:
+    """Writes a mix of image types typically extracted from lecture slides and scanned books."""
+    rng = np.random.default_rng(42)
+    images = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            # Scanned figure: 4000x3000 line drawing with paper noise, stored as PNG
+            noise = rng.normal(235, 12, (3000, 4000)).clip(0, 255).astype(np.uint8)
+            img = Image.fromarray(noise).convert("RGB")
+            draw = ImageDraw.Draw(img)
+            for y in range(200, 2800, 150):
+                draw.line((300, y, 3700, 3000 - y), fill=(20, 20, 20), width=6)
+            filename = f"img_{i + 1}_{i}.png"
+        elif kind == 1:
+            # Photo: 3000x2000 smooth colour field with texture, stored as high-quality JPEG
+            x = np.linspace(0, 6 * np.pi, 3000)
+            y = np.linspace(0, 4 * np.pi, 2000)[:, None]
+            base = (np.sin(x) * np.cos(y) * 80 + 128)[..., None] + rng.normal(0, 6, (2000, 3000, 3))
+            img = Image.fromarray(base.clip(0, 255).astype(np.uint8))
+            filename = f"img_{i + 1}_{i}.jpg"
+        else:
+            # Diagram with transparency: 2400x1800 RGBA PNG
+            img = Image.new("RGBA", (2400, 1800), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(img)
+            for j in range(12):
+                draw.rectangle((100 + j * 180, 200 + j * 90, 260 + j * 180, 500 + j * 90), outline=(30, 60, 200, 255), width=8)
+            filename = f"img_{i + 1}_{i}.png"
+        if filename.endswith(".jpg"):
+            img.save(os.path.join(image_dir, filename), quality=95)
+        else:
+            img.save(os.path.join(image_dir, filename))
+        images.append(models.ExtractedImageInfo(filename=filename, page_number=i + 1))
+    return images
+
+def request_size(prompt_parts: list) -> int:
+    """Serialized protobuf size of the request contents."""
+    return sum(content._pb.ByteSize() for content in content_types.to_contents(prompt_parts))
+
+def size_before(image_dir: str, images: list[models.ExtractedImageInfo]) -> int:
+    parts = [PROMPT_TEXT]
+    for img_info in images:
+        pil_image = Image.open(os.path.join(image_dir, img_info.filename))
+        if pil_image.mode != 'RGB':
+            pil_image = pil_image.convert('RGB') # Old behaviour: sent as lossless WebP
+        parts.append(pil_image)
+    return request_size(parts)
+
+async def size_after(image_dir: str, images: list[models.ExtractedImageInfo]) -> tuple[int, dict, float]:
+    start = time.perf_counter()
+    prepared, report = await prepare_images_for_gemini(image_dir, images)
+    elapsed = time.perf_counter() - start
+    process_pool.shutdown()
+    parts = [PROMPT_TEXT] + [blob for _, blob in prepared]
+    return request_size(parts), report, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=24)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_payload_")
+    try:
+        images = build_images(work_dir, args.images)
+        before = size_before(work_dir, images)
+        after, report, elapsed = asyncio.run(size_after(work_dir, images))
+        print(f"{len(images)} images, long edge <= {settings.GEMINI_IMAGE_MAX_EDGE}px, "
+              f"{settings.GEMINI_IMAGE_FORMAT} q{settings.GEMINI_IMAGE_QUALITY}")
+        print(f"request before : {before / 1e6:8.2f} MB")
+        print(f"request after  : {after / 1e6:8.2f} MB")
+        print(f"reduction      : {before / after:8.1f}x")
+        print(f"image bytes saved vs. files on disk: {report['bytes_saved'] / 1e6:.2f} MB")
+        print(f"preprocessing time: {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: server-side topic graph layout (graph_layout.layout_graph) on large graphs.
+
+Builds synthetic topic graphs shaped like the ones derived from study guides (guide ->
+sections -> subsections trees, plus "related" edges between subsections of different
+guides) and measures, per size:
+  * full:        a layout from scratch, and the time per iteration
+  * incremental: adding 1% new topics with every existing position pinned
+  * error:       median relative error of the Barnes-Hut repulsion against the exact
+                 all-pairs forces, on a sample of nodes
+
+Run from the backend/ directory:
+    python -m py_neuro.benchmarks.bench_graph_layout --nodes 1000 10000 50000
+    python -m py_neuro.benchmarks.bench_graph_layout --nodes 50000 --iterations 20 --theta 1.2
+"""
+import time
+import argparse
+
+import numpy as np
+
+from ..config import settings
+from ..graph_layout import layout_graph, _QuadTree
+
+def build_graph(node_count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Edges (E, 2) of a forest of study guides (~8 sections of ~6 subsections each) with
+    related edges from ~half the subsections to other guides' subsections.
+    """
+    parents = np.full(node_count, -1)
+    kinds = np.zeros(node_count, dtype=np.int8) # 0 guide, 1 section, 2 subsection
+    guide = section = -1
+    for node in range(node_count):
+        draw = rng.random()
+        if guide < 0 or draw < 1 / 60:
+            guide = node
+        elif section < 0 or section < guide or draw < 1 / 7:
+            parents[node], kinds[node], section = guide, 1, node
+        else:
+            parents[node], kinds[node] = section, 2
+    children = np.flatnonzero(parents >= 0)
+    edges = [np.stack([parents[children], children], axis=1)]
+    subsections = np.flatnonzero(kinds == 2)
+    if len(subsections) > 1:
+        sources = rng.choice(subsections, size=len(subsections) // 2)
+        targets = rng.choice(subsections, size=len(sources))
+        edges.append(np.stack([sources, targets], axis=1)[sources != targets])
+    return np.concatenate(edges)
+
+def repulsion_error(positions: np.ndarray, k: float, theta: float, sample: int, rng: np.random.Generator) -> float:
+    """Median relative error of the Barnes-Hut forces on `sample` nodes."""
+    picked = rng.choice(len(positions), size=min(sample, len(positions)), replace=False)
+    approximate = _QuadTree(positions).repulsion(positions[picked], picked, k, theta)
+    exact = np.zeros_like(approximate)
+    for row, node in enumerate(picked):
+        delta = positions[node] - positions
+        squared = np.einsum("ij,ij->i", delta, delta)
+        squared[node] = np.inf
+        exact[row] = (k * k / np.maximum(squared, 1e-4)) @ delta
+    return float(np.median(np.linalg.norm(approximate - exact, axis=1) / np.linalg.norm(exact, axis=1)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--iterations", type=int, default=settings.TOPIC_LAYOUT_ITERATIONS)
+    parser.add_argument("--theta", type=float, default=settings.TOPIC_LAYOUT_THETA)
+    parser.add_argument("--edge-length", type=float, default=settings.TOPIC_LAYOUT_EDGE_LENGTH)
+    parser.add_argument("--error-sample", type=int, default=200, help="Nodes checked against exact forces")
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    print(f"{'nodes':>7} {'edges':>7} {'full':>9} {'per iter':>9} {'+1% incr.':>10} {'BH error':>9}")
+    for node_count in args.nodes:
+        edges = build_graph(node_count, rng)
+
+        start = time.perf_counter()
+        positions = layout_graph(node_count, edges, k=args.edge_length, iterations=args.iterations, theta=args.theta)
+        full_seconds = time.perf_counter() - start
+
+        added = max(1, node_count // 100)
+        new_edges = np.stack([rng.integers(0, node_count, added), np.arange(node_count, node_count + added)], axis=1)
+        previous = np.vstack([positions, np.full((added, 2), np.nan)])
+        pinned = np.arange(node_count + added) < node_count
+        start = time.perf_counter()
+        updated = layout_graph(
+            node_count + added, np.concatenate([edges, new_edges]), previous, pinned,
+            k=args.edge_length, iterations=args.iterations, theta=args.theta
+        )
+        incremental_seconds = time.perf_counter() - start
+        assert np.array_equal(updated[:node_count], positions), "Pinned positions moved"
+
+        error = repulsion_error(positions, args.edge_length, args.theta, args.error_sample, rng)
+        print(
+            f"{node_count:>7} {len(edges):>7} {full_seconds:>8.2f}s {full_seconds / args.iterations * 1000:>7.0f}ms "
+            f"{incremental_seconds:>9.2f}s {error:>8.2%}"
+        )
+
+if __name__ == "__main__":
+    main()
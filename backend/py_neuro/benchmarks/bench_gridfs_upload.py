@@ -0,0 +1,78 @@
+"""
+Benchmark: GridFS upload wall time against image count, sequential vs concurrent.
+
+Stores synthetic study guides through `crud.create_study_guide` with
+GRIDFS_UPLOAD_CONCURRENCY=1 (the old one-at-a-time behaviour) and with the configured
+concurrency. Needs a running MongoDB; uses a throwaway database that is dropped afterwards.
+
+Run from the backend/ directory:
+    python -m py_neuro.benchmarks.bench_gridfs_upload --images 10 40 80 --concurrency 8
+    python -m py_neuro.benchmarks.bench_gridfs_upload --mongodb-url mongodb://localhost:27017
+"""
+import os
+import time
+import asyncio
+import argparse
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+
+from .. import crud
+from .. import models
+from ..config import settings
+
+BENCH_DATABASE = "bench_gridfs_upload"
+
+def build_images(count: int, size: int) -> dict[str, bytes]:
+    """Distinct random payloads, so content-addressed storage can't reuse earlier uploads."""
+    return {f"img_{i + 1}_{i}.png": os.urandom(size) for i in range(count)}
+
+async def store_guide(db, fs, images: dict[str, bytes], concurrency: int) -> float:
+    settings.GRIDFS_UPLOAD_CONCURRENCY = concurrency
+    study_guide = models.StudyGuideResponse(
+        original_filename="bench.pdf",
+        extracted_images=[models.ExtractedImageInfo(filename=name) for name in images],
+        study_guide=[],
+        workspace_id=ObjectId()
+    )
+    start = time.perf_counter()
+    saved = await crud.create_study_guide(
+        db=db,
+        fs=fs,
+        study_guide_data=study_guide,
+        original_pdf_path=None,
+        image_paths=[],
+        image_buffers=images,
+        original_data=os.urandom(2 * 1024 * 1024)
+    )
+    elapsed = time.perf_counter() - start
+    assert not saved.failed_image_uploads, saved.failed_image_uploads
+    return elapsed
+
+async def run(mongodb_url: str, image_counts: list[int], image_kb: int, concurrency: int):
+    client = AsyncIOMotorClient(mongodb_url, serverSelectionTimeoutMS=5000)
+    db = client[BENCH_DATABASE]
+    fs = AsyncIOMotorGridFSBucket(db)
+    try:
+        await client.admin.command("ping")
+        await db[crud.GRIDFS_FILES_COLLECTION].create_index("metadata.sha256")
+        print(f"{'images':>6} {'sequential':>11} {f'concurrent({concurrency})':>15} {'speedup':>8}")
+        for count in image_counts:
+            sequential = await store_guide(db, fs, build_images(count, image_kb * 1024), 1)
+            concurrent = await store_guide(db, fs, build_images(count, image_kb * 1024), concurrency)
+            print(f"{count:>6} {sequential:>10.2f}s {concurrent:>14.2f}s {sequential / concurrent:>7.1f}x")
+    finally:
+        await client.drop_database(BENCH_DATABASE)
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default=settings.MONGODB_URL)
+    parser.add_argument("--images", type=int, nargs="+", default=[10, 40, 80])
+    parser.add_argument("--image-kb", type=int, default=300, help="Size of each synthetic image")
+    parser.add_argument("--concurrency", type=int, default=settings.GRIDFS_UPLOAD_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(run(args.mongodb_url, args.images, args.image_kb, args.concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: single-pass vs page-sharded PDF extraction.
+
+Builds a synthetic PDF (text plus one image per page) and times
+`extract_text_and_images_pdf` in one process against `pipeline.extract_pdf_in_pool`,
+which splits the page range across the extraction process pool.
+
+Run from the backend/ directory:
+    python -m py_neuro.benchmarks.bench_pdf_extraction --pages 600 --workers 4
+"""
+import io
+import os
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from ..config import settings
+from ..process_pool import process_pool
+from ..extraction import extract_text_and_images_pdf
+from .. import pipeline
+
+PARAGRAPH = (
+    "Graph neural networks aggregate features from a node's neighbourhood. "
+    "Each layer mixes the node's own representation with those of its neighbours. "
+) * 6
+
+def build_synthetic_pdf(path: str, pages: int):
+    """Writes a PDF with a few paragraphs of text and one distinct image per page."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 400), f"Chapter {page_num + 1}\n{PARAGRAPH}", fontsize=10)
+        image = Image.new("RGB", (320, 240), ((page_num * 37) % 256, (page_num * 91) % 256, (page_num * 13) % 256))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        page.insert_image(fitz.Rect(50, 420, 370, 660), stream=buffer.getvalue())
+    doc.save(path)
+    doc.close()
+
+def timed_single_pass(pdf_path: str, image_dir: str):
+    start = time.perf_counter()
+    result = extract_text_and_images_pdf(pdf_path, image_dir)
+    return time.perf_counter() - start, result
+
+async def timed_sharded(pdf_path: str, image_dir: str):
+    # Don't count worker start-up: occupy every worker once before timing
+    await asyncio.gather(*(process_pool.run(time.sleep, 0.5) for _ in range(process_pool.max_workers)))
+    start = time.perf_counter()
+    result = await pipeline.extract_pdf_in_pool(pdf_path, image_dir)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    settings.EXTRACTION_MAX_WORKERS = args.workers
+
+    work_dir = tempfile.mkdtemp(prefix="bench_pdf_")
+    try:
+        pdf_path = os.path.join(work_dir, "synthetic.pdf")
+        build_synthetic_pdf(pdf_path, args.pages)
+        print(f"Synthetic PDF: {args.pages} pages, {os.path.getsize(pdf_path) / 1e6:.1f} MB")
+
+        single_dir = os.path.join(work_dir, "single")
+        sharded_dir = os.path.join(work_dir, "sharded")
+        os.makedirs(single_dir)
+        os.makedirs(sharded_dir)
+
+        single_seconds, single_result = timed_single_pass(pdf_path, single_dir)
+        sharded_seconds, sharded_result = asyncio.run(timed_sharded(pdf_path, sharded_dir))
+        process_pool.shutdown()
+
+        assert single_result[0] == sharded_result[0], "Sharded text differs from single-pass text"
+        assert [i.filename for i in single_result[1]] == [i.filename for i in sharded_result[1]], "Image names differ"
+
+        shards = len(pipeline.plan_pdf_shards(args.pages, args.workers))
+        print(f"single pass          : {single_seconds:.2f}s")
+        print(f"sharded ({shards} shards, {args.workers} workers): {sharded_seconds:.2f}s")
+        print(f"speedup              : {single_seconds / sharded_seconds:.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
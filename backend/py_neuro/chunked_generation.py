@@ -0,0 +1,234 @@
+# Map-reduce study guide generation for documents longer than one Gemini request.
+# The document is split on page and heading boundaries, each chunk is sent with its
+# page-local images (map), and the per-chunk sections are merged in order (reduce).
+import re
+import asyncio
+import logging
+from typing import List, NamedTuple, AsyncIterator
+
+from . import models
+from .config import settings
+from .extraction import PAGE_BREAK
+from .generation import generate_hierarchical_study_guide, stream_hierarchical_study_guide
+
+logger = logging.getLogger(__name__)
+
+# Line starts that look like headings: Markdown, "Chapter 3", "2.1 Title", or short ALL-CAPS lines
+_HEADING_PATTERN = re.compile(
+    r"^(?:#{1,6}\s|(?:chapter|section|part|unit|lecture)\s+\w+|\d+(?:\.\d+)*\.?\s+[A-Z]|(?-i:[A-Z][A-Z0-9 ,:\-]{3,60})$)",
+    re.IGNORECASE | re.MULTILINE
+)
+
+class DocumentChunk(NamedTuple):
+    text: str
+    first_page: int # 1-based, inclusive
+    last_page: int
+    images: List[models.ExtractedImageInfo]
+
+def _split_oversized(text: str, max_chars: int) -> List[str]:
+    """
+    Splits a single page that is longer than `max_chars` (e.g. a whole TXT/DOCX file).
+    Each cut prefers, in order: a heading, a blank line, a line break, a space; cuts are
+    never placed in the first half of the window so pieces stay reasonably large.
+    """
+    pieces = []
+    while len(text) > max_chars:
+        window_start = max_chars // 2
+        window = text[:max_chars + 1]
+        cut = -1
+        # Headings are matched on whole lines: a line cut by the window end isn't a short heading
+        line_end = text.find("\n", max_chars)
+        headings = [
+            m.start() for m in _HEADING_PATTERN.finditer(text, window_start, len(text) if line_end == -1 else line_end)
+            if window_start < m.start() <= max_chars
+        ]
+        if headings:
+            cut = headings[-1]
+        else:
+            for separator in ("\n\n", "\n", " "):
+                position = window.rfind(separator, window_start)
+                if position != -1:
+                    cut = position + len(separator)
+                    break
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    pieces.append(text)
+    return pieces
+
+def plan_chunks(text_content: str, images_info: List[models.ExtractedImageInfo], max_chars: int) -> List[DocumentChunk]:
+    """
+    Packs consecutive pages into chunks of at most `max_chars` characters. Pages longer than
+    that are split further on headings/paragraphs. Images go to the chunk containing their
+    page (the first piece of a split page); images without a page go to the first chunk.
+    """
+    pages = text_content.split(PAGE_BREAK)
+    if pages and not pages[-1].strip() and len(pages) > 1:
+        pages.pop() # Trailing page break
+
+    # (text, page_number, is_first_piece_of_page)
+    pieces: List[tuple[str, int, bool]] = []
+    for page_index, page_text in enumerate(pages):
+        for piece_index, piece in enumerate(_split_oversized(page_text, max_chars)):
+            pieces.append((piece, page_index + 1, piece_index == 0))
+
+    images_by_page: dict[int | None, List[models.ExtractedImageInfo]] = {}
+    for img_info in images_info:
+        page_number = img_info.page_number if img_info.page_number in range(1, len(pages) + 1) else None
+        images_by_page.setdefault(page_number, []).append(img_info)
+
+    chunks: List[DocumentChunk] = []
+    current_text: List[str] = []
+    current_length = 0
+    current_images: List[models.ExtractedImageInfo] = list(images_by_page.get(None, []))
+    first_page = 1
+    last_page = 1
+    for piece, page_number, is_first_piece in pieces:
+        if current_text and current_length + len(piece) > max_chars:
+            chunks.append(DocumentChunk("\n".join(current_text), first_page, last_page, current_images))
+            current_text, current_length, current_images = [], 0, []
+        if not current_text:
+            first_page = page_number
+        current_text.append(piece)
+        current_length += len(piece) + 1
+        last_page = page_number
+        if is_first_piece:
+            current_images.extend(images_by_page.get(page_number, []))
+    if current_text or current_images:
+        chunks.append(DocumentChunk("\n".join(current_text), first_page, last_page, current_images))
+    return chunks
+
+def _chunk_context(chunks: List[DocumentChunk], index: int) -> str:
+    """Tells the model which part of the document a chunk is."""
+    chunk = chunks[index]
+    pages = f"page {chunk.first_page}" if chunk.first_page == chunk.last_page else f"pages {chunk.first_page}-{chunk.last_page}"
+    return f"part {index + 1} of {len(chunks)} ({pages} of {chunks[-1].last_page}) of a longer document"
+
+def _chunk_prepared_images(chunk: DocumentChunk, prepared_by_filename: dict[str, dict]) -> List[tuple[str, dict]]:
+    return [
+        (img_info.filename, prepared_by_filename[img_info.filename])
+        for img_info in chunk.images if img_info.filename in prepared_by_filename
+    ]
+
+def _continues_previous(previous: models.StudyGuideSection | None, section: models.StudyGuideSection) -> bool:
+    """True when a chunk's first section carries on the previous chunk's last section (same title)."""
+    return previous is not None and previous.section_title.strip().lower() == section.section_title.strip().lower()
+
+def merge_chunk_sections(chunk_sections: List[List[models.StudyGuideSection]]) -> List[models.StudyGuideSection]:
+    """
+    Concatenates per-chunk sections in document order. When a chunk boundary splits a topic,
+    the first section of a chunk often repeats the title of the previous chunk's last section;
+    those are merged into one section.
+    """
+    merged: List[models.StudyGuideSection] = []
+    for sections in chunk_sections:
+        for position, section in enumerate(sections):
+            previous = merged[-1] if merged else None
+            if position == 0 and _continues_previous(previous, section):
+                previous.subsection_titles.extend(section.subsection_titles)
+                previous.subsections.extend(section.subsections)
+                continue
+            merged.append(section)
+    return merged
+
+async def generate_study_guide_chunked(
+    text_content: str,
+    images_info: List[models.ExtractedImageInfo],
+    request_image_dir: str,
+    prepared_images: List[tuple[str, dict]]
+) -> List[models.StudyGuideSection]:
+    """
+    Generates the study guide for a document of any length. Documents that fit into one
+    request (GEMINI_CHUNK_MAX_CHARS) are sent as before; longer ones are chunked and the
+    chunks are generated concurrently, at most GEMINI_MAX_CONCURRENCY at a time.
+    """
+    chunks = plan_chunks(text_content, images_info, settings.GEMINI_CHUNK_MAX_CHARS)
+    if len(chunks) <= 1:
+        return await generate_hierarchical_study_guide(
+            text_content, images_info, request_image_dir, prepared_images=prepared_images
+        )
+
+    prepared_by_filename = dict(prepared_images)
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_MAX_CONCURRENCY))
+    logger.info(f"Generating study guide in {len(chunks)} chunks (concurrency {settings.GEMINI_MAX_CONCURRENCY})")
+
+    async def generate_chunk(index: int, chunk: DocumentChunk) -> List[models.StudyGuideSection]:
+        chunk_prepared = _chunk_prepared_images(chunk, prepared_by_filename)
+        async with semaphore:
+            sections = await generate_hierarchical_study_guide(
+                chunk.text, chunk.images, request_image_dir,
+                prepared_images=chunk_prepared, document_context=_chunk_context(chunks, index)
+            )
+        logger.info(f"Chunk {index + 1}/{len(chunks)} produced {len(sections)} sections")
+        return sections
+
+    tasks = [asyncio.create_task(generate_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+    try:
+        chunk_sections = await asyncio.gather(*tasks)
+    except BaseException:
+        # One failed chunk fails the study guide; don't keep paying for the others
+        for task in tasks:
+            task.cancel()
+        raise
+    return merge_chunk_sections(chunk_sections)
+
+async def stream_study_guide_chunked(
+    text_content: str,
+    images_info: List[models.ExtractedImageInfo],
+    prepared_images: List[tuple[str, dict]]
+) -> AsyncIterator[tuple[int, models.StudyGuideSection]]:
+    """
+    Streaming counterpart of `generate_study_guide_chunked`. Yields (index, section) in document
+    order as sections complete. Chunks stream concurrently; each fills its own queue and the
+    queues are drained in chunk order. A section continuing across a chunk boundary is merged
+    into the previous one and yielded again with the previous section's index.
+    """
+    chunks = plan_chunks(text_content, images_info, settings.GEMINI_CHUNK_MAX_CHARS)
+    if len(chunks) <= 1:
+        index = 0
+        async for section in stream_hierarchical_study_guide(text_content, prepared_images):
+            yield index, section
+            index += 1
+        return
+
+    prepared_by_filename = dict(prepared_images)
+    semaphore = asyncio.Semaphore(max(1, settings.GEMINI_MAX_CONCURRENCY))
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in chunks]
+    end_of_chunk = object()
+    logger.info(f"Streaming study guide in {len(chunks)} chunks (concurrency {settings.GEMINI_MAX_CONCURRENCY})")
+
+    async def stream_chunk(index: int, chunk: DocumentChunk):
+        queue = queues[index]
+        try:
+            async with semaphore:
+                async for section in stream_hierarchical_study_guide(
+                    chunk.text, _chunk_prepared_images(chunk, prepared_by_filename), _chunk_context(chunks, index)
+                ):
+                    queue.put_nowait(section)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(end_of_chunk)
+
+    tasks = [asyncio.create_task(stream_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+    try:
+        merged: List[models.StudyGuideSection] = []
+        for queue in queues:
+            first_of_chunk = True
+            while (item := await queue.get()) is not end_of_chunk:
+                if isinstance(item, Exception):
+                    raise item
+                previous = merged[-1] if merged else None
+                if first_of_chunk and _continues_previous(previous, item):
+                    previous.subsection_titles.extend(item.subsection_titles)
+                    previous.subsections.extend(item.subsections)
+                    yield len(merged) - 1, previous
+                else:
+                    merged.append(item)
+                    yield len(merged) - 1, item
+                first_of_chunk = False
+    finally:
+        # Consumer finished, failed or went away: stop the remaining chunk requests
+        for task in tasks:
+            task.cancel()
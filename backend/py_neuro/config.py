@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 import logging
+from typing import List
 from pydantic_settings import BaseSettings
 import google.generativeai as genai # Add import
 
@@ -15,6 +16,89 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str = "" # Added Gemini key
     kokoro_model_path: str = "" # Added Kokoro model path
     kokoro_voices_path: str = "" # Added Kokoro voices path
+    GEMINI_MODEL_NAME: str = "gemini-2.0-flash" # Also part of the study guide cache key
+
+    MONGO_CHECK_QUERY_PLANS: bool = False # At startup, fail if a known query has no usable index (explain() -> COLLSCAN)
+
+    # --- Study guide job queue ---
+    JOB_WORKER_CONCURRENCY: int = 2 # Jobs processed concurrently by each API process
+    JOB_POLL_INTERVAL_SECONDS: float = 2.0 # How often idle workers check Mongo for queued jobs
+    JOB_LEASE_SECONDS: int = 900 # Renewed every third of this while a job runs; an expired lease (crashed worker) is picked up again
+    JOB_MAX_ATTEMPTS: int = 3 # Give up on a job after this many claims
+    JOB_RETRY_BACKOFF_SECONDS: float = 30.0 # Wait before retrying a job that failed with a transient error; doubles per attempt
+    JOB_QUEUE_MAX_PENDING: int = 100 # Uploads are rejected with a 429 once this many jobs are queued
+
+    # --- Uploads ---
+    UPLOAD_SPILL_TO_DISK_MB: int = 64 # Uploads up to this size are extracted from memory; larger ones from one temp file
+
+    # --- Document extraction process pool ---
+    EXTRACTION_MAX_WORKERS: int = 0 # Worker processes; 0 = one per CPU core
+    EXTRACTION_TIMEOUT_SECONDS: int = 300 # Per-task limit, enforced inside the worker
+    EXTRACTION_MAX_MEMORY_MB: int = 4096 # Address-space cap per worker process; 0 = unlimited
+    EXTRACTION_MAX_PENDING: int = 16 # Tasks in flight before request handlers get a 503
+    EXTRACTION_MAX_TASKS_PER_CHILD: int = 50 # Recycle workers periodically to release leaked memory; 0 = never
+    PDF_SHARD_MIN_PAGES: int = 100 # PDFs with at least this many pages are split across worker processes
+    PDF_SHARD_MIN_PAGES_PER_SHARD: int = 25 # Don't make shards smaller than this
+
+    # --- Image relevance filter (applied before images are sent to Gemini) ---
+    IMAGE_FILTER_ENABLED: bool = True
+    IMAGE_FILTER_MIN_COLOR_STD: float = 4.0 # Below this mean channel std-dev (and tonal range) an image is blank
+    IMAGE_FILTER_MIN_TONAL_RANGE: float = 24.0 # Darkest-to-brightest spread (0-255) that still counts as blank
+    IMAGE_FILTER_MIN_ENTROPY: float = 0.1 # Grayscale histogram entropy (bits) below which an image is near-uniform
+    IMAGE_FILTER_MIN_DETAIL: float = 0.5 # Mean |Laplacian| below which an image is a smooth gradient
+    IMAGE_FILTER_MAX_HASH_DISTANCE: int = 6 # dHash bits (of 64) within which images count as near-duplicates
+    IMAGE_FILTER_MAX_IMAGES: int = 40 # Maximum images sent per request; 0 = unlimited
+
+    # --- Gemini image preprocessing ---
+    GEMINI_IMAGE_MAX_EDGE: int = 1536 # Long-edge limit (pixels) for images sent to Gemini
+    GEMINI_IMAGE_FORMAT: str = "JPEG" # Re-encode format: JPEG or WEBP
+    GEMINI_IMAGE_QUALITY: int = 80 # Encoder quality (1-100)
+
+    # --- Thumbnails of extracted images (GET /api/files/gridfs/{id}?size=...) ---
+    THUMBNAIL_SIZES: List[int] = [160, 480] # Long-edge sizes (pixels) that can be requested
+    THUMBNAIL_FORMAT: str = "WEBP" # JPEG or WEBP
+    THUMBNAIL_QUALITY: int = 75
+    THUMBNAIL_ON_INGEST: bool = True # Render when a study guide is stored; otherwise on first request
+
+    # --- Chunked study guide generation ---
+    GEMINI_CHUNK_MAX_CHARS: int = 30000 # Text per Gemini request; longer documents are split on page/heading boundaries
+    GEMINI_MAX_CONCURRENCY: int = 4 # Chunk requests in flight per study guide
+
+    # --- GridFS uploads ---
+    GRIDFS_UPLOAD_CONCURRENCY: int = 8 # Files uploaded in parallel per study guide
+    GRIDFS_UPLOAD_RETRIES: int = 2 # Retries per file on transient MongoDB errors
+    GRIDFS_UPLOAD_RETRY_BACKOFF_SECONDS: float = 0.5 # Doubled after every retry
+
+    # --- GridFS file cache (GET /api/files/gridfs/{id}) ---
+    FILE_CACHE_MEMORY_MB: int = 128 # In-process budget; 0 = disabled
+    FILE_CACHE_MEMORY_MAX_FILE_KB: int = 1024 # Larger files skip the memory tier
+    FILE_CACHE_DIR: str = "" # On-disk tier for larger files; empty = disabled
+    FILE_CACHE_DISK_MB: int = 2048
+    FILE_CACHE_DISK_MAX_FILE_MB: int = 64
+
+    # --- Batch file endpoint (POST /api/files/gridfs/batch) ---
+    FILE_BATCH_MAX_FILES: int = 500 # Files per batch request
+    FILE_BATCH_INLINE_MAX_KB: int = 64 # Images up to this size are inlined (base64) in the JSON manifest
+
+    # --- Study guide storage ---
+    STUDY_GUIDE_STORAGE_LAYOUT: str = "embedded" # "embedded" (sections inside the guide document) or "sections" (one document per section)
+
+    # --- Knowledge graph (topics derived from study guides) ---
+    TOPIC_SIMILARITY_FEATURES: int = 32768 # Hashed TF-IDF dimensions for "related" edges between study guides
+    TOPIC_RELATED_TOP_K: int = 3 # Related edges per subsection, to subsections of other study guides
+    TOPIC_RELATED_MIN_SIMILARITY: float = 0.2 # Cosine similarity below which no edge is added
+    TOPIC_LAYOUT_EDGE_LENGTH: float = 80.0 # Ideal distance between connected topics (layout units)
+    TOPIC_LAYOUT_ITERATIONS: int = 60 # Force-directed iterations per (full or incremental) layout
+    TOPIC_LAYOUT_THETA: float = 1.0 # Barnes-Hut opening angle; smaller is more exact and slower, 0 = all pairs
+    TOPIC_VIEWPORT_MAX_NODES: int = 2000 # Default topics per viewport response before it switches to clusters
+    TOPIC_VIEWPORT_CACHED_GRAPHS: int = 16 # Workspaces whose spatial index is kept in memory (per process)
+    TOPIC_PROGRESS_FLUSH_SECONDS: float = 1.0 # Progress events are coalesced and written this often; 0 = on every request
+    TOPIC_PROGRESS_MAX_PENDING: int = 5000 # Flush early once this many topics have pending progress
+
+    # --- Study guide result cache ---
+    STUDY_GUIDE_CACHE_ENABLED: bool = True
+    STUDY_GUIDE_CACHE_TTL_DAYS: int = 30 # Mongo entries not read for this long are evicted
+    STUDY_GUIDE_CACHE_MEMORY_ENTRIES: int = 64 # In-process LRU in front of Mongo; 0 = disabled
 
     class Config:
         # Construct the path to the .env file relative to this config file
@@ -34,8 +118,8 @@ else:
         # Using a model that supports multimodal and JSON output mode
         # Note: Check Google AI documentation for the latest recommended model for JSON mode.
         # gemini-1.5-flash or gemini-1.5-pro might be suitable. Using flash for potential cost/speed benefits.
-        gemini_model = genai.GenerativeModel('gemini-2.0-flash') # Or 'gemini-1.5-pro'
-        logger.info("Gemini configured successfully with gemini-2.0-flash.")
+        gemini_model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME) # Or 'gemini-1.5-pro'
+        logger.info(f"Gemini configured successfully with {settings.GEMINI_MODEL_NAME}.")
     except Exception as e:
         logger.error(f"Failed to configure Gemini: {e}")
         gemini_model = None # Ensure it's None if configuration fails
@@ -1,27 +1,46 @@
 # CRUD (Create, Read, Update, Delete) operations
 from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
 from bson import ObjectId
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+import io
+import asyncio
+import hashlib
 import logging
 import os
 from typing import List
 
 # Use relative import
 from . import models
+from .config import settings
+from .file_cache import file_cache, thumbnail_cache_key
+from .image_processing import render_thumbnails
+from .process_pool import process_pool
 
 logger = logging.getLogger(__name__)
 
 STUDY_GUIDE_COLLECTION = "study_guides" # Define collection name
+STUDY_GUIDE_SECTIONS_COLLECTION = "study_guide_sections" # Sections of guides stored with the "sections" layout
+GRIDFS_FILES_COLLECTION = "fs.files" # Metadata collection of the default GridFS bucket
+
+def _read_file(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.read()
 
 # --- GridFS Helper ---
-async def upload_file_to_gridfs(fs: AsyncIOMotorGridFSBucket, file_path: str, filename: str, content_type: str | None = None) -> ObjectId:
-    """Uploads a file from the local filesystem to GridFS."""
+async def upload_file_to_gridfs(fs: AsyncIOMotorGridFSBucket, file_path: str | None, filename: str, content_type: str | None = None, metadata: dict | None = None, data: bytes | None = None) -> ObjectId:
+    """Uploads a file to GridFS, from `data` when the bytes are already in memory, otherwise from `file_path`."""
+    file_metadata = dict(metadata or {})
+    if content_type:
+        file_metadata["contentType"] = content_type
     try:
-        with open(file_path, "rb") as file_data:
+        with (io.BytesIO(data) if data is not None else open(file_path, "rb")) as file_data:
             # upload_from_stream requires filename, source, and optionally metadata
             file_id = await fs.upload_from_stream(
                 filename=filename,
                 source=file_data,
-                metadata={"contentType": content_type} if content_type else None
+                metadata=file_metadata or None
             )
             logger.info(f"Uploaded {filename} to GridFS with ID: {file_id}")
             return file_id
@@ -29,63 +48,337 @@ async def upload_file_to_gridfs(fs: AsyncIOMotorGridFSBucket, file_path: str, fi
         logger.error(f"Error uploading file {filename} to GridFS: {e}")
         raise # Re-raise the exception to be handled by the caller
 
+async def _with_retries(operation, description: str):
+    """
+    Runs `operation()` (a coroutine factory), retrying transient MongoDB errors up to
+    GRIDFS_UPLOAD_RETRIES times with exponential backoff.
+    """
+    attempts = max(1, settings.GRIDFS_UPLOAD_RETRIES + 1)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await operation()
+        except PyMongoError as e:
+            if attempt == attempts:
+                raise
+            delay = settings.GRIDFS_UPLOAD_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.warning(f"{description} failed (attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+# --- Content-addressed GridFS storage ---
+# Files stored this way carry metadata.sha256, metadata.refcount and metadata.owners (the IDs
+# of the study guides referencing them). An identical file that is already stored (e.g. the same
+# logo in another study guide) gets a reference instead of being uploaded again. Owners call
+# release_gridfs_file when they are deleted, and the file is removed once nothing references it.
+# A reference is taken and dropped only if the owner isn't/is listed, so retrying either after a
+# transient error (e.g. AutoReconnect once the server applied the write) can't count it twice.
+# Files stored before owners were recorded may have references not listed in metadata.owners.
+
+async def store_content_addressed_file(
+    db: AsyncIOMotorDatabase,
+    fs: AsyncIOMotorGridFSBucket,
+    file_path: str | None,
+    filename: str,
+    content_hash: str,
+    owner_id: ObjectId,
+    content_type: str | None = None,
+    data: bytes | None = None
+) -> ObjectId:
+    """
+    Returns the GridFS ID of a live file with this content hash referenced by `owner_id`,
+    uploading it only if none exists.
+    """
+    existing = await db[GRIDFS_FILES_COLLECTION].find_one_and_update(
+        {"metadata.sha256": content_hash, "metadata.refcount": {"$gt": 0}, "metadata.owners": {"$ne": owner_id}},
+        {"$inc": {"metadata.refcount": 1}, "$push": {"metadata.owners": owner_id}},
+        projection={"_id": 1}
+    )
+    if existing:
+        logger.info(f"Reusing GridFS file {existing['_id']} for {filename} (same content hash)")
+        return existing["_id"]
+    # A retry of a call whose reference (or upload) was applied before the error
+    referenced = await db[GRIDFS_FILES_COLLECTION].find_one(
+        {"metadata.sha256": content_hash, "metadata.refcount": {"$gt": 0}, "metadata.owners": owner_id}, {"_id": 1}
+    )
+    if referenced:
+        return referenced["_id"]
+    # Two concurrent uploads of a brand-new file may both get here; each copy is then
+    # reference-counted on its own, which wastes a little space but stays correct.
+    return await upload_file_to_gridfs(
+        fs=fs,
+        file_path=file_path,
+        filename=filename,
+        content_type=content_type,
+        metadata={"sha256": content_hash, "refcount": 1, "owners": [owner_id]},
+        data=data
+    )
+
+async def release_gridfs_file(db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, file_id: ObjectId, owner_id: ObjectId):
+    """
+    Drops `owner_id`'s reference to a GridFS file and deletes it when no references remain.
+    Files stored without a refcount (single owner) are deleted straight away.
+    """
+    document = await db[GRIDFS_FILES_COLLECTION].find_one_and_update(
+        {"_id": file_id, "$or": [
+            {"metadata.owners": owner_id},
+            # Or one of the references taken before owners were recorded
+            {"metadata.owners": {"$ne": owner_id}, "$expr": {"$gt": [
+                {"$ifNull": ["$metadata.refcount", 0]}, {"$size": {"$ifNull": ["$metadata.owners", []]}}
+            ]}},
+            {"metadata.refcount": {"$exists": False}},
+        ]},
+        {"$inc": {"metadata.refcount": -1}, "$pull": {"metadata.owners": owner_id}},
+        projection={"metadata.refcount": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if document is None:
+        return
+    if document.get("metadata", {}).get("refcount", 0) <= 0:
+        # A file at refcount 0 no longer matches the lookup in store_content_addressed_file,
+        # so nothing can take a new reference to it while it is being deleted
+        try:
+            await fs.delete(file_id)
+            file_cache.discard(str(file_id))
+            logger.info(f"Deleted unreferenced GridFS file {file_id}")
+        except NoFile:
+            pass
+        await delete_thumbnails(db, fs, file_id)
+
+# --- Thumbnails ---
+# Thumbnails are GridFS files with metadata.thumbnail_of (the original image's ID) and
+# metadata.thumbnail_size. They belong to the original, not to a study guide: content-addressed
+# images shared by several guides share their thumbnails, which are deleted with the original.
+
+def _thumbnail_from_document(document: dict) -> models.ImageThumbnail:
+    metadata = document["metadata"]
+    return models.ImageThumbnail(
+        size=metadata["thumbnail_size"],
+        gridfs_id=document["_id"],
+        width=metadata["width"],
+        height=metadata["height"]
+    )
+
+async def find_thumbnails(db: AsyncIOMotorDatabase, image_id: ObjectId) -> dict[int, models.ImageThumbnail]:
+    """Stored thumbnails of an image, by size."""
+    cursor = db[GRIDFS_FILES_COLLECTION].find({"metadata.thumbnail_of": image_id}, {"metadata": 1})
+    return {document["metadata"]["thumbnail_size"]: _thumbnail_from_document(document) async for document in cursor}
+
+async def store_thumbnails(
+    db: AsyncIOMotorDatabase,
+    fs: AsyncIOMotorGridFSBucket,
+    image_id: ObjectId,
+    data: bytes,
+    sizes: List[int] | None = None,
+    wait: bool = True
+) -> List[models.ImageThumbnail]:
+    """
+    Makes sure the image has a thumbnail for each of `sizes` (default: THUMBNAIL_SIZES) and
+    returns them. Missing ones are rendered in the process pool (`wait` as in process_pool.run)
+    and uploaded; existing ones, e.g. of a content-addressed image stored before, are reused.
+    """
+    sizes = sizes if sizes is not None else settings.THUMBNAIL_SIZES
+    thumbnails = await find_thumbnails(db, image_id)
+    missing = [size for size in sizes if size not in thumbnails]
+    if missing:
+        image_format = settings.THUMBNAIL_FORMAT.upper()
+        rendered = await process_pool.run(
+            render_thumbnails, data, missing, image_format, settings.THUMBNAIL_QUALITY, wait=wait
+        )
+        for size, mime_type, thumbnail_data, width, height in rendered:
+            metadata = {
+                "thumbnail_of": image_id,
+                "thumbnail_size": size,
+                "width": width,
+                "height": height,
+                "sha256": hashlib.sha256(thumbnail_data).hexdigest(),
+            }
+            # Concurrent requests for a new size may both upload one; delete_thumbnails removes all copies
+            thumbnail_id = await _with_retries(
+                lambda: upload_file_to_gridfs(
+                    fs=fs,
+                    file_path=None,
+                    filename=f"{image_id}_{size}.{image_format.lower()}",
+                    content_type=mime_type,
+                    metadata=metadata,
+                    data=thumbnail_data
+                ),
+                f"Uploading {size}px thumbnail of {image_id}"
+            )
+            thumbnails[size] = models.ImageThumbnail(size=size, gridfs_id=thumbnail_id, width=width, height=height)
+    return [thumbnails[size] for size in sorted(thumbnails)]
+
+async def get_or_create_thumbnail(db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, image_id: ObjectId, size: int) -> models.ImageThumbnail:
+    """
+    Returns the image's thumbnail of `size`, rendering it on first request. A new thumbnail is
+    also linked from every study guide image record pointing at the original.
+    Raises NoFile if the image does not exist.
+    """
+    thumbnails = await find_thumbnails(db, image_id)
+    if size in thumbnails:
+        return thumbnails[size]
+    grid_out = await fs.open_download_stream(image_id)
+    data = await grid_out.read()
+    thumbnail = next(t for t in await store_thumbnails(db, fs, image_id, data, [size], wait=False) if t.size == size)
+    await db[STUDY_GUIDE_COLLECTION].update_many(
+        {"extracted_images.gridfs_id": image_id},
+        {"$push": {"extracted_images.$[img].thumbnails": thumbnail.model_dump()}},
+        array_filters=[{"img.gridfs_id": image_id, "img.thumbnails.size": {"$ne": size}}]
+    )
+    return thumbnail
+
+async def delete_thumbnails(db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, image_id: ObjectId):
+    cursor = db[GRIDFS_FILES_COLLECTION].find({"metadata.thumbnail_of": image_id}, {"metadata.thumbnail_size": 1})
+    async for document in cursor:
+        try:
+            await fs.delete(document["_id"])
+        except NoFile:
+            pass
+        file_cache.discard(str(document["_id"]))
+        file_cache.discard(thumbnail_cache_key(image_id, document["metadata"]["thumbnail_size"]))
+
 # --- Study Guide CRUD ---
 async def create_study_guide(
     db: AsyncIOMotorDatabase,
     fs: AsyncIOMotorGridFSBucket, # Add GridFS bucket dependency
     study_guide_data: models.StudyGuideResponse,
-    original_pdf_path: str, # Path to the temporary original PDF
-    image_paths: List[str] # List of paths to temporary extracted images
+    original_pdf_path: str | None, # Path to the temporary original PDF
+    image_paths: List[str], # List of paths to temporary extracted images
+    original_gridfs_id: ObjectId | None = None, # Set when the original is already staged in GridFS
+    image_buffers: dict[str, bytes] | None = None, # filename -> bytes for images already in memory
+    original_data: bytes | None = None # Original document bytes, if already in memory
 ) -> models.StudyGuideResponse:
     """
     Uploads associated files (PDF, images) to GridFS and inserts the
     study guide metadata document into the database.
+    Uploads run concurrently (at most GRIDFS_UPLOAD_CONCURRENCY at a time) and transient
+    errors are retried. Images that still fail are listed in `failed_image_uploads`
+    instead of failing the whole study guide; a failed original upload does fail it.
     """
     try:
-        # 1. Upload original PDF to GridFS
-        pdf_gridfs_id = await upload_file_to_gridfs(
-            fs=fs,
-            file_path=original_pdf_path,
-            filename=study_guide_data.original_filename,
-            content_type="application/pdf" # Assuming PDF
-        )
-        study_guide_data.original_pdf_gridfs_id = pdf_gridfs_id
+        semaphore = asyncio.Semaphore(max(1, settings.GRIDFS_UPLOAD_CONCURRENCY))
+        # Assigned up front: the guide owns its content-addressed images by this ID
+        study_guide_id = study_guide_data.id or ObjectId()
 
-        # 2. Upload extracted images to GridFS and update the model list
+        # 1. Upload original PDF to GridFS (skipped if the job queue already staged it there)
+        async def upload_original() -> ObjectId:
+            if original_gridfs_id is not None:
+                return original_gridfs_id
+            async with semaphore:
+                return await _with_retries(
+                    lambda: upload_file_to_gridfs(
+                        fs=fs,
+                        file_path=original_pdf_path,
+                        filename=study_guide_data.original_filename,
+                        content_type="application/pdf", # Assuming PDF
+                        data=original_data
+                    ),
+                    f"Uploading {study_guide_data.original_filename}"
+                )
+
+        # 2. Store extracted images in GridFS (content-addressed), one upload per distinct content
         image_map = {os.path.basename(p): p for p in image_paths} # Map filename to full path
+        buffers = dict(image_buffers or {})
+        images_by_hash: dict[str, List[models.ExtractedImageInfo]] = {}
         for img_info in study_guide_data.extracted_images:
-            if img_info.filename in image_map:
-                try:
-                    img_gridfs_id = await upload_file_to_gridfs(
+            if img_info.filename in buffers or img_info.filename in image_map:
+                if img_info.filename not in buffers:
+                    # Read each temp file once; the bytes are used for both hashing and upload
+                    buffers[img_info.filename] = await asyncio.to_thread(_read_file, image_map[img_info.filename])
+                content_hash = img_info.content_hash or hashlib.sha256(buffers[img_info.filename]).hexdigest()
+                img_info.content_hash = content_hash
+                images_by_hash.setdefault(content_hash, []).append(img_info)
+            elif img_info.filter_reason is None:
+                 logger.warning(f"Image path not found for {img_info.filename} during GridFS upload.")
+
+        async def store_image(content_hash: str, img_info: models.ExtractedImageInfo) -> ObjectId:
+            async with semaphore:
+                return await _with_retries(
+                    lambda: store_content_addressed_file(
+                        db=db,
                         fs=fs,
-                        file_path=image_map[img_info.filename],
-                        filename=img_info.filename
-                        # content_type could be inferred or passed if available
-                    )
-                    img_info.gridfs_id = img_gridfs_id
-                except Exception as img_upload_err:
-                    # Log error but potentially continue? Or fail the whole operation?
-                    # For now, log and skip associating the ID for this image.
-                    logger.error(f"Failed to upload image {img_info.filename} to GridFS: {img_upload_err}")
+                        file_path=None,
+                        filename=img_info.filename,
+                        content_hash=content_hash,
+                        owner_id=study_guide_id,
+                        data=buffers[img_info.filename]
+                    ),
+                    f"Uploading image {img_info.filename}"
+                )
+
+        # One reference per guide per distinct content: the first image with a hash is stored
+        hashes = list(images_by_hash)
+        results = await asyncio.gather(
+            upload_original(),
+            *(store_image(content_hash, images_by_hash[content_hash][0]) for content_hash in hashes),
+            return_exceptions=True
+        )
+        original_result, image_results = results[0], results[1:]
+        if isinstance(original_result, BaseException):
+            # Don't leave this guide's images referenced with nothing pointing at them
+            for image_result in image_results:
+                if not isinstance(image_result, BaseException):
+                    await release_gridfs_file(db, fs, image_result, study_guide_id)
+            raise original_result
+        study_guide_data.original_pdf_gridfs_id = original_result
+
+        gridfs_ids_by_hash: dict[str, ObjectId] = {}
+        failed_uploads: List[str] = []
+        for content_hash, image_result in zip(hashes, image_results):
+            if isinstance(image_result, BaseException):
+                filenames = [img_info.filename for img_info in images_by_hash[content_hash]]
+                logger.error(f"Failed to upload image {filenames[0]} to GridFS: {image_result}")
+                failed_uploads.extend(filenames)
             else:
-                 logger.warning(f"Image path not found for {img_info.filename} during GridFS upload.")
+                gridfs_ids_by_hash[content_hash] = image_result
+        study_guide_data.failed_image_uploads = failed_uploads
 
+        # Duplicates (in this upload, or dropped as duplicates during extraction) point at the stored copy
+        for img_info in study_guide_data.extracted_images:
+            if img_info.gridfs_id is None and img_info.content_hash in gridfs_ids_by_hash:
+                img_info.gridfs_id = gridfs_ids_by_hash[img_info.content_hash]
+
+        # Thumbnails; an image without them is still usable, they are then rendered on first request
+        if settings.THUMBNAIL_ON_INGEST and settings.THUMBNAIL_SIZES:
+            stored_hashes = list(gridfs_ids_by_hash)
+            thumbnail_results = await asyncio.gather(*(
+                store_thumbnails(db, fs, gridfs_ids_by_hash[content_hash], buffers[images_by_hash[content_hash][0].filename])
+                for content_hash in stored_hashes
+            ), return_exceptions=True)
+            for content_hash, thumbnail_result in zip(stored_hashes, thumbnail_results):
+                if isinstance(thumbnail_result, BaseException):
+                    logger.warning(f"Could not create thumbnails for image {gridfs_ids_by_hash[content_hash]}: {thumbnail_result}")
+                    continue
+                for img_info in study_guide_data.extracted_images:
+                    if img_info.gridfs_id == gridfs_ids_by_hash[content_hash]:
+                        img_info.thumbnails = thumbnail_result
+        if failed_uploads:
+            logger.warning(f"{len(failed_uploads)} images of {study_guide_data.original_filename} could not be stored: {failed_uploads}")
 
         # 3. Convert Pydantic model (now with GridFS IDs) to dict for DB insertion
         study_guide_dict = study_guide_data.model_dump(by_alias=True, exclude_unset=True)
 
-        # Remove the 'id' field if it's None before insertion, MongoDB will generate it
-        if "_id" in study_guide_dict and study_guide_dict["_id"] is None:
-            del study_guide_dict["_id"]
+        study_guide_dict["_id"] = study_guide_id
+
+        sections = []
+        if settings.STUDY_GUIDE_STORAGE_LAYOUT == SECTIONS_LAYOUT:
+            # Sections go to their own collection; the guide document stays small whatever the book's length
+            sections = study_guide_dict.pop("study_guide", [])
+            study_guide_dict["study_guide"] = []
+            study_guide_dict["storage_layout"] = SECTIONS_LAYOUT
 
         logger.info(f"Inserting study guide for: {study_guide_data.original_filename}")
         result = await db[STUDY_GUIDE_COLLECTION].insert_one(study_guide_dict)
+        if sections:
+            await db[STUDY_GUIDE_SECTIONS_COLLECTION].insert_many([
+                _section_document(result.inserted_id, index, section) for index, section in enumerate(sections)
+            ])
 
         # Fetch the newly created document to include the generated _id
         created_document = await db[STUDY_GUIDE_COLLECTION].find_one({"_id": result.inserted_id})
 
         if created_document:
             logger.info(f"Successfully inserted study guide with ID: {result.inserted_id}")
+            if sections:
+                created_document["study_guide"] = sections
             # Convert the retrieved dict back to the Pydantic model for type consistency
             # Use model_validate for Pydantic v2
             return models.StudyGuideResponse.model_validate(created_document)
@@ -99,12 +392,114 @@ async def create_study_guide(
         # Re-raise the exception or handle it as appropriate for the application
         raise
 
+async def save_study_guide_section(
+    db: AsyncIOMotorDatabase,
+    study_guide_id: ObjectId,
+    index: int,
+    section: models.StudyGuideSection,
+    storage_layout: str | None = None
+):
+    """
+    Persists one streamed section: appended when `index` is new, replaced in place when a
+    section was extended (e.g. merged across a chunk boundary).
+    `storage_layout` is the guide's (StudyGuideResponse.storage_layout).
+    """
+    if storage_layout == SECTIONS_LAYOUT:
+        await db[STUDY_GUIDE_SECTIONS_COLLECTION].replace_one(
+            {"study_guide_id": study_guide_id, "index": index},
+            _section_document(study_guide_id, index, section.model_dump()),
+            upsert=True
+        )
+        return
+    section_dict = section.model_dump()
+    result = await db[STUDY_GUIDE_COLLECTION].update_one(
+        {"_id": study_guide_id, f"study_guide.{index}": {"$exists": True}},
+        {"$set": {f"study_guide.{index}": section_dict}}
+    )
+    if result.matched_count == 0:
+        await db[STUDY_GUIDE_COLLECTION].update_one(
+            {"_id": study_guide_id},
+            {"$push": {"study_guide": section_dict}}
+        )
+
+async def set_study_guide_generation_status(db: AsyncIOMotorDatabase, study_guide_id: ObjectId, status: str):
+    await db[STUDY_GUIDE_COLLECTION].update_one(
+        {"_id": study_guide_id},
+        {"$set": {"generation_status": status}}
+    )
+
+# --- Section-level storage ---
+# With STUDY_GUIDE_STORAGE_LAYOUT = "sections", new guides keep their sections in
+# STUDY_GUIDE_SECTIONS_COLLECTION (one document per section, ordered by `index`) and the guide
+# document has storage_layout = "sections" and an empty study_guide list. Guides of both layouts
+# are read through the functions below, so the layout can be switched without a migration.
+
+EMBEDDED_LAYOUT = "embedded"
+SECTIONS_LAYOUT = "sections"
+# Fields of a section needed for a table of contents
+TOC_FIELDS = ("section_id", "section_title", "section_overview_description", "subsection_titles")
+
+def _section_document(study_guide_id: ObjectId, index: int, section: dict) -> dict:
+    return {"study_guide_id": study_guide_id, "index": index, **section}
+
+async def attach_sections(db: AsyncIOMotorDatabase, document: dict) -> dict:
+    """Fills `study_guide` of a guide stored with the sections layout (no-op for embedded guides)."""
+    if document.get("storage_layout") == SECTIONS_LAYOUT:
+        cursor = db[STUDY_GUIDE_SECTIONS_COLLECTION].find(
+            {"study_guide_id": document["_id"]}, {"_id": 0, "study_guide_id": 0, "index": 0}
+        ).sort("index", 1)
+        document["study_guide"] = await cursor.to_list(None)
+    return document
+
+async def get_workspace_study_guide_document(db: AsyncIOMotorDatabase, workspace_id: ObjectId, study_guide_id: ObjectId) -> dict | None:
+    """The full study guide document (sections attached), if it belongs to the workspace."""
+    document = await db[STUDY_GUIDE_COLLECTION].find_one({"_id": study_guide_id, "workspace_id": workspace_id})
+    return await attach_sections(db, document) if document else None
+
+async def get_study_guide_toc(db: AsyncIOMotorDatabase, workspace_id: ObjectId, study_guide_id: ObjectId) -> models.StudyGuideToc | None:
+    """Section titles, overviews and subsection titles, without subsection content."""
+    projection = {"original_filename": 1, "generation_status": 1, "storage_layout": 1}
+    projection.update({f"study_guide.{field}": 1 for field in TOC_FIELDS})
+    document = await db[STUDY_GUIDE_COLLECTION].find_one({"_id": study_guide_id, "workspace_id": workspace_id}, projection)
+    if document is None:
+        return None
+    sections = document.pop("study_guide", [])
+    if document.get("storage_layout") == SECTIONS_LAYOUT:
+        cursor = db[STUDY_GUIDE_SECTIONS_COLLECTION].find(
+            {"study_guide_id": study_guide_id}, {"_id": 0, **{field: 1 for field in TOC_FIELDS}}
+        ).sort("index", 1)
+        sections = await cursor.to_list(None)
+    return models.StudyGuideToc.model_validate({**document, "sections": sections})
+
+async def get_study_guide_section(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    study_guide_id: ObjectId,
+    section_id: str
+) -> models.StudyGuideSection | None:
+    """One section with its subsections, from either layout."""
+    # $elemMatch projection: of an embedded guide, only the matching section is returned
+    document = await db[STUDY_GUIDE_COLLECTION].find_one(
+        {"_id": study_guide_id, "workspace_id": workspace_id},
+        {"storage_layout": 1, "study_guide": {"$elemMatch": {"section_id": section_id}}}
+    )
+    if document is None:
+        return None
+    if document.get("storage_layout") == SECTIONS_LAYOUT:
+        section = await db[STUDY_GUIDE_SECTIONS_COLLECTION].find_one(
+            {"study_guide_id": study_guide_id, "section_id": section_id}, {"_id": 0, "study_guide_id": 0, "index": 0}
+        )
+    else:
+        section = (document.get("study_guide") or [None])[0]
+    return models.StudyGuideSection.model_validate(section) if section else None
+
 async def get_study_guide(db: AsyncIOMotorDatabase, study_guide_id: str) -> models.StudyGuideResponse | None:
     """Fetches a study guide document by its MongoDB _id."""
     try:
         oid = ObjectId(study_guide_id)
         document = await db[STUDY_GUIDE_COLLECTION].find_one({"_id": oid})
         if document:
+            await attach_sections(db, document)
             logger.info(f"Retrieved study guide with ID: {study_guide_id}")
             return models.StudyGuideResponse.model_validate(document)
         else:
@@ -115,6 +510,37 @@ async def get_study_guide(db: AsyncIOMotorDatabase, study_guide_id: str) -> mode
         # Depending on desired behavior, could raise HTTPException here or return None
         return None
 
+async def delete_study_guide(db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, study_guide_id: ObjectId) -> bool:
+    """
+    Deletes a study guide, releases its GridFS files (original document and images)
+    and removes it from its workspace. Returns False if it did not exist.
+    """
+    document = await db[STUDY_GUIDE_COLLECTION].find_one_and_delete({"_id": study_guide_id})
+    if document is None:
+        return False
+    if document.get("storage_layout") == SECTIONS_LAYOUT:
+        await db[STUDY_GUIDE_SECTIONS_COLLECTION].delete_many({"study_guide_id": study_guide_id})
+
+    file_ids = set()
+    if document.get("original_pdf_gridfs_id"):
+        file_ids.add(document["original_pdf_gridfs_id"])
+    for img in document.get("extracted_images", []):
+        # Duplicates share the kept image's ID; the guide holds a single reference to it
+        if img.get("gridfs_id"):
+            file_ids.add(img["gridfs_id"])
+    for file_id in file_ids:
+        try:
+            await release_gridfs_file(db, fs, file_id, study_guide_id)
+        except Exception as e:
+            logger.error(f"Failed to release GridFS file {file_id} of study guide {study_guide_id}: {e}")
+
+    await db["workspaces"].update_one(
+        {"_id": document["workspace_id"]},
+        {"$pull": {"study_guides": study_guide_id}}
+    )
+    logger.info(f"Deleted study guide {study_guide_id} and released {len(file_ids)} GridFS files")
+    return True
+
 async def get_study_guides_for_workspace(db: AsyncIOMotorDatabase, workspace_id: str) -> List[models.StudyGuideResponse]:
     """Fetches all study guide documents associated with a specific workspace_id."""
     study_guides = []
@@ -122,6 +548,7 @@ async def get_study_guides_for_workspace(db: AsyncIOMotorDatabase, workspace_id:
         oid = ObjectId(workspace_id)
         cursor = db[STUDY_GUIDE_COLLECTION].find({"workspace_id": oid})
         async for document in cursor:
+            await attach_sections(db, document)
             study_guides.append(models.StudyGuideResponse.model_validate(document))
         logger.info(f"Retrieved {len(study_guides)} study guides for workspace ID: {workspace_id}")
     except Exception as e:
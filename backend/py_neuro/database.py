@@ -1,6 +1,8 @@
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
 from .config import settings # Import the settings instance
+from .indexes import ensure_indexes, assert_no_collection_scans
+from .migrations import run_migrations
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +29,10 @@ async def connect_to_mongo():
         db_instance.fs = AsyncIOMotorGridFSBucket(db_instance.db) # Initialize GridFS bucket
         # You can add a check here to verify the connection, e.g., by pinging the server
         await db_instance.client.admin.command('ping')
+        await run_migrations(db_instance.db)
+        await ensure_indexes(db_instance.db)
+        if settings.MONGO_CHECK_QUERY_PLANS:
+            await assert_no_collection_scans(db_instance.db)
         logger.info(f"Successfully connected to MongoDB database: {settings.DATABASE_NAME} and initialized GridFS.")
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB or initialize GridFS: {e}")
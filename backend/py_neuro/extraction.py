@@ -0,0 +1,269 @@
+# Text and image extraction from uploaded documents (PDF, PPTX, DOCX, TXT) and the size
+# pre-filter for extracted images, run by the pipeline stages (mostly in the process pool)
+import io
+import os
+import logging
+import math
+import hashlib
+from typing import List
+
+from fastapi import HTTPException
+import fitz  # PyMuPDF
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from docx import Document
+from PIL import Image, UnidentifiedImageError
+
+from . import models
+from . import config
+
+logger = logging.getLogger(__name__)
+
+TEMP_UPLOAD_DIR = "temp_uploads"
+IMAGE_OUTPUT_DIR_BASE = os.path.join(TEMP_UPLOAD_DIR, "images")
+MIN_IMAGE_WIDTH = 50  # Pixels - adjust as needed for pre-filtering
+MIN_IMAGE_HEIGHT = 50 # Pixels - adjust as needed for pre-filtering
+# Separates pages (PDF) and slides (PPTX) in extracted text, so long documents can be chunked on page boundaries
+PAGE_BREAK = "\f"
+
+# A document to extract: a path on disk, or its bytes when the upload was kept in memory
+DocumentSource = str | bytes
+
+def describe_source(source: DocumentSource) -> str:
+    """Label for log messages."""
+    return source if isinstance(source, str) else f"<{len(source)} bytes in memory>"
+
+def open_pdf(source: DocumentSource) -> fitz.Document:
+    """Opens a PDF from a path or straight from memory (no temp file needed)."""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def _as_file(source: DocumentSource):
+    """python-pptx/python-docx accept a path or a file-like object."""
+    return source if isinstance(source, str) else io.BytesIO(source)
+
+def get_pdf_page_count(source: DocumentSource) -> int:
+    """Returns the number of pages of a PDF (used to plan sharded extraction)."""
+    with open_pdf(source) as doc:
+        return doc.page_count
+
+def hash_image_bytes(image_bytes: bytes) -> str:
+    """Content hash used to deduplicate images within a document and in GridFS."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def extract_pdf_page_range(source: DocumentSource, request_image_dir: str, start_page: int, end_page: int) -> List[tuple[str, List[tuple[str, str | None, str | None]]]]:
+    """
+    Extracts pages [start_page, end_page) of a PDF. Opens the document itself so that
+    several ranges can run in separate worker processes.
+    Returns one (page_text, [(temp_image_filename, filter_reason, content_hash), ...]) entry per page.
+    Images are pre-filtered in memory and only those that pass are saved, under page-local
+    temp names; `merge_pdf_pages` gives them their final names.
+    An image object (xref) that appears on several pages is extracted once; later
+    occurrences, and different objects with identical bytes, are marked "duplicate".
+    """
+    pages = []
+    xref_results: dict[int, tuple[str | None, str, str]] = {} # xref -> (filter_reason, content_hash, ext) of first occurrence
+    kept_hashes: set[str] = set()
+    doc = open_pdf(source)
+    try:
+        for page_num in range(start_page, end_page):
+            page = doc[page_num]
+            page_images: List[tuple[str, str | None, str | None]] = []
+            for img_index, img in enumerate(page.get_images(full=True)):
+                xref = img[0]
+                if xref in xref_results:
+                    filter_reason, content_hash, image_ext = xref_results[xref]
+                    temp_filename = f"page_{page_num + 1}_{img_index}.{image_ext}"
+                    page_images.append((temp_filename, filter_reason or "duplicate", content_hash))
+                    continue
+                try:
+                    base_image = doc.extract_image(xref)
+                    image_bytes = base_image["image"]
+                    image_ext = base_image["ext"]
+                    temp_filename = f"page_{page_num + 1}_{img_index}.{image_ext}"
+                    content_hash = hash_image_bytes(image_bytes)
+
+                    # PyMuPDF already reports the pixel size, so no probing is needed
+                    filter_reason = pre_filter_image_size(base_image.get("width"), base_image.get("height"), temp_filename)
+                    xref_results[xref] = (filter_reason, content_hash, image_ext)
+                    if filter_reason is None and content_hash in kept_hashes:
+                        filter_reason = "duplicate"
+                    if filter_reason is None:
+                        kept_hashes.add(content_hash)
+                        with open(os.path.join(request_image_dir, temp_filename), "wb") as img_file:
+                            img_file.write(image_bytes)
+                    page_images.append((temp_filename, filter_reason, content_hash))
+                except Exception as img_extract_err:
+                    logger.warning(f"Could not extract image ref {xref} on page {page_num+1}: {img_extract_err}")
+            pages.append((page.get_text(), page_images))
+    finally:
+        doc.close()
+    return pages
+
+def merge_pdf_pages(pages: List[tuple[str, List[tuple[str, str | None, str | None]]]], request_image_dir: str) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """
+    Merges per-page results (in page order) into the document text and image lists.
+    Images are renamed to `img_{page}_{n}` with a document-wide counter, so the names are
+    the same whether the document was extracted in one pass or in shards.
+    Images repeated across shards are deduplicated here by content hash.
+    """
+    text_parts: List[str] = []
+    all_images_info: List[models.ExtractedImageInfo] = []
+    filtered_images_info: List[models.ExtractedImageInfo] = []
+    kept_hashes: set[str] = set()
+    img_counter = 0
+    for page_index, (page_text, page_images) in enumerate(pages):
+        page_number = page_index + 1
+        text_parts.append(page_text)
+        text_parts.append(PAGE_BREAK)
+        for temp_filename, filter_reason, content_hash in page_images:
+            image_ext = temp_filename.rsplit(".", 1)[-1]
+            image_filename = f"img_{page_number}_{img_counter}.{image_ext}"
+            temp_path = os.path.join(request_image_dir, temp_filename)
+            if filter_reason is None and content_hash in kept_hashes:
+                # Same image was kept by an earlier shard
+                filter_reason = "duplicate"
+                try: os.remove(temp_path)
+                except OSError: pass
+            image_info = models.ExtractedImageInfo(
+                filename=image_filename,
+                page_number=page_number,
+                filter_reason=filter_reason,
+                content_hash=content_hash
+            )
+            all_images_info.append(image_info) # Add to all list first
+            if filter_reason is None:
+                kept_hashes.add(content_hash)
+                os.replace(temp_path, os.path.join(request_image_dir, image_filename))
+                filtered_images_info.append(image_info) # Add to filtered list if it passes
+            img_counter += 1
+    return "".join(text_parts), all_images_info, filtered_images_info
+
+def plan_pdf_shards(page_count: int, max_shards: int) -> List[tuple[int, int]]:
+    """
+    Splits [0, page_count) into contiguous page ranges for parallel extraction.
+    Small documents get a single range; sharding only pays off past PDF_SHARD_MIN_PAGES.
+    """
+    shard_settings = config.settings
+    if page_count < shard_settings.PDF_SHARD_MIN_PAGES or max_shards <= 1:
+        return [(0, page_count)]
+    shard_count = min(max_shards, math.ceil(page_count / shard_settings.PDF_SHARD_MIN_PAGES_PER_SHARD))
+    pages_per_shard = math.ceil(page_count / shard_count)
+    return [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+
+def extract_text_and_images_pdf(source: DocumentSource, request_image_dir: str) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """Extracts text and images from PDF, performs basic image filtering."""
+    try:
+        page_count = get_pdf_page_count(source)
+        pages = extract_pdf_page_range(source, request_image_dir, 0, page_count)
+        text, all_images_info, filtered_images_info = merge_pdf_pages(pages, request_image_dir)
+        logger.info(f"Extracted text, found {len(all_images_info)} total images, kept {len(filtered_images_info)} after filtering from PDF: {describe_source(source)}")
+        return text, all_images_info, filtered_images_info
+    except Exception as e:
+        logger.error(f"Error extracting data from PDF {describe_source(source)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF file: {e}")
+
+def extract_text_and_images_pptx(source: DocumentSource, request_image_dir: str) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """Extracts text and images from PPTX, performs basic image filtering."""
+    text_parts: List[str] = []
+    all_images_info: List[models.ExtractedImageInfo] = []
+    filtered_images_info: List[models.ExtractedImageInfo] = []
+    kept_hashes: set[str] = set()
+    try:
+        prs = Presentation(_as_file(source))
+        img_counter = 0
+        for slide_num, slide in enumerate(prs.slides):
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    text_parts.append(shape.text)
+                    text_parts.append("\n")
+                if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
+                    try:
+                        image = shape.image
+                        image_bytes = image.blob
+                        image_ext = image.ext.lower()
+                        image_filename = f"img_slide_{slide_num + 1}_{img_counter}.{image_ext}"
+                        content_hash = hash_image_bytes(image_bytes)
+
+                        # Filter on the in-memory blob; only images that pass are written to disk
+                        if content_hash in kept_hashes:
+                            filter_reason = "duplicate" # Same logo/diagram repeated on several slides
+                        else:
+                            filter_reason = pre_filter_image_bytes(image_bytes, image_filename)
+                        image_info = models.ExtractedImageInfo(
+                            filename=image_filename,
+                            page_number=slide_num + 1,
+                            filter_reason=filter_reason,
+                            content_hash=content_hash
+                        )
+                        all_images_info.append(image_info)
+
+                        if filter_reason is None:
+                            kept_hashes.add(content_hash)
+                            with open(os.path.join(request_image_dir, image_filename), "wb") as img_file:
+                                img_file.write(image_bytes)
+                            filtered_images_info.append(image_info)
+                        img_counter += 1
+                    except Exception as img_extract_err:
+                        logger.warning(f"Could not extract image shape on slide {slide_num+1}: {img_extract_err}")
+            text_parts.append(PAGE_BREAK)
+
+        logger.info(f"Extracted text, found {len(all_images_info)} total images, kept {len(filtered_images_info)} after filtering from PPTX: {describe_source(source)}")
+        return "".join(text_parts), all_images_info, filtered_images_info
+    except Exception as e:
+        logger.error(f"Error extracting data from PPTX {describe_source(source)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process PPTX file: {e}")
+
+def extract_text_docx(source: DocumentSource) -> str:
+    """Extracts text from a DOCX file. Image extraction is complex and omitted for now."""
+    try:
+        doc = Document(_as_file(source))
+        text = "\n".join([para.text for para in doc.paragraphs])
+        logger.info(f"Extracted text from DOCX: {describe_source(source)}. Image extraction skipped.")
+        return text
+    except Exception as e:
+        logger.error(f"Error extracting text from DOCX {describe_source(source)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process DOCX file: {e}")
+
+def extract_text_txt(source: DocumentSource) -> str:
+    """Extracts text from a TXT file."""
+    try:
+        if isinstance(source, bytes):
+            text = source.decode('utf-8', errors='ignore')
+        else:
+            with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+        logger.info(f"Extracted text from TXT: {describe_source(source)}")
+        return text
+    except Exception as e:
+        logger.error(f"Error extracting text from TXT {describe_source(source)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process TXT file: {e}")
+
+def probe_image_size(image_bytes: bytes) -> tuple[int, int] | None:
+    """
+    Reads an image's pixel size from its header. PIL's open() is lazy, so this parses
+    only the header and never decodes the pixel data. Returns None if unreadable.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+def pre_filter_image_size(width: int | None, height: int | None, label: str) -> str | None:
+    """Basic pre-filtering based on dimensions. Returns the reason to drop the image, or None to keep it."""
+    if width is None or height is None:
+        logger.warning(f"Cannot identify image file, filtering out: {label}")
+        return "unreadable"
+    if width < MIN_IMAGE_WIDTH or height < MIN_IMAGE_HEIGHT:
+        logger.info(f"Filtering out image (too small): {label}")
+        return "too_small"
+    return None
+
+def pre_filter_image_bytes(image_bytes: bytes, label: str) -> str | None:
+    """Pre-filters an in-memory image (header-only size probe). Returns the drop reason, or None to keep it."""
+    size = probe_image_size(image_bytes)
+    if size is None:
+        return pre_filter_image_size(None, None, label)
+    return pre_filter_image_size(size[0], size[1], label)
@@ -0,0 +1,177 @@
+# Tiered cache of GridFS files for /api/files/gridfs/{file_id}.
+# GridFS files are immutable (new content gets a new _id), so entries never need invalidation;
+# they only leave the cache through LRU eviction or when the file is deleted.
+import os
+import json
+import uuid
+import logging
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .config import settings
+from .metrics import counters
+
+logger = logging.getLogger(__name__)
+
+def thumbnail_cache_key(image_id, size: int) -> str:
+    """Thumbnails are cached under the original's ID and size, so a hit needs no thumbnail lookup."""
+    return f"{image_id}@{size}"
+
+class CachedFile(NamedTuple):
+    length: int
+    etag: str
+    media_type: str
+    data: bytes | None = None # Memory tier
+    path: str | None = None # Disk tier
+
+class GridFSFileCache:
+    """
+    Memory tier: files up to FILE_CACHE_MEMORY_MAX_FILE_KB, within FILE_CACHE_MEMORY_MB in total.
+    Disk tier (when FILE_CACHE_DIR is set): larger files up to FILE_CACHE_DISK_MAX_FILE_MB,
+    within FILE_CACHE_DISK_MB in total. Both tiers evict least recently used entries first.
+    """
+    def __init__(self):
+        self._memory: OrderedDict[str, CachedFile] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, CachedFile] | None = None # Loaded lazily from FILE_CACHE_DIR
+        self._disk_bytes = 0
+
+    # --- Sizing ---
+
+    def fits_memory(self, length: int) -> bool:
+        return settings.FILE_CACHE_MEMORY_MB > 0 and length <= settings.FILE_CACHE_MEMORY_MAX_FILE_KB * 1024
+
+    def fits_disk(self, length: int) -> bool:
+        return bool(settings.FILE_CACHE_DIR) and length <= settings.FILE_CACHE_DISK_MAX_FILE_MB * 1024 * 1024
+
+    # --- Lookup ---
+
+    def get(self, file_id: str) -> CachedFile | None:
+        entry = self._memory.get(file_id)
+        if entry is not None:
+            self._memory.move_to_end(file_id)
+            counters.increment("file_cache.memory_hits")
+            return entry
+        disk = self._disk_index()
+        entry = disk.get(file_id) if disk is not None else None
+        if entry is not None:
+            if os.path.exists(entry.path):
+                disk.move_to_end(file_id)
+                counters.increment("file_cache.disk_hits")
+                return entry
+            self._drop_disk_entry(file_id) # Removed behind our back
+        counters.increment("file_cache.misses")
+        return None
+
+    def record_served(self, nbytes: int, from_cache: bool):
+        counters.increment("file_cache.bytes_from_cache" if from_cache else "file_cache.bytes_from_gridfs", nbytes)
+
+    # --- Memory tier ---
+
+    def put_memory(self, file_id: str, data: bytes, etag: str, media_type: str):
+        if not self.fits_memory(len(data)):
+            return
+        budget = settings.FILE_CACHE_MEMORY_MB * 1024 * 1024
+        previous = self._memory.pop(file_id, None)
+        if previous is not None:
+            self._memory_bytes -= previous.length
+        self._memory[file_id] = CachedFile(len(data), etag, media_type, data=data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > budget and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.length
+
+    # --- Disk tier ---
+
+    def _disk_index(self) -> OrderedDict[str, CachedFile] | None:
+        """Index of the cache directory, rebuilt from the sidecar .json files on first use."""
+        if not settings.FILE_CACHE_DIR:
+            return None
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_bytes = 0
+            os.makedirs(settings.FILE_CACHE_DIR, exist_ok=True)
+            entries = []
+            for name in os.listdir(settings.FILE_CACHE_DIR):
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(settings.FILE_CACHE_DIR, name)
+                data_path = meta_path[:-len(".json")]
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    entries.append((os.path.getmtime(data_path), name[:-len(".json")], meta, data_path))
+                except (OSError, ValueError):
+                    continue
+            for _, file_id, meta, data_path in sorted(entries): # Oldest first = least recently used
+                self._disk[file_id] = CachedFile(meta["length"], meta["etag"], meta["media_type"], path=data_path)
+                self._disk_bytes += meta["length"]
+        return self._disk
+
+    def disk_temp_path(self, file_id: str) -> str:
+        """
+        Where a file is written while it is being downloaded; `commit_disk` moves it into place.
+        Unique per download: concurrent first downloads of the same file each fill their own copy.
+        """
+        self._disk_index()
+        return os.path.join(settings.FILE_CACHE_DIR, f"{file_id}.part-{uuid.uuid4().hex}")
+
+    def commit_disk(self, file_id: str, temp_path: str, length: int, etag: str, media_type: str):
+        disk = self._disk_index()
+        if disk is None:
+            return
+        data_path = os.path.join(settings.FILE_CACHE_DIR, file_id)
+        try:
+            with open(f"{data_path}.json", "w") as f:
+                json.dump({"length": length, "etag": etag, "media_type": media_type}, f)
+            os.replace(temp_path, data_path)
+        except OSError as e:
+            logger.warning(f"Could not add GridFS file {file_id} to the disk cache: {e}")
+            self.discard_temp(temp_path)
+            return
+        if file_id in disk:
+            self._disk_bytes -= disk.pop(file_id).length
+        disk[file_id] = CachedFile(length, etag, media_type, path=data_path)
+        self._disk_bytes += length
+        budget = settings.FILE_CACHE_DISK_MB * 1024 * 1024
+        while self._disk_bytes > budget and disk:
+            self._drop_disk_entry(next(iter(disk)))
+
+    def discard_temp(self, temp_path: str):
+        try: os.remove(temp_path)
+        except OSError: pass
+
+    def _drop_disk_entry(self, file_id: str):
+        entry = self._disk.pop(file_id, None)
+        if entry is None:
+            return
+        self._disk_bytes -= entry.length
+        for path in (entry.path, f"{entry.path}.json"):
+            try: os.remove(path)
+            except OSError: pass
+
+    # --- Maintenance ---
+
+    def discard(self, file_id: str):
+        """Drops a file from both tiers (called when it is deleted from GridFS)."""
+        entry = self._memory.pop(file_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry.length
+        if self._disk is not None:
+            self._drop_disk_entry(file_id)
+
+    def stats(self) -> dict:
+        hits = counters.get("file_cache.memory_hits") + counters.get("file_cache.disk_hits")
+        lookups = hits + counters.get("file_cache.misses")
+        served = counters.get("file_cache.bytes_from_cache") + counters.get("file_cache.bytes_from_gridfs")
+        return {
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "byte_hit_ratio": counters.get("file_cache.bytes_from_cache") / served if served else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk or {}),
+            "disk_bytes": self._disk_bytes,
+        }
+
+# Singleton shared by all requests in the process
+file_cache = GridFSFileCache()
@@ -1,168 +1,32 @@
-# Standard library imports
-import os
+# Study guide generation with Gemini: the multimodal prompt, and the one-shot and streaming
+# requests that turn a document's text and images into study guide sections.
 import json
 import logging
-import uuid # Added for generating section IDs
-from typing import List
+import uuid
+from typing import List, AsyncIterator
 
-# FastAPI imports
 from fastapi import HTTPException
-
-# PDF processing
-import fitz  # PyMuPDF
-
-# Document processing
-from pptx import Presentation
-from pptx.enum.shapes import MSO_SHAPE_TYPE
-from docx import Document
-
-# Image processing
-from PIL import Image, UnidentifiedImageError
-
-# Google AI imports
+from pydantic import ValidationError
 import google.generativeai as genai
 
-# Local imports
-from .. import models # Relative import
-from pydantic import ValidationError # Import for specific error checking
-# from utils.image_processing import pre_filter_image
-from .. import config # Import the whole module
+from . import models
+from . import config # Import the whole module: config.gemini_model is read at call time
+from .extraction import PAGE_BREAK
+from .image_processing import prepare_images_for_gemini
+from .json_stream import JsonArrayStreamParser
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-TEMP_UPLOAD_DIR = "temp_uploads"
-IMAGE_OUTPUT_DIR_BASE = os.path.join(TEMP_UPLOAD_DIR, "images")
-MIN_IMAGE_WIDTH = 50  # Pixels - adjust as needed for pre-filtering
-MIN_IMAGE_HEIGHT = 50 # Pixels - adjust as needed for pre-filtering
+# Bump whenever the prompt below changes, so cached results from the old prompt are not reused
+STUDY_GUIDE_PROMPT_VERSION = "v4"
 
-def extract_text_and_images_pdf(file_path: str, request_image_dir: str) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
-    """Extracts text and images from PDF, performs basic image filtering."""
-    text = ""
-    all_images_info: List[models.ExtractedImageInfo] = []
-    filtered_images_info: List[models.ExtractedImageInfo] = []
-    try:
-        doc = fitz.open(file_path)
-        img_counter = 0
-        for page_num, page in enumerate(doc):
-            text += page.get_text() + "\n"
-            image_list = page.get_images(full=True)
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                try:
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-                    image_filename = f"img_{page_num + 1}_{img_counter}.{image_ext}"
-                    image_save_path = os.path.join(request_image_dir, image_filename)
-
-                    with open(image_save_path, "wb") as img_file:
-                        img_file.write(image_bytes)
-
-                    image_info = models.ExtractedImageInfo(filename=image_filename, page_number=page_num + 1)
-                    all_images_info.append(image_info) # Add to all list first
-
-                    # Pre-filter the saved image
-                    if pre_filter_image(image_save_path):
-                         filtered_images_info.append(image_info) # Add to filtered list if it passes
-                    else:
-                         # Optionally delete the filtered-out image file immediately
-                         try: os.remove(image_save_path)
-                         except OSError: pass
-                    img_counter += 1
-                except Exception as img_extract_err:
-                     logger.warning(f"Could not extract image ref {xref} on page {page_num+1}: {img_extract_err}")
-
-        logger.info(f"Extracted text, found {len(all_images_info)} total images, kept {len(filtered_images_info)} after filtering from PDF: {file_path}")
-        doc.close()
-        return text, all_images_info, filtered_images_info
-    except Exception as e:
-        logger.error(f"Error extracting data from PDF {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to process PDF file: {e}")
-
-def extract_text_and_images_pptx(file_path: str, request_image_dir: str) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
-    """Extracts text and images from PPTX, performs basic image filtering."""
-    text = ""
-    all_images_info: List[models.ExtractedImageInfo] = []
-    filtered_images_info: List[models.ExtractedImageInfo] = []
-    try:
-        prs = Presentation(file_path)
-        img_counter = 0
-        for slide_num, slide in enumerate(prs.slides):
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-                if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
-                    try:
-                        image = shape.image
-                        image_bytes = image.blob
-                        image_ext = image.ext.lower()
-                        image_filename = f"img_slide_{slide_num + 1}_{img_counter}.{image_ext}"
-                        image_save_path = os.path.join(request_image_dir, image_filename)
-
-                        with open(image_save_path, "wb") as img_file:
-                            img_file.write(image_bytes)
-
-                        image_info = models.ExtractedImageInfo(filename=image_filename, page_number=slide_num + 1)
-                        all_images_info.append(image_info)
-
-                        if pre_filter_image(image_save_path):
-                            filtered_images_info.append(image_info)
-                        else:
-                            try: os.remove(image_save_path)
-                            except OSError: pass
-                        img_counter += 1
-                    except Exception as img_extract_err:
-                        logger.warning(f"Could not extract image shape on slide {slide_num+1}: {img_extract_err}")
-
-        logger.info(f"Extracted text, found {len(all_images_info)} total images, kept {len(filtered_images_info)} after filtering from PPTX: {file_path}")
-        return text, all_images_info, filtered_images_info
-    except Exception as e:
-        logger.error(f"Error extracting data from PPTX {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to process PPTX file: {e}")
-
-def extract_text_docx(file_path: str) -> str:
-    """Extracts text from a DOCX file. Image extraction is complex and omitted for now."""
-    try:
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        logger.info(f"Extracted text from DOCX: {file_path}. Image extraction skipped.")
-        return text
-    except Exception as e:
-        logger.error(f"Error extracting text from DOCX {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to process DOCX file: {e}")
-
-def extract_text_txt(file_path: str) -> str:
-    """Extracts text from a TXT file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            text = f.read()
-        logger.info(f"Extracted text from TXT: {file_path}")
-        return text
-    except Exception as e:
-        logger.error(f"Error extracting text from TXT {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to process TXT file: {e}")
-
-
-# Modified extraction functions to return BOTH all extracted and filtered images
-async def generate_hierarchical_study_guide(text_content: str, images_info: List[models.ExtractedImageInfo], request_image_dir: str) -> List[models.StudyGuideSection]:
-    """Uses Gemini multimodal capabilities to generate hierarchical sections, explanations, and image associations."""
-    if not config.gemini_model: # Access via config module
-        raise HTTPException(status_code=500, detail="Gemini model not configured. Check API key.")
-
-    prepared_images = []
-    image_filenames_list = [] # Only filenames of images being sent (already pre-filtered)
-    for img_info in images_info: # images_info now contains only pre-filtered images
-        try:
-            img_path = os.path.join(request_image_dir, img_info.filename)
-            pil_image = Image.open(img_path)
-            if pil_image.mode != 'RGB':
-                 pil_image = pil_image.convert('RGB')
-            prepared_images.append(pil_image)
-            image_filenames_list.append(img_info.filename)
-        except Exception as e:
-            logger.warning(f"Could not load or prepare image {img_info.filename} for Gemini: {e}")
+def build_study_guide_prompt(
+    text_content: str,
+    prepared_images: List[tuple[str, dict]],
+    document_context: str | None = None
+) -> list:
+    """Builds the multimodal prompt (instructions, document text, image filenames and image blobs)."""
+    image_filenames_list = [filename for filename, _ in prepared_images] # Only filenames of images being sent
 
     # --- Prompt v4: Hierarchical Structure, Relevance Filter, Markdown Cues ---
     prompt_parts = [
@@ -231,14 +95,41 @@ You will receive the full text content of the document and a list of image filen
 **Document Text:**
 ---
 """,
-        text_content[:30000], # Limit text length
+        text_content.replace(PAGE_BREAK, "\n")[:config.settings.GEMINI_CHUNK_MAX_CHARS], # Limit text length
         "\n---\n\n**Available (Pre-filtered) Image Filenames (corresponding to the images provided):**\n",
         json.dumps(image_filenames_list),
         "\n\n**JSON Output:**\n"
     ]
 
-    for img in prepared_images:
-        prompt_parts.append(img)
+    if document_context:
+        prompt_parts.insert(0, f"**Note:** This request covers {document_context}. Only create sections for that part; the rest of the document is handled separately.\n\n")
+
+    for _, image_blob in prepared_images:
+        prompt_parts.append(image_blob)
+    return prompt_parts
+
+async def generate_hierarchical_study_guide(
+    text_content: str,
+    images_info: List[models.ExtractedImageInfo],
+    request_image_dir: str,
+    prepared_images: List[tuple[str, dict]] | None = None,
+    document_context: str | None = None
+) -> List[models.StudyGuideSection]:
+    """
+    Uses Gemini multimodal capabilities to generate hierarchical sections, explanations, and image associations.
+    `prepared_images` are the downscaled/re-encoded images from `prepare_images_for_gemini`;
+    they are prepared here if the caller did not already do so.
+    `document_context` tells the model which part of a longer document the text is (chunked generation).
+    Text beyond GEMINI_CHUNK_MAX_CHARS is cut off; use `chunked_generation` for long documents.
+    """
+    if not config.gemini_model: # Access via config module
+        raise HTTPException(status_code=500, detail="Gemini model not configured. Check API key.")
+
+    if prepared_images is None:
+        # images_info contains only pre-filtered images
+        prepared_images, _ = await prepare_images_for_gemini(request_image_dir, images_info)
+
+    prompt_parts = build_study_guide_prompt(text_content, prepared_images, document_context)
 
     # Use explicit JSON mode with gemini-1.5-pro
     generation_config = genai.types.GenerationConfig(response_mime_type="application/json")
@@ -312,19 +203,54 @@ You will receive the full text content of the document and a list of image filen
         logger.error(f"Gemini raw response was: {response.text if 'response' in locals() else 'N/A'}")
         raise HTTPException(status_code=500, detail=f"Unexpected error processing AI response: {e}")
 
-def pre_filter_image(image_path: str) -> bool:
-    """Basic pre-filtering for images based on dimensions."""
+async def stream_hierarchical_study_guide(
+    text_content: str,
+    prepared_images: List[tuple[str, dict]],
+    document_context: str | None = None
+) -> AsyncIterator[models.StudyGuideSection]:
+    """
+    Streaming variant of `generate_hierarchical_study_guide`: uses Gemini's streaming API and
+    yields each main section as soon as its JSON object is complete and valid.
+    Malformed sections are logged and skipped rather than failing the whole guide.
+    """
+    if not config.gemini_model: # Access via config module
+        raise HTTPException(status_code=500, detail="Gemini model not configured. Check API key.")
+
+    prompt_parts = build_study_guide_prompt(text_content, prepared_images, document_context)
+    generation_config = genai.types.GenerationConfig(response_mime_type="application/json")
+    parser = JsonArrayStreamParser()
+    sections_yielded = 0
+
+    logger.info(f"Streaming hierarchical multimodal request to Gemini with {len(prepared_images)} images...")
     try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            if width < MIN_IMAGE_WIDTH or height < MIN_IMAGE_HEIGHT:
-                logger.info(f"Filtering out image (too small): {image_path}")
-                return False
-            # Add other checks here if needed (e.g., color variance)
-        return True
-    except UnidentifiedImageError:
-        logger.warning(f"Cannot identify image file, filtering out: {image_path}")
-        return False
-    except Exception as e:
-        logger.warning(f"Error during image pre-filtering for {image_path}: {e}")
-        return False # Filter out if error occurs
+        response = await config.gemini_model.generate_content_async(
+            prompt_parts,
+            generation_config=generation_config,
+            stream=True
+        )
+        async for chunk in response:
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                continue # Chunk without text parts (e.g. only finish/safety metadata)
+            for section_dict in parser.feed(chunk_text):
+                if not isinstance(section_dict, dict):
+                    logger.warning(f"Skipping non-dictionary item found in AI response stream: {section_dict}")
+                    continue
+                section_dict["section_id"] = str(uuid.uuid4())
+                try:
+                    section = models.StudyGuideSection.model_validate(section_dict)
+                except ValidationError as val_err:
+                    logger.warning(f"Skipping streamed section that failed validation: {val_err}")
+                    continue
+                sections_yielded += 1
+                yield section
+    except json.JSONDecodeError as json_err:
+        logger.error(f"Failed to parse streamed Gemini section as JSON: {json_err}")
+        raise HTTPException(status_code=500, detail=f"AI response was not valid JSON: {json_err}")
+
+    if not parser.finished:
+        logger.warning("Gemini stream ended before the closing bracket ']'; keeping the complete sections received.")
+    if sections_yielded == 0:
+        raise HTTPException(status_code=500, detail="AI response did not contain any valid study guide sections.")
+    logger.info(f"Streamed {sections_yielded} main sections from Gemini.")
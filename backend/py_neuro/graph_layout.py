@@ -0,0 +1,206 @@
+# Force-directed layout of topic graphs: Fruchterman-Reingold with a Barnes-Hut approximation
+# of the repulsive forces, vectorised with NumPy (run in the process pool)
+import numpy as np
+
+_MIN_DISTANCE_SQUARED = 1e-4
+# Movable nodes up to this count repel each other exactly during an incremental layout
+_EXACT_REPULSION_MAX_NODES = 1024
+_GRAVITY = 1.0 # Pull towards the centre; keeps disconnected components together (radius ~ k * sqrt(n))
+
+def _morton_codes(cells: np.ndarray, depth: int) -> np.ndarray:
+    """Interleaves the bits of integer cell coordinates (n, 2), most significant level first."""
+    codes = np.zeros(len(cells), dtype=np.int64)
+    for bit in range(depth):
+        codes |= ((cells[:, 0] >> bit) & 1) << (2 * bit + 1)
+        codes |= ((cells[:, 1] >> bit) & 1) << (2 * bit)
+    return codes
+
+class _QuadTree:
+    """
+    Point masses aggregated per quadtree cell, one level at a time: the cells of a level are the
+    distinct prefixes of the points' Morton codes, so each level is one np.unique and a few bincounts.
+    """
+    def __init__(self, points: np.ndarray):
+        self.points = points
+        self.depth = int(np.clip(np.ceil(np.log(max(len(points), 1)) / np.log(4)) + 2, 2, 15))
+        self.origin = points.min(axis=0)
+        self.span = max(float((points.max(axis=0) - self.origin).max()), 1e-6) * (1 + 1e-9)
+        self.codes = self._codes(points)
+        self.levels = []
+        for level in range(1, self.depth + 1):
+            cell_codes, inverse, mass = np.unique(self.codes >> (2 * (self.depth - level)), return_inverse=True, return_counts=True)
+            center = np.stack([
+                np.bincount(inverse, weights=points[:, 0], minlength=len(cell_codes)),
+                np.bincount(inverse, weights=points[:, 1], minlength=len(cell_codes)),
+            ], axis=1) / mass[:, None]
+            self.levels.append((cell_codes, mass.astype(np.float64), center))
+
+    def _codes(self, points: np.ndarray) -> np.ndarray:
+        side = 1 << self.depth
+        cells = np.clip(((points - self.origin) / self.span * side).astype(np.int64), 0, side - 1)
+        return _morton_codes(cells, self.depth)
+
+    def repulsion(self, queries: np.ndarray, query_ids: np.ndarray | None, k: float, theta: float) -> np.ndarray:
+        """
+        Repulsive force k^2 / d on each query point from all tree points. A cell is used as one
+        mass at its centre when size / distance < theta and the query isn't inside it; otherwise
+        its children are visited. `query_ids` are the queries' indices in the tree (their own
+        mass is left out), or None for points that aren't in it.
+        """
+        count = len(queries)
+        force = np.zeros((count, 2))
+        query_codes = self._codes(queries)
+        cell_codes, _, _ = self.levels[0]
+        node = np.repeat(np.arange(count), len(cell_codes))
+        cell = np.tile(np.arange(len(cell_codes)), count)
+        for level in range(1, self.depth + 1):
+            cell_codes, mass, center = self.levels[level - 1]
+            delta = queries[node] - center[cell]
+            distance_squared = np.einsum("ij,ij->i", delta, delta)
+            inside = (query_codes[node] >> (2 * (self.depth - level))) == cell_codes[cell]
+            if level == self.depth:
+                accept = np.ones(len(node), dtype=bool)
+            else:
+                size = self.span / (1 << level)
+                accept = ~inside & (size * size < theta * theta * distance_squared)
+
+            accepted_node, accepted_cell = node[accept], cell[accept]
+            accepted_mass, accepted_delta = mass[accepted_cell], delta[accept]
+            if level == self.depth and query_ids is not None:
+                # A query's own leaf: the remaining points' centre of mass, without the query itself
+                own = inside[accept]
+                own_node, own_cell = accepted_node[own], accepted_cell[own]
+                others = mass[own_cell] - 1
+                others_center = (center[own_cell] * mass[own_cell, None] - self.points[query_ids[own_node]]) / np.maximum(others, 1)[:, None]
+                accepted_delta[own] = queries[own_node] - others_center
+                accepted_mass[own] = others
+            squared = np.maximum(np.einsum("ij,ij->i", accepted_delta, accepted_delta), _MIN_DISTANCE_SQUARED)
+            magnitude = k * k * accepted_mass / squared # (k^2 / d) along delta / d
+            force[:, 0] += np.bincount(accepted_node, weights=magnitude * accepted_delta[:, 0], minlength=count)
+            force[:, 1] += np.bincount(accepted_node, weights=magnitude * accepted_delta[:, 1], minlength=count)
+            if level == self.depth:
+                break
+
+            # Open the remaining cells: their existing children at the next level
+            open_node, open_cell = node[~accept], cell[~accept]
+            next_codes = self.levels[level][0]
+            children = (cell_codes[open_cell] * 4)[:, None] + np.arange(4)
+            positions = np.minimum(np.searchsorted(next_codes, children), len(next_codes) - 1)
+            exists = (next_codes[positions] == children).ravel()
+            node = np.repeat(open_node, 4)[exists]
+            cell = positions.ravel()[exists]
+        return force
+
+def exact_repulsion(points: np.ndarray, k: float) -> np.ndarray:
+    """All-pairs repulsive forces (O(n^2) memory; for small sets and accuracy checks)."""
+    delta = points[:, None, :] - points[None, :, :]
+    squared = np.maximum(np.einsum("ijk,ijk->ij", delta, delta), _MIN_DISTANCE_SQUARED)
+    np.fill_diagonal(squared, np.inf)
+    return np.einsum("ij,ijk->ik", k * k / squared, delta)
+
+def _attraction(positions: np.ndarray, edges: np.ndarray, k: float) -> np.ndarray:
+    """Attractive force d^2 / k pulling the endpoints of every edge together."""
+    force = np.zeros_like(positions)
+    if len(edges):
+        delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+        pull = delta * (np.sqrt(np.einsum("ij,ij->i", delta, delta)) / k)[:, None]
+        for axis in (0, 1):
+            force[:, axis] -= np.bincount(edges[:, 0], weights=pull[:, axis], minlength=len(positions))
+            force[:, axis] += np.bincount(edges[:, 1], weights=pull[:, axis], minlength=len(positions))
+    return force
+
+def _initial_positions(
+    positions: np.ndarray,
+    placed: np.ndarray,
+    edges: np.ndarray,
+    k: float,
+    rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Places unplaced nodes next to the mean of their placed neighbours (repeated, so chains of
+    new nodes grow outwards); nodes without any are scattered around the centre.
+    """
+    positions = positions.copy()
+    placed = placed.copy()
+    count = len(positions)
+    if not placed.any():
+        radius = k * np.sqrt(count)
+        return rng.uniform(-radius, radius, size=(count, 2))
+    center = positions[placed].mean(axis=0)
+    both_ways = np.concatenate([edges, edges[:, ::-1]]) if len(edges) else edges.reshape(0, 2)
+    while not placed.all():
+        usable = both_ways[placed[both_ways[:, 1]] & ~placed[both_ways[:, 0]]]
+        if not len(usable):
+            break
+        neighbours = np.bincount(usable[:, 0], minlength=count)
+        sums = np.stack([
+            np.bincount(usable[:, 0], weights=positions[usable[:, 1], axis], minlength=count) for axis in (0, 1)
+        ], axis=1)
+        newly_placed = neighbours > 0
+        positions[newly_placed] = sums[newly_placed] / neighbours[newly_placed, None] + rng.normal(0, k, (newly_placed.sum(), 2))
+        placed |= newly_placed
+    remaining = ~placed
+    positions[remaining] = center + rng.normal(0, k * np.sqrt(count) / 4, (remaining.sum(), 2))
+    return positions
+
+def layout_graph(
+    node_count: int,
+    edges: np.ndarray,
+    positions: np.ndarray | None = None,
+    pinned: np.ndarray | None = None,
+    k: float = 80.0,
+    iterations: int = 60,
+    theta: float = 0.8,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Fruchterman-Reingold layout of a graph with `node_count` nodes and `edges` (E, 2) of node
+    indices; `k` is the ideal edge length. Returns positions (node_count, 2).
+
+    Incremental layout: pass the previous `positions` and a `pinned` mask; pinned nodes keep
+    their positions and the others are placed next to their neighbours, then relaxed. Rows of
+    `positions` that are NaN count as unplaced. Repulsion uses a Barnes-Hut quadtree with opening
+    angle `theta` (0 = exact); for an incremental layout the pinned nodes' tree is built once.
+    """
+    rng = np.random.default_rng(seed)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if node_count == 0:
+        return np.zeros((0, 2))
+    if positions is None:
+        positions = np.full((node_count, 2), np.nan)
+    pinned = np.zeros(node_count, dtype=bool) if pinned is None else np.asarray(pinned, dtype=bool).copy()
+    placed = ~np.isnan(positions).any(axis=1)
+    pinned &= placed
+    positions = _initial_positions(np.where(placed[:, None], positions, 0.0), placed, edges, k, rng)
+
+    movable = np.flatnonzero(~pinned)
+    if not len(movable):
+        return positions
+    incremental = pinned.any()
+    if incremental:
+        # Only edges touching a movable node matter; the pinned nodes' repulsion is static
+        edges = edges[~(pinned[edges[:, 0]] & pinned[edges[:, 1]])]
+        pinned_tree = _QuadTree(positions[pinned])
+        center = positions[pinned].mean(axis=0)
+        start_temperature = 2 * k
+    else:
+        start_temperature = 0.1 * k * np.sqrt(node_count)
+
+    for iteration in range(iterations):
+        moving = positions[movable]
+        if not incremental:
+            repulsion = _QuadTree(positions).repulsion(positions, np.arange(node_count), k, theta) if theta > 0 else exact_repulsion(positions, k)
+            center = positions.mean(axis=0)
+        else:
+            repulsion = pinned_tree.repulsion(moving, None, k, theta)
+            if len(movable) <= _EXACT_REPULSION_MAX_NODES:
+                repulsion += exact_repulsion(moving, k)
+            else:
+                repulsion += _QuadTree(moving).repulsion(moving, np.arange(len(movable)), k, theta)
+        force = repulsion + _attraction(positions, edges, k)[movable] - _GRAVITY * (moving - center)
+
+        # Move along the force, at most the current temperature (linear cooling)
+        temperature = start_temperature * (1 - iteration / iterations) + 1e-3 * k
+        length = np.maximum(np.sqrt(np.einsum("ij,ij->i", force, force)), 1e-12)
+        positions[movable] = moving + force * (np.minimum(length, temperature) / length)[:, None]
+    return positions
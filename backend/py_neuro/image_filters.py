@@ -0,0 +1,143 @@
+# Relevance filtering for extracted images, run before they are sent to Gemini.
+# Every image dropped here saves upload bandwidth and prompt tokens.
+import os
+import logging
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+STATS_SIZE = 64 # Images are reduced to STATS_SIZE x STATS_SIZE before computing statistics
+HASH_SIZE = 8 # dHash of HASH_SIZE x HASH_SIZE bits
+# Number of set bits for every byte value, used to popcount packed hashes
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _load_thumbnails(image_paths: List[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Loads every image as a tiny RGB thumbnail and a dHash-sized grayscale thumbnail.
+    JPEGs are decoded at reduced scale via draft mode, so large photos stay cheap.
+    Returns (rgb [N, S, S, 3], hash_gray [N, H, H + 1], readable [N]).
+    """
+    count = len(image_paths)
+    rgb = np.zeros((count, STATS_SIZE, STATS_SIZE, 3), dtype=np.float32)
+    hash_gray = np.zeros((count, HASH_SIZE, HASH_SIZE + 1), dtype=np.float32)
+    readable = np.ones(count, dtype=bool)
+    for i, path in enumerate(image_paths):
+        try:
+            with Image.open(path) as img:
+                img.draft("RGB", (STATS_SIZE * 2, STATS_SIZE * 2))
+                img = img.convert("RGB")
+                rgb[i] = np.asarray(img.resize((STATS_SIZE, STATS_SIZE), Image.Resampling.BILINEAR), dtype=np.float32)
+                hash_gray[i] = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Cannot read image for relevance filtering, dropping: {path}: {e}")
+            readable[i] = False
+    return rgb, hash_gray, readable
+
+def _color_std(rgb: np.ndarray) -> np.ndarray:
+    """Mean per-channel standard deviation of each image. Near 0 for blank backgrounds and solid fills."""
+    return rgb.reshape(len(rgb), -1, 3).std(axis=1).mean(axis=1)
+
+def _tonal_range(gray: np.ndarray) -> np.ndarray:
+    """Darkest-to-brightest spread of each image; keeps sparse marks (a line of text) from counting as blank."""
+    flat = gray.reshape(len(gray), -1)
+    return flat.max(axis=1) - flat.min(axis=1)
+
+def _gray_entropy(gray: np.ndarray, bins: int = 32) -> np.ndarray:
+    """Shannon entropy (bits) of each image's grayscale histogram, computed for all images at once."""
+    count = len(gray)
+    binned = np.clip((gray.reshape(count, -1) * bins / 256).astype(np.int64), 0, bins - 1)
+    offsets = binned + (np.arange(count) * bins)[:, None]
+    histograms = np.bincount(offsets.ravel(), minlength=count * bins).reshape(count, bins).astype(np.float64)
+    p = histograms / histograms.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+
+def _detail(gray: np.ndarray) -> np.ndarray:
+    """Mean absolute Laplacian of each image. Near 0 for smooth gradients, high for text, lines and photos."""
+    laplacian = (
+        gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:] + gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1]
+        - 4 * gray[:, 1:-1, 1:-1]
+    )
+    return np.abs(laplacian).mean(axis=(1, 2))
+
+def _dhash(hash_gray: np.ndarray) -> np.ndarray:
+    """Difference hash of each image, packed into HASH_SIZE * HASH_SIZE / 8 bytes."""
+    bits = hash_gray[:, :, 1:] > hash_gray[:, :, :-1]
+    return np.packbits(bits.reshape(len(bits), -1), axis=1)
+
+def _hamming_matrix(hashes: np.ndarray) -> np.ndarray:
+    """Pairwise Hamming distances between packed hashes."""
+    xor = np.bitwise_xor(hashes[:, None, :], hashes[None, :, :])
+    return _POPCOUNT_TABLE[xor].sum(axis=2, dtype=np.int32)
+
+def score_images(image_paths: List[str]) -> dict[str, np.ndarray]:
+    """Computes the per-image statistics the filter works on (exposed for tuning and benchmarks)."""
+    rgb, hash_gray, readable = _load_thumbnails(image_paths)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return {
+        "readable": readable,
+        "color_std": _color_std(rgb),
+        "tonal_range": _tonal_range(gray),
+        "entropy": _gray_entropy(gray),
+        "detail": _detail(gray),
+        "dhash": _dhash(hash_gray),
+    }
+
+def filter_relevant_images(request_image_dir: str, images_info: List[models.ExtractedImageInfo]) -> dict[str, str]:
+    """
+    Drops images unlikely to help the study guide:
+      * "blank"          - colour variance below IMAGE_FILTER_MIN_COLOR_STD and no marks spanning
+                           IMAGE_FILTER_MIN_TONAL_RANGE (backgrounds, solid fills, faint scans)
+      * "low_entropy"    - almost a single tone, e.g. an empty frame (IMAGE_FILTER_MIN_ENTROPY)
+      * "smooth"         - no edges or texture, e.g. gradients (IMAGE_FILTER_MIN_DETAIL)
+      * "near_duplicate" - perceptual hash within IMAGE_FILTER_MAX_HASH_DISTANCE of an earlier kept image
+      * "over_limit"     - beyond IMAGE_FILTER_MAX_IMAGES; the most detailed images are kept
+    Dropped files are deleted. Returns {filename: reason} for every dropped image.
+    """
+    if not images_info:
+        return {}
+    paths = [os.path.join(request_image_dir, info.filename) for info in images_info]
+    scores = score_images(paths)
+
+    reasons = np.full(len(paths), "", dtype=object)
+    reasons[~scores["readable"]] = "unreadable"
+    undecided = reasons == ""
+    blank = (scores["color_std"] < settings.IMAGE_FILTER_MIN_COLOR_STD) & (scores["tonal_range"] < settings.IMAGE_FILTER_MIN_TONAL_RANGE)
+    reasons[undecided & blank] = "blank"
+    undecided = reasons == ""
+    reasons[undecided & (scores["entropy"] < settings.IMAGE_FILTER_MIN_ENTROPY)] = "low_entropy"
+    undecided = reasons == ""
+    reasons[undecided & (scores["detail"] < settings.IMAGE_FILTER_MIN_DETAIL)] = "smooth"
+
+    # Collapse near-duplicates, keeping the first occurrence in document order
+    candidates = np.flatnonzero(reasons == "")
+    if len(candidates) > 1:
+        distances = _hamming_matrix(scores["dhash"][candidates])
+        kept: List[int] = []
+        for position, index in enumerate(candidates):
+            if kept and distances[position, kept].min() <= settings.IMAGE_FILTER_MAX_HASH_DISTANCE:
+                reasons[index] = "near_duplicate"
+            else:
+                kept.append(position)
+
+    # Cap the number of images per request, preferring the most detailed ones
+    candidates = np.flatnonzero(reasons == "")
+    max_images = settings.IMAGE_FILTER_MAX_IMAGES
+    if max_images and len(candidates) > max_images:
+        ranked = candidates[np.argsort(-scores["detail"][candidates], kind="stable")]
+        reasons[ranked[max_images:]] = "over_limit"
+
+    dropped = {}
+    for info, path, reason in zip(images_info, paths, reasons):
+        if reason:
+            dropped[info.filename] = reason
+            try: os.remove(path)
+            except OSError: pass
+    logger.info(f"Relevance filter kept {len(paths) - len(dropped)} of {len(paths)} images in {request_image_dir}")
+    return dropped
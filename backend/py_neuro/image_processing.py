@@ -0,0 +1,122 @@
+# Image preprocessing for Gemini requests: downscale and re-encode before upload
+import io
+import os
+import asyncio
+import logging
+from typing import List
+
+from PIL import Image, UnidentifiedImageError
+from fastapi import HTTPException
+
+from . import models
+from .config import settings
+from .process_pool import process_pool
+
+logger = logging.getLogger(__name__)
+
+# Formats Gemini accepts as-is, so a small original can be sent unchanged
+_PASSTHROUGH_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white; JPEG has no alpha and black backgrounds hide diagrams
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def prepare_image_for_gemini(image_path: str, max_edge: int, image_format: str, quality: int) -> tuple[str, bytes, int]:
+    """
+    Downscales an image so its long edge is at most `max_edge` and re-encodes it as
+    JPEG/WebP at `quality`. The original bytes are kept when they are already smaller.
+    Returns (mime_type, data, original_size_in_bytes).
+    """
+    with open(image_path, "rb") as f:
+        original_bytes = f.read()
+
+    with Image.open(io.BytesIO(original_bytes)) as img:
+        original_format = img.format
+        fits = max(img.size) <= max_edge
+        img.draft("RGB", (max_edge, max_edge)) # JPEGs decode straight at reduced scale
+        img = _flatten_to_rgb(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality)
+        encoded = buffer.getvalue()
+
+    if fits and original_format in _PASSTHROUGH_MIME_TYPES and len(original_bytes) <= len(encoded):
+        return _PASSTHROUGH_MIME_TYPES[original_format], original_bytes, len(original_bytes)
+    return f"image/{image_format.lower()}", encoded, len(original_bytes)
+
+async def prepare_images_for_gemini(
+    request_image_dir: str,
+    images_info: List[models.ExtractedImageInfo]
+) -> tuple[List[tuple[str, dict]], dict]:
+    """
+    Prepares all images for a Gemini request in parallel in the process pool.
+    Returns ([(filename, {"mime_type", "data"}), ...], report) where the report holds
+    the original and prepared byte totals for the request.
+    """
+    image_format = settings.GEMINI_IMAGE_FORMAT.upper()
+    results = await asyncio.gather(*(
+        process_pool.run(
+            prepare_image_for_gemini,
+            os.path.join(request_image_dir, img_info.filename),
+            settings.GEMINI_IMAGE_MAX_EDGE,
+            image_format,
+            settings.GEMINI_IMAGE_QUALITY
+        )
+        for img_info in images_info
+    ), return_exceptions=True)
+
+    prepared: List[tuple[str, dict]] = []
+    original_bytes = 0
+    prepared_bytes = 0
+    for img_info, result in zip(images_info, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Could not load or prepare image {img_info.filename} for Gemini: {result}")
+            continue
+        mime_type, data, original_size = result
+        prepared.append((img_info.filename, {"mime_type": mime_type, "data": data}))
+        original_bytes += original_size
+        prepared_bytes += len(data)
+
+    report = {
+        "images": len(prepared),
+        "original_bytes": original_bytes,
+        "prepared_bytes": prepared_bytes,
+        "bytes_saved": original_bytes - prepared_bytes,
+    }
+    logger.info(
+        f"Prepared {len(prepared)} images for Gemini: {original_bytes / 1e6:.2f} MB -> "
+        f"{prepared_bytes / 1e6:.2f} MB ({report['bytes_saved'] / 1e6:.2f} MB saved)"
+    )
+    return prepared, report
+
+def render_thumbnails(data: bytes, sizes: List[int], image_format: str, quality: int) -> List[tuple[int, str, bytes, int, int]]:
+    """
+    Renders one thumbnail per size (long edge in pixels, never upscaled) from an image's bytes.
+    The image is decoded once and downscaled from the largest size to the smallest.
+    Returns [(size, mime_type, data, width, height), ...]. Runs in the process pool.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="File is not a supported image")
+    with img:
+        img.draft("RGB", (max(sizes), max(sizes)))
+        current = _flatten_to_rgb(img)
+        thumbnails = []
+        for size in sorted(sizes, reverse=True):
+            if max(current.size) > size:
+                current = current.copy()
+                current.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            current.save(buffer, format=image_format, quality=quality)
+            thumbnails.append((size, f"image/{image_format.lower()}", buffer.getvalue(), *current.size))
+    return thumbnails
@@ -0,0 +1,210 @@
+# Declarative MongoDB index registry, applied at startup by connect_to_mongo, and
+# explain()-based checks that the application's queries are served by those indexes.
+import logging
+from datetime import datetime
+from typing import Any, List, NamedTuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .config import settings
+from .crud import STUDY_GUIDE_COLLECTION, STUDY_GUIDE_SECTIONS_COLLECTION, GRIDFS_FILES_COLLECTION
+from .jobs import JOBS_COLLECTION
+from .knowledge_graph import TOPIC_NODES_COLLECTION, TOPIC_EDGES_COLLECTION, TOPIC_VECTORS_COLLECTION
+from .study_guide_cache import STUDY_GUIDE_CACHE_COLLECTION
+from .migrations import MIGRATIONS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+WORKSPACES_COLLECTION = "workspaces"
+GRIDFS_CHUNKS_COLLECTION = "fs.chunks"
+
+# Server error codes for an index that exists with the same name but other options/keys
+_INDEX_CONFLICT_CODES = {85, 86} # IndexOptionsConflict, IndexKeySpecsConflict
+
+def index_registry() -> dict[str, List[IndexModel]]:
+    """Every index the application relies on, by collection."""
+    return {
+        WORKSPACES_COLLECTION: [
+            IndexModel([("title", ASCENDING), ("_id", ASCENDING)]), # Listing sorted by title (keyset)
+            # Listing sorted by created_at pages on _id (insertion order): no index of its own
+        ],
+        STUDY_GUIDE_COLLECTION: [
+            IndexModel([("workspace_id", ASCENDING), ("_id", ASCENDING)]), # Guides of a workspace, in upload order
+            IndexModel([("extracted_images.gridfs_id", ASCENDING)]), # Linking lazily created thumbnails
+        ],
+        STUDY_GUIDE_SECTIONS_COLLECTION: [
+            IndexModel([("study_guide_id", ASCENDING), ("index", ASCENDING)], unique=True), # A guide's sections in order
+            IndexModel([("study_guide_id", ASCENDING), ("section_id", ASCENDING)], unique=True), # One section on demand
+        ],
+        TOPIC_NODES_COLLECTION: [
+            IndexModel([("workspace_id", ASCENDING), ("id", ASCENDING)], unique=True), # Nodes of a workspace, by id
+            IndexModel([("workspace_id", ASCENDING), ("parentTopicId", ASCENDING), ("orderPosition", ASCENDING)]), # Children ($graphLookup)
+            IndexModel([("study_guide_id", ASCENDING)], sparse=True), # Topics derived from a study guide
+        ],
+        TOPIC_VECTORS_COLLECTION: [
+            IndexModel([("workspace_id", ASCENDING), ("features", ASCENDING)]),
+            IndexModel([("study_guide_id", ASCENDING)]),
+        ],
+        TOPIC_EDGES_COLLECTION: [
+            # Adjacency in both directions
+            IndexModel([("workspace_id", ASCENDING), ("sourceTopicId", ASCENDING), ("targetTopicId", ASCENDING)], unique=True),
+            IndexModel([("workspace_id", ASCENDING), ("targetTopicId", ASCENDING)]),
+        ],
+        JOBS_COLLECTION: [
+            IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]), # Claiming the oldest queued job, queue depth
+            IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]), # Expired leases
+            IndexModel([("workspace_id", ASCENDING), ("created_at", DESCENDING)]), # Jobs of a workspace, newest first
+        ],
+        STUDY_GUIDE_CACHE_COLLECTION: [
+            # TTL: entries not read for STUDY_GUIDE_CACHE_TTL_DAYS are evicted
+            IndexModel([("last_accessed", ASCENDING)], expireAfterSeconds=settings.STUDY_GUIDE_CACHE_TTL_DAYS * 24 * 3600),
+        ],
+        GRIDFS_FILES_COLLECTION: [
+            IndexModel([("metadata.sha256", ASCENDING)]), # Content-addressed lookups
+            IndexModel([("metadata.thumbnail_of", ASCENDING), ("metadata.thumbnail_size", ASCENDING)], sparse=True),
+        ],
+        GRIDFS_CHUNKS_COLLECTION: [
+            # The driver creates this on the first upload; batch reads rely on it from the start
+            IndexModel([("files_id", ASCENDING), ("n", ASCENDING)], unique=True),
+        ],
+    }
+
+async def _update_ttl(db: AsyncIOMotorDatabase, collection: str, index: IndexModel):
+    """Changes expireAfterSeconds of an existing TTL index in place (create_indexes refuses to)."""
+    await db.command(
+        "collMod", collection,
+        index={"keyPattern": dict(index.document["key"]), "expireAfterSeconds": index.document["expireAfterSeconds"]}
+    )
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Creates the registry's indexes; idempotent, so it runs on every startup. An index whose
+    TTL changed is updated in place; other conflicts (an index with the same name but different
+    options) are logged and left for an operator to resolve.
+    """
+    for collection, indexes in index_registry().items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code not in _INDEX_CONFLICT_CODES:
+                raise
+            # Creating the whole batch failed; retry one by one to find the conflicting ones
+            for index in indexes:
+                try:
+                    await db[collection].create_indexes([index])
+                except OperationFailure as index_error:
+                    if index_error.code not in _INDEX_CONFLICT_CODES:
+                        raise
+                    if "expireAfterSeconds" in index.document:
+                        await _update_ttl(db, collection, index)
+                    else:
+                        logger.warning(f"Index {index.document['name']} on {collection} conflicts with an existing one: {index_error}")
+    logger.info(f"Ensured indexes on {len(index_registry())} collections")
+
+# --- Query plan checks ---
+
+class QueryShape(NamedTuple):
+    # A representative query the application issues; values only need the right types
+    description: str
+    collection: str
+    filter: dict
+    sort: Any = None
+
+def query_shapes() -> List[QueryShape]:
+    """
+    The find/update/count filters issued by crud.py, jobs.py, the caches and the routers.
+    tests/test_query_plans.py fails when the code issues a query none of these covers.
+    """
+    oid = ObjectId()
+    now = datetime.utcnow()
+    return [
+        QueryShape("study guide by id", STUDY_GUIDE_COLLECTION, {"_id": oid}),
+        QueryShape("study guides of a workspace", STUDY_GUIDE_COLLECTION, {"workspace_id": oid}),
+        QueryShape("study guide of a workspace", STUDY_GUIDE_COLLECTION, {"_id": oid, "workspace_id": oid}),
+        QueryShape("study guides using an image", STUDY_GUIDE_COLLECTION, {"extracted_images.gridfs_id": oid}),
+        QueryShape("sections of a guide", STUDY_GUIDE_SECTIONS_COLLECTION, {"study_guide_id": oid}, [("index", 1)]),
+        QueryShape("section of a guide", STUDY_GUIDE_SECTIONS_COLLECTION, {"study_guide_id": oid, "section_id": "s"}),
+        QueryShape("workspace listing by creation", WORKSPACES_COLLECTION, {"_id": {"$gt": oid}}, [("_id", 1)]),
+        QueryShape(
+            "workspace listing by title", WORKSPACES_COLLECTION,
+            {"$or": [{"title": {"$gt": "a"}}, {"title": "a", "_id": {"$gt": oid}}]}, [("title", 1), ("_id", 1)]
+        ),
+        QueryShape("topic nodes of a workspace", TOPIC_NODES_COLLECTION, {"workspace_id": oid}, [("id", 1)]),
+        QueryShape("topic nodes by id", TOPIC_NODES_COLLECTION, {"workspace_id": oid, "id": {"$in": [1]}}),
+        QueryShape("children of a topic", TOPIC_NODES_COLLECTION, {"workspace_id": oid, "parentTopicId": 1}),
+        QueryShape("topics of a study guide", TOPIC_NODES_COLLECTION, {"study_guide_id": oid}),
+        QueryShape("term vectors of a workspace", TOPIC_VECTORS_COLLECTION, {"workspace_id": oid}),
+        QueryShape("term vectors sharing a feature", TOPIC_VECTORS_COLLECTION, {"workspace_id": oid, "features": 1}),
+        QueryShape("term vectors of a study guide", TOPIC_VECTORS_COLLECTION, {"study_guide_id": oid}),
+        QueryShape("topic edges of a workspace", TOPIC_EDGES_COLLECTION, {"workspace_id": oid}),
+        QueryShape("outgoing topic edges", TOPIC_EDGES_COLLECTION, {"workspace_id": oid, "sourceTopicId": 1}),
+        QueryShape("incoming topic edges", TOPIC_EDGES_COLLECTION, {"workspace_id": oid, "targetTopicId": 1}),
+        QueryShape("jobs of a workspace", JOBS_COLLECTION, {"workspace_id": oid}, [("created_at", -1)]),
+        QueryShape("queued job count", JOBS_COLLECTION, {"status": "queued"}),
+        QueryShape(
+            "claim next job", JOBS_COLLECTION,
+            {"$or": [
+                {"status": "queued", "run_after": {"$not": {"$gt": now}}},
+                {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$lt": settings.JOB_MAX_ATTEMPTS}},
+            ]},
+            [("created_at", 1)]
+        ),
+        QueryShape(
+            "exhausted jobs", JOBS_COLLECTION,
+            {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": settings.JOB_MAX_ATTEMPTS}}
+        ),
+        QueryShape("study guide cache entry", STUDY_GUIDE_CACHE_COLLECTION, {"_id": "0" * 64}),
+        QueryShape("completed migration", MIGRATIONS_COLLECTION, {"_id": "convert_string_object_ids"}),
+        QueryShape("content-addressed file", GRIDFS_FILES_COLLECTION, {"metadata.sha256": "0" * 64, "metadata.refcount": {"$gt": 0}}),
+        QueryShape("thumbnails of an image", GRIDFS_FILES_COLLECTION, {"metadata.thumbnail_of": oid}),
+        QueryShape(
+            "thumbnails for a batch", GRIDFS_FILES_COLLECTION,
+            {"metadata.thumbnail_of": {"$in": [oid]}, "metadata.thumbnail_size": 160}
+        ),
+        QueryShape("files for a batch", GRIDFS_FILES_COLLECTION, {"_id": {"$in": [oid]}}),
+        QueryShape(
+            "chunks for a batch", GRIDFS_CHUNKS_COLLECTION,
+            {"files_id": {"$in": [oid]}}, [("files_id", 1), ("n", 1)]
+        ),
+    ]
+
+def _plan_stages(plan: dict):
+    """Yields every stage name of an explain() plan tree."""
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+    for shard in plan.get("shards", []): # Sharded clusters explain per shard
+        yield from _plan_stages(shard.get("winningPlan", {}))
+
+async def explain_stages(db: AsyncIOMotorDatabase, shape: QueryShape) -> List[str]:
+    """Stages of the winning plan for `shape`."""
+    command = {"find": shape.collection, "filter": shape.filter}
+    if shape.sort:
+        command["sort"] = dict(shape.sort)
+    explanation = await db.command("explain", command, verbosity="queryPlanner")
+    return list(_plan_stages(explanation["queryPlanner"]["winningPlan"]))
+
+async def find_collection_scans(db: AsyncIOMotorDatabase, shapes: List[QueryShape] | None = None) -> List[str]:
+    """Descriptions of the queries whose winning plan scans a whole collection."""
+    failures = []
+    for shape in shapes if shapes is not None else query_shapes():
+        stages = await explain_stages(db, shape)
+        if "COLLSCAN" in stages:
+            failures.append(f"{shape.description} ({shape.collection}: {shape.filter}) -> {' <- '.join(stages)}")
+    return failures
+
+async def assert_no_collection_scans(db: AsyncIOMotorDatabase, shapes: List[QueryShape] | None = None):
+    """
+    Fails if any query falls back to COLLSCAN. For tests against a real MongoDB
+    (after ensure_indexes), and at startup when MONGO_CHECK_QUERY_PLANS is set.
+    """
+    failures = await find_collection_scans(db, shapes)
+    if failures:
+        raise AssertionError("Queries without a usable index:\n" + "\n".join(failures))
@@ -0,0 +1,422 @@
+# Persistent study guide job queue backed by MongoDB
+import os
+import socket
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import HTTPException, UploadFile
+from bson import ObjectId
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+
+# Use relative imports
+from . import models
+from . import crud
+from . import pipeline
+from . import knowledge_graph
+from .config import settings
+from .chunked_generation import generate_study_guide_chunked
+from .image_processing import prepare_images_for_gemini
+from .study_guide_cache import study_guide_cache, compute_cache_key
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "study_guide_jobs"
+# Ordered pipeline stages; a job's progress is the fraction of these that have completed
+JOB_STAGES = ["staging", "extracting", "generating", "storing", "linking"]
+
+# --- Queue operations ---
+
+async def enqueue_study_guide_job(
+    db: AsyncIOMotorDatabase,
+    fs: AsyncIOMotorGridFSBucket,
+    workspace_id: str,
+    file: UploadFile
+) -> models.StudyGuideJob:
+    """
+    Stages the uploaded document in GridFS and inserts a queued job for it.
+    Returns immediately; a worker from any API process picks the job up.
+    """
+    staged = await pipeline.stage_upload_to_gridfs(
+        fs=fs,
+        upload=file,
+        filename=file.filename,
+        content_type=file.content_type
+    )
+    now = datetime.utcnow()
+    job_doc = {
+        "workspace_id": ObjectId(workspace_id),
+        "original_filename": file.filename,
+        "content_type": file.content_type,
+        "upload_gridfs_id": staged.gridfs_id,
+        "status": "queued",
+        "stages": [models.StudyGuideJobStage(name=stage).model_dump() for stage in JOB_STAGES],
+        "progress": 0.0,
+        "attempts": 0,
+        "error": None,
+        "study_guide_id": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    result = await db[JOBS_COLLECTION].insert_one(job_doc)
+    job_doc["_id"] = result.inserted_id
+    logger.info(f"Queued study guide job {result.inserted_id} for {file.filename} in workspace {workspace_id}")
+    job_workers.notify() # Wake a local worker instead of waiting for the next poll
+    return models.StudyGuideJob.model_validate(job_doc)
+
+async def get_job(db: AsyncIOMotorDatabase, job_id: str) -> models.StudyGuideJob | None:
+    """Fetches a job document by its MongoDB _id."""
+    document = await db[JOBS_COLLECTION].find_one({"_id": ObjectId(job_id)})
+    if document:
+        return models.StudyGuideJob.model_validate(document)
+    return None
+
+async def get_jobs_for_workspace(db: AsyncIOMotorDatabase, workspace_id: str) -> List[models.StudyGuideJob]:
+    """Fetches all jobs of a workspace, newest first."""
+    cursor = db[JOBS_COLLECTION].find({"workspace_id": ObjectId(workspace_id)}).sort("created_at", -1)
+    return [models.StudyGuideJob.model_validate(document) async for document in cursor]
+
+async def count_queued_jobs(db: AsyncIOMotorDatabase) -> int:
+    """Number of jobs waiting for a worker, used for upload backpressure."""
+    return await db[JOBS_COLLECTION].count_documents({"status": "queued"})
+
+async def claim_next_job(db: AsyncIOMotorDatabase, worker_id: str) -> dict | None:
+    """
+    Atomically claims the oldest queued job (or a running job whose lease expired)
+    so that several API processes can share one queue. Jobs waiting out a retry backoff are skipped.
+    """
+    now = datetime.utcnow()
+    return await db[JOBS_COLLECTION].find_one_and_update(
+        {
+            "$or": [
+                {"status": "queued", "run_after": {"$not": {"$gt": now}}},
+                {
+                    "status": "running",
+                    "lease_expires_at": {"$lt": now},
+                    "attempts": {"$lt": settings.JOB_MAX_ATTEMPTS},
+                },
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "lease_expires_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def fail_exhausted_jobs(db: AsyncIOMotorDatabase):
+    """Marks jobs whose lease expired too many times (e.g. they keep crashing workers) as failed."""
+    now = datetime.utcnow()
+    result = await db[JOBS_COLLECTION].update_many(
+        {
+            "status": "running",
+            "lease_expires_at": {"$lt": now},
+            "attempts": {"$gte": settings.JOB_MAX_ATTEMPTS},
+        },
+        {"$set": {"status": "failed", "error": "Job exceeded maximum attempts", "updated_at": now}}
+    )
+    if result.modified_count:
+        logger.warning(f"Marked {result.modified_count} exhausted study guide jobs as failed")
+
+class JobLeaseLost(Exception):
+    """The job's lease expired and another worker claimed it; this worker must stop writing."""
+
+def _job_owner(job_doc: dict) -> dict:
+    """Filter matching the job only while this claim owns it (a reclaim changes worker_id/attempts)."""
+    return {"_id": job_doc["_id"], "worker_id": job_doc["worker_id"], "attempts": job_doc["attempts"]}
+
+async def _renew_lease(db: AsyncIOMotorDatabase, owner: dict) -> bool:
+    """Extends the lease of a job this worker still owns; False once it lost it."""
+    now = datetime.utcnow()
+    result = await db[JOBS_COLLECTION].update_one(
+        {**owner, "status": "running"},
+        {"$set": {"lease_expires_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS), "updated_at": now}}
+    )
+    return result.matched_count > 0
+
+async def _heartbeat(db: AsyncIOMotorDatabase, owner: dict):
+    """Renews the lease while the job runs, so a long stage (e.g. chunked generation) isn't reclaimed."""
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+        try:
+            if not await _renew_lease(db, owner):
+                logger.warning(f"Study guide job {owner['_id']} lost its lease; it will stop at the next stage")
+                return
+        except Exception as e:
+            logger.warning(f"Could not renew the lease of study guide job {owner['_id']}: {e}")
+
+async def _set_stage(db: AsyncIOMotorDatabase, owner: dict, stage: str, status: str, detail: str | None = None):
+    """Records a stage transition and renews the job's lease. Raises JobLeaseLost if the job was reclaimed."""
+    index = JOB_STAGES.index(stage)
+    now = datetime.utcnow()
+    update = {
+        f"stages.{index}.status": status,
+        "updated_at": now,
+        "lease_expires_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+    }
+    if status == "running":
+        update[f"stages.{index}.started_at"] = now
+    else:
+        update[f"stages.{index}.finished_at"] = now
+    if detail is not None:
+        update[f"stages.{index}.detail"] = detail
+    if status == "completed":
+        update["progress"] = (index + 1) / len(JOB_STAGES)
+    result = await db[JOBS_COLLECTION].update_one({**owner, "status": "running"}, {"$set": update})
+    if not result.matched_count:
+        raise JobLeaseLost(f"Study guide job {owner['_id']} was reclaimed by another worker")
+
+def _is_retryable(error: Exception) -> bool:
+    """Client errors (HTTPException 4xx, e.g. empty text or an unsupported type) won't change on a retry; anything else may be transient."""
+    return not (isinstance(error, HTTPException) and 400 <= error.status_code < 500)
+
+async def _reserve_study_guide_id(db: AsyncIOMotorDatabase, owner: dict, job_doc: dict) -> ObjectId:
+    """
+    The ID the job stores its study guide under, recorded on the job before the guide is
+    created: a rerun (requeued at shutdown, reclaimed, retried) finds the guide instead of creating a second one.
+    """
+    if job_doc.get("study_guide_id") is not None:
+        return job_doc["study_guide_id"]
+    study_guide_id = ObjectId()
+    result = await db[JOBS_COLLECTION].update_one({**owner, "status": "running"}, {"$set": {"study_guide_id": study_guide_id}})
+    if not result.matched_count:
+        raise JobLeaseLost(f"Study guide job {owner['_id']} was reclaimed by another worker")
+    job_doc["study_guide_id"] = study_guide_id
+    return study_guide_id
+
+async def _stored_study_guide(db: AsyncIOMotorDatabase, job_doc: dict) -> models.StudyGuideResponse | None:
+    """The study guide an earlier run of the job already stored, if any."""
+    if job_doc.get("study_guide_id") is None:
+        return None
+    document = await crud.get_workspace_study_guide_document(db, job_doc["workspace_id"], job_doc["study_guide_id"])
+    return models.StudyGuideResponse.model_validate(document) if document is not None else None
+
+def _error_detail(error: Exception) -> str:
+    """HTTPExceptions raised by the pipeline carry a user-facing detail; use it when present."""
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return str(error)
+
+@asynccontextmanager
+async def _job_stage(db: AsyncIOMotorDatabase, owner: dict, stage: str):
+    """Marks a stage running on entry and completed/failed on exit. Yields a dict for a progress detail."""
+    await _set_stage(db, owner, stage, "running")
+    stage_info = {"detail": None}
+    try:
+        yield stage_info
+    except JobLeaseLost:
+        raise
+    except Exception as e:
+        await _set_stage(db, owner, stage, "failed", detail=_error_detail(e))
+        raise
+    await _set_stage(db, owner, stage, "completed", detail=stage_info["detail"])
+
+# --- Pipeline ---
+
+async def run_study_guide_job(db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, job_doc: dict):
+    """
+    Runs the full pipeline for a claimed job: fetch the staged upload, extract text/images,
+    generate the study guide with Gemini, store it (GridFS + metadata) and link it to the workspace.
+    A job whose guide an earlier run already stored resumes at linking. Transient errors requeue
+    the job with a backoff until JOB_MAX_ATTEMPTS; client errors fail it at once.
+    """
+    job_id = job_doc["_id"]
+    owner = _job_owner(job_doc)
+    request_id = str(job_id)
+    workspace_id = str(job_doc["workspace_id"])
+    original_filename = job_doc["original_filename"]
+    extension = pipeline.get_extension(original_filename)
+    _, request_image_dir = pipeline.create_request_dirs(request_id)
+    spill_path = os.path.join(pipeline.TEMP_UPLOAD_DIR, request_id, f"upload{extension}")
+    saved_study_guide = None
+
+    logger.info(f"Running study guide job {job_id} ({original_filename}), attempt {job_doc.get('attempts')}")
+    heartbeat = asyncio.create_task(_heartbeat(db, owner))
+    try:
+        saved_study_guide = await _stored_study_guide(db, job_doc)
+        if saved_study_guide is not None:
+            logger.info(f"Study guide job {job_id} already stored study guide {saved_study_guide.id}; resuming at linking")
+            study_guide_main_sections = saved_study_guide.study_guide
+        else:
+            async with _job_stage(db, owner, "staging"):
+                # Small documents stay in memory; large ones are written to disk once
+                document_source = await pipeline.load_staged_upload(fs, job_doc["upload_gridfs_id"], spill_path)
+
+            async with _job_stage(db, owner, "extracting") as stage:
+                text_content, all_extracted_images_info, filtered_images_info = await pipeline.extract_document_in_pool(
+                    document_source, extension, request_image_dir
+                )
+                if not text_content.strip():
+                    raise HTTPException(status_code=400, detail="Extracted text content is empty.")
+                stage["detail"] = f"{len(all_extracted_images_info)} images extracted, {len(filtered_images_info)} kept after filtering"
+                dropped_summary = pipeline.summarize_filter_reasons(all_extracted_images_info)
+                if dropped_summary:
+                    stage["detail"] += f" (dropped: {dropped_summary})"
+
+            async with _job_stage(db, owner, "generating") as stage:
+                cache_key = compute_cache_key(text_content, filtered_images_info, request_image_dir)
+                study_guide_main_sections = await study_guide_cache.get(db, cache_key)
+                if study_guide_main_sections is not None:
+                    stage["detail"] = f"{len(study_guide_main_sections)} sections reused from cache"
+                else:
+                    prepared_images, image_report = await prepare_images_for_gemini(request_image_dir, filtered_images_info)
+                    study_guide_main_sections = await generate_study_guide_chunked(
+                        text_content, filtered_images_info, request_image_dir, prepared_images=prepared_images
+                    )
+                    await study_guide_cache.put(db, cache_key, study_guide_main_sections)
+                    stage["detail"] = (
+                        f"{len(study_guide_main_sections)} sections generated; images sent as "
+                        f"{image_report['prepared_bytes'] / 1e6:.2f} MB ({image_report['bytes_saved'] / 1e6:.2f} MB saved)"
+                    )
+
+            async with _job_stage(db, owner, "storing") as stage:
+                response_data = models.StudyGuideResponse(
+                    original_filename=original_filename,
+                    extracted_images=all_extracted_images_info, # Info for all originally extracted images
+                    study_guide=study_guide_main_sections,
+                    workspace_id=job_doc["workspace_id"]
+                )
+                filtered_image_paths = [os.path.join(request_image_dir, img_info.filename) for img_info in filtered_images_info]
+                response_data.id = await _reserve_study_guide_id(db, owner, job_doc)
+                saved_study_guide = await crud.create_study_guide(
+                    db=db,
+                    fs=fs,
+                    study_guide_data=response_data,
+                    original_pdf_path=None,
+                    image_paths=filtered_image_paths,
+                    original_gridfs_id=job_doc["upload_gridfs_id"] # Already in GridFS, don't upload again
+                )
+                if saved_study_guide.failed_image_uploads:
+                    stage["detail"] = f"{len(saved_study_guide.failed_image_uploads)} images could not be stored"
+
+        async with _job_stage(db, owner, "linking") as stage:
+            await pipeline.link_study_guide_to_workspace(db, workspace_id, saved_study_guide.id)
+            try:
+                topics_added, related_added = await knowledge_graph.add_study_guide_to_graph(
+                    db, job_doc["workspace_id"], saved_study_guide.id, original_filename, study_guide_main_sections
+                )
+                await knowledge_graph.ensure_topic_layout(db, job_doc["workspace_id"]) # Positions are ready when the job completes
+                stage["detail"] = f"{topics_added} topics added to the knowledge graph, {related_added} related edges"
+            except Exception as e:
+                # The graph is derived data; the study guide itself is complete
+                logger.warning(f"Could not add study guide {saved_study_guide.id} to the knowledge graph: {_error_detail(e)}")
+                stage["detail"] = "Knowledge graph not updated"
+
+        result = await db[JOBS_COLLECTION].update_one(
+            {**owner, "status": "running"},
+            {
+                "$set": {"status": "completed", "progress": 1.0, "study_guide_id": saved_study_guide.id, "error": None, "updated_at": datetime.utcnow()},
+                "$unset": {"lease_expires_at": ""},
+            }
+        )
+        if not result.matched_count:
+            raise JobLeaseLost(f"Study guide job {job_id} was reclaimed before it could complete")
+        logger.info(f"Study guide job {job_id} completed with study guide {saved_study_guide.id}")
+
+    except asyncio.CancelledError:
+        # Worker shutdown: hand the job back to the queue for another worker/process
+        await db[JOBS_COLLECTION].update_one(
+            {**owner, "status": "running"},
+            {"$set": {"status": "queued", "updated_at": datetime.utcnow()}, "$unset": {"lease_expires_at": ""}}
+        )
+        logger.info(f"Requeued study guide job {job_id} on shutdown")
+        raise
+    except JobLeaseLost as e:
+        # The job (and its staged upload) now belongs to the worker that reclaimed it
+        logger.warning(f"{e}; abandoning this run" + (f" (study guide {saved_study_guide.id} was already stored)" if saved_study_guide else ""))
+    except Exception as e:
+        attempts = job_doc.get("attempts", 1)
+        if _is_retryable(e) and attempts < settings.JOB_MAX_ATTEMPTS:
+            # The staged upload (and a guide already stored) are kept for the retry
+            delay = settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+            now = datetime.utcnow()
+            await db[JOBS_COLLECTION].update_one(
+                {**owner, "status": "running"},
+                {
+                    "$set": {"status": "queued", "error": _error_detail(e), "run_after": now + timedelta(seconds=delay), "updated_at": now},
+                    "$unset": {"lease_expires_at": ""},
+                }
+            )
+            logger.warning(f"Study guide job {job_id} failed (attempt {attempts} of {settings.JOB_MAX_ATTEMPTS}), retrying in {delay:.0f}s: {e}")
+            return
+        logger.error(f"Study guide job {job_id} failed: {e}")
+        result = await db[JOBS_COLLECTION].update_one(
+            {**owner, "status": "running"},
+            {"$set": {"status": "failed", "error": _error_detail(e), "updated_at": datetime.utcnow()}, "$unset": {"lease_expires_at": ""}}
+        )
+        if saved_study_guide is None and result.matched_count:
+            # Nothing references the staged upload, so don't leave it orphaned in GridFS
+            try:
+                await fs.delete(job_doc["upload_gridfs_id"])
+            except Exception as delete_err:
+                logger.warning(f"Could not delete staged upload for failed job {job_id}: {delete_err}")
+    finally:
+        heartbeat.cancel()
+        pipeline.cleanup_request_dirs(request_id)
+
+# --- Worker pool ---
+
+class JobWorkerPool:
+    """A bounded pool of asyncio workers that claim jobs from Mongo and run the pipeline."""
+
+    def __init__(self):
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def start(self, db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, concurrency: int):
+        """Starts `concurrency` workers on the running event loop."""
+        self._wakeup = asyncio.Event()
+        for i in range(concurrency):
+            worker_id = f"{self._worker_prefix}:{i}"
+            self._tasks.append(asyncio.create_task(self._run_worker(db, fs, worker_id)))
+        logger.info(f"Started {concurrency} study guide job workers")
+
+    async def stop(self):
+        """Cancels the workers; jobs they were running are requeued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        logger.info("Stopped study guide job workers")
+
+    def notify(self):
+        """Wakes idle workers in this process after a job was enqueued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _wait_for_work(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run_worker(self, db: AsyncIOMotorDatabase, fs: AsyncIOMotorGridFSBucket, worker_id: str):
+        while True:
+            try:
+                await fail_exhausted_jobs(db)
+                job_doc = await claim_next_job(db, worker_id)
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+                job_doc = None
+            if job_doc is None:
+                await self._wait_for_work()
+                continue
+            try:
+                await run_study_guide_job(db, fs, job_doc)
+            except Exception as e:
+                # E.g. Mongo unavailable while recording the failure; the lease expiry hands the job to a retry
+                logger.error(f"Job worker {worker_id} could not finish job {job_doc['_id']}: {e}")
+
+# Singleton pool, started and stopped by the app lifespan
+job_workers = JobWorkerPool()
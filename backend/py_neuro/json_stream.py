@@ -0,0 +1,82 @@
+# Incremental parser for a streamed top-level JSON array, e.g. Gemini's study guide response
+# arriving in chunks. Each array element is returned as soon as its closing bracket arrives.
+import json
+from typing import Any, List
+
+class JsonArrayStreamParser:
+    """
+    Feed text chunks with `feed()`; it returns the array elements completed by that chunk.
+    Anything before the opening `[` (such as a ```json fence) is skipped, and so is anything
+    after the closing `]`. Scanning is incremental: every character is looked at once.
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0 # Next character of _buffer to scan
+        self._started = False # Seen the array's opening "["
+        self.finished = False # Seen the array's closing "]"
+        self._depth = 0 # Nesting depth inside the current element
+        self._element_start = -1 # Buffer index where the current element starts
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Any]:
+        if self.finished:
+            return []
+        self._buffer += text
+        elements = []
+        buffer = self._buffer
+        i = self._position
+        while i < len(buffer):
+            char = buffer[i]
+            if not self._started:
+                if char == "[":
+                    self._started = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._element_start == -1:
+                # Between elements: skip whitespace and commas
+                if char == "]":
+                    self.finished = True
+                    break
+                if not char.isspace() and char != ",":
+                    self._element_start = i
+                    if char in "[{":
+                        self._depth = 1
+                    elif char == '"':
+                        self._in_string = True
+                        self._depth = 0
+                    else:
+                        self._depth = 0 # Scalar element; ends at the next "," or "]"
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                if self._depth == 0:
+                    # "]" ending the array right after a scalar element
+                    elements.append(json.loads(buffer[self._element_start:i]))
+                    self._element_start = -1
+                    self.finished = True
+                    break
+                self._depth -= 1
+            elif char == "," and self._depth == 0:
+                elements.append(json.loads(buffer[self._element_start:i]))
+                self._element_start = -1
+
+            if self._element_start != -1 and self._depth == 0 and not self._in_string and buffer[self._element_start] in '[{"' and i > self._element_start:
+                elements.append(json.loads(buffer[self._element_start:i + 1]))
+                self._element_start = -1
+            i += 1
+
+        # Drop everything that has been consumed to keep the buffer small
+        keep_from = self._element_start if self._element_start != -1 else i
+        self._buffer = buffer[keep_from:]
+        if self._element_start != -1:
+            self._element_start = 0
+        self._position = i - keep_from
+        return elements
@@ -0,0 +1,686 @@
+# Persistent topic graph (TopicNode/TopicEdge) of a workspace, stored in MongoDB
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from typing import Iterable, List
+
+import numpy as np
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from . import models
+from . import crud
+from .config import settings
+from .process_pool import process_pool
+from .topic_similarity import hash_term_counts, top_k_related
+from .graph_layout import layout_graph
+from .topic_spatial import TopicGridIndex, cluster_cell_size
+
+logger = logging.getLogger(__name__)
+
+TOPIC_NODES_COLLECTION = "topic_nodes"
+TOPIC_EDGES_COLLECTION = "topic_edges"
+TOPIC_VECTORS_COLLECTION = "topic_term_vectors" # Hashed term counts of subsection topics, for related edges
+# Per-workspace topic id sequence, kept on the workspace document
+TOPIC_ID_SEQUENCE_FIELD = "topic_id_seq"
+# Also on the workspace document: incremented on every change to the nodes/edges, and the
+# version the stored positions were computed for (the layout is cached until they differ)
+TOPIC_GRAPH_VERSION_FIELD = "topic_graph_version"
+TOPIC_LAYOUT_VERSION_FIELD = "topic_layout_version"
+
+# Documents are the API models plus workspace_id, study_guide_id, laid_out (False until the
+# layout has positioned the node) and the completion rollup fields: ancestors (ids from the root
+# down to the parent), leaf (no subtopics; progress is recorded on leaves), leaf_count and
+# completion_sum (over the leaves below, so completionPercentage = completion_sum / leaf_count).
+# These projections turn them back into models
+_ROLLUP_FIELDS = ("ancestors", "leaf", "leaf_count", "completion_sum")
+_NODE_PROJECTION = {"_id": 0, "workspace_id": 0, "study_guide_id": 0, "laid_out": 0} | {field: 0 for field in _ROLLUP_FIELDS}
+_EDGE_PROJECTION = {"_id": 0, "workspace_id": 0}
+_DUPLICATE_KEY = 11000
+
+async def reserve_topic_ids(db: AsyncIOMotorDatabase, workspace_id: ObjectId, count: int = 1) -> int | None:
+    """
+    Atomically reserves `count` consecutive topic ids in a workspace and returns the first,
+    or None if the workspace doesn't exist. Safe across processes: one $inc per reservation.
+    """
+    workspace = await db["workspaces"].find_one_and_update(
+        {"_id": workspace_id},
+        {"$inc": {TOPIC_ID_SEQUENCE_FIELD: count}},
+        projection={TOPIC_ID_SEQUENCE_FIELD: 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if workspace is None:
+        return None
+    return workspace[TOPIC_ID_SEQUENCE_FIELD] - count + 1
+
+async def _bump_graph_version(db: AsyncIOMotorDatabase, workspace_id: ObjectId):
+    await db["workspaces"].update_one({"_id": workspace_id}, {"$inc": {TOPIC_GRAPH_VERSION_FIELD: 1}})
+
+def _rollup_fields(nodes: List[models.TopicNode], parent_ancestors: dict[int, List[int]]) -> dict[int, dict]:
+    """
+    Rollup fields of a batch of new nodes: parents are either in the batch or existing topics
+    (with their ancestors in `parent_ancestors`). Rolls the batch's leaves up to its own nodes;
+    existing ancestors are the caller's to update.
+    """
+    by_id = {node.id: node for node in nodes}
+    ancestors: dict[int, List[int]] = {}
+
+    def path(node: models.TopicNode) -> List[int]:
+        if node.id not in ancestors:
+            parent_id = node.parentTopicId
+            if parent_id is None:
+                ancestors[node.id] = []
+            elif parent_id in by_id:
+                ancestors[node.id] = [*path(by_id[parent_id]), parent_id]
+            else:
+                ancestors[node.id] = [*parent_ancestors.get(parent_id, []), parent_id]
+        return ancestors[node.id]
+
+    parents = {node.parentTopicId for node in nodes}
+    fields = {node.id: {"ancestors": path(node), "leaf": node.id not in parents, "leaf_count": 0, "completion_sum": 0.0} for node in nodes}
+    for node in nodes:
+        if node.id not in parents:
+            for topic_id in [*fields[node.id]["ancestors"], node.id]:
+                if topic_id in fields:
+                    fields[topic_id]["leaf_count"] += 1
+                    fields[topic_id]["completion_sum"] += node.completionPercentage
+    for node in nodes:
+        node_fields = fields[node.id]
+        node.completionPercentage = node_fields["completion_sum"] / node_fields["leaf_count"] if node_fields["leaf_count"] else 0.0
+    return fields
+
+async def insert_topic_nodes(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    nodes: List[models.TopicNode],
+    study_guide_id: ObjectId | None = None,
+    parent_ancestors: dict[int, List[int]] | None = None
+):
+    """
+    Inserts nodes whose ids were reserved with reserve_topic_ids, in one round trip; their
+    positions are computed by the next ensure_topic_layout (see schedule_topic_layout).
+    `study_guide_id` marks nodes derived from a study guide (removed with it). Nodes whose
+    parent is an existing topic need its ancestors in `parent_ancestors`.
+    """
+    source = {"study_guide_id": study_guide_id} if study_guide_id is not None else {}
+    if nodes:
+        rollups = _rollup_fields(nodes, parent_ancestors or {})
+        await db[TOPIC_NODES_COLLECTION].insert_many(
+            [{"workspace_id": workspace_id, **node.model_dump(), **source, **rollups[node.id], "laid_out": False} for node in nodes],
+            ordered=False
+        )
+        await _bump_graph_version(db, workspace_id)
+
+async def insert_topic_edges(db: AsyncIOMotorDatabase, workspace_id: ObjectId, edges: Iterable[models.TopicEdge]) -> int:
+    """
+    Inserts edges in one unordered bulk write; edges that already exist are skipped
+    (unique index on workspace/source/target). Returns the number inserted.
+    """
+    documents = [{"workspace_id": workspace_id, **edge.model_dump()} for edge in edges]
+    if not documents:
+        return 0
+    try:
+        result = await db[TOPIC_EDGES_COLLECTION].insert_many(documents, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        if any(error["code"] != _DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+        inserted = e.details.get("nInserted", 0)
+    if inserted:
+        await _bump_graph_version(db, workspace_id)
+    return inserted
+
+async def create_topic(db: AsyncIOMotorDatabase, topic: models.TopicCreate) -> models.TopicNode | None:
+    """
+    Creates a topic (linked to its parent by an edge). It is returned at (0, 0) and placed by a
+    background layout. Returns None if the workspace doesn't exist; raises ValueError if the parent topic doesn't.
+    """
+    workspace_id = topic.workspaceId
+    parent = None
+    if topic.parentTopicId is not None:
+        parent = await db[TOPIC_NODES_COLLECTION].find_one(
+            {"workspace_id": workspace_id, "id": topic.parentTopicId}, {"_id": 0, "ancestors": 1}
+        )
+        if parent is None:
+            raise ValueError(f"Parent topic {topic.parentTopicId} not found")
+    topic_id = await reserve_topic_ids(db, workspace_id)
+    if topic_id is None:
+        return None
+    node = models.TopicNode(
+        id=topic_id,
+        name=topic.name,
+        x=0.0,
+        y=0.0,
+        completionPercentage=0.0, # New topics start at 0%
+        parentTopicId=topic.parentTopicId,
+        orderPosition=topic.orderPosition
+    )
+    if parent is None:
+        await insert_topic_nodes(db, workspace_id, [node])
+    else:
+        ancestors = [*parent.get("ancestors", []), topic.parentTopicId]
+        await insert_topic_nodes(db, workspace_id, [node], parent_ancestors={topic.parentTopicId: parent.get("ancestors", [])})
+        await insert_topic_edges(db, workspace_id, [models.TopicEdge(sourceTopicId=topic.parentTopicId, targetTopicId=topic_id)])
+        # The new leaf joins its ancestors' rollups. If the parent was a leaf, the new topic replaces
+        # it: same leaf count, minus the parent's own progress (no longer recorded once it's unset)
+        former_leaf = await db[TOPIC_NODES_COLLECTION].find_one_and_update(
+            {"workspace_id": workspace_id, "id": topic.parentTopicId, "leaf": True},
+            {"$set": {"leaf": False}},
+            projection={"_id": 0, "completion_sum": 1}
+        )
+        delta = (-former_leaf.get("completion_sum", 0.0), 0) if former_leaf is not None else (0.0, 1)
+        await _add_to_rollups(db, workspace_id, {ancestor: delta for ancestor in ancestors})
+    schedule_topic_layout(db, workspace_id)
+    document = await db[TOPIC_NODES_COLLECTION].find_one({"workspace_id": workspace_id, "id": topic_id}, _NODE_PROJECTION)
+    return models.TopicNode.model_validate(document)
+
+async def get_topic_nodes(db: AsyncIOMotorDatabase, workspace_id: ObjectId) -> List[dict]:
+    """All nodes of a workspace, by id (served from the (workspace_id, id) index)."""
+    cursor = db[TOPIC_NODES_COLLECTION].find({"workspace_id": workspace_id}, _NODE_PROJECTION).sort("id", 1)
+    return await cursor.to_list(None)
+
+async def get_topic_edges(db: AsyncIOMotorDatabase, workspace_id: ObjectId) -> List[dict]:
+    """All edges of a workspace."""
+    cursor = db[TOPIC_EDGES_COLLECTION].find({"workspace_id": workspace_id}, _EDGE_PROJECTION)
+    return await cursor.to_list(None)
+
+async def get_topic_neighbours(db: AsyncIOMotorDatabase, workspace_id: ObjectId, topic_id: int) -> models.TopicGraph:
+    """
+    Edges touching a topic and the nodes at their other ends: O(degree), one index range
+    per direction ((workspace_id, sourceTopicId) and (workspace_id, targetTopicId)).
+    """
+    cursor = db[TOPIC_EDGES_COLLECTION].find(
+        {"$or": [
+            {"workspace_id": workspace_id, "sourceTopicId": topic_id},
+            {"workspace_id": workspace_id, "targetTopicId": topic_id},
+        ]},
+        _EDGE_PROJECTION
+    )
+    edges = await cursor.to_list(None)
+    neighbour_ids = {edge["sourceTopicId"] for edge in edges} | {edge["targetTopicId"] for edge in edges}
+    neighbour_ids.discard(topic_id)
+    cursor = db[TOPIC_NODES_COLLECTION].find({"workspace_id": workspace_id, "id": {"$in": sorted(neighbour_ids)}}, _NODE_PROJECTION)
+    return models.TopicGraph(nodes=await cursor.to_list(None), edges=edges)
+
+async def get_topic_subtree(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    topic_id: int,
+    max_depth: int | None = None
+) -> models.TopicGraph | None:
+    """
+    A topic and its descendants (following parentTopicId) with the parent-child edges between
+    them, in one $graphLookup; each level is an index lookup on (workspace_id, parentTopicId).
+    Returns None if the topic doesn't exist.
+    """
+    graph_lookup = {
+        "from": TOPIC_NODES_COLLECTION,
+        "startWith": "$id",
+        "connectFromField": "id",
+        "connectToField": "parentTopicId",
+        "as": "descendants",
+        "restrictSearchWithMatch": {"workspace_id": workspace_id},
+    }
+    if max_depth is not None:
+        graph_lookup["maxDepth"] = max_depth - 1 # maxDepth 0 = children only
+    pipeline = [
+        {"$match": {"workspace_id": workspace_id, "id": topic_id}},
+        {"$graphLookup": graph_lookup},
+        {"$project": _NODE_PROJECTION | {f"descendants.{field}": 0 for field in _NODE_PROJECTION}},
+    ]
+    documents = await db[TOPIC_NODES_COLLECTION].aggregate(pipeline).to_list(1)
+    if not documents:
+        return None
+    root = documents[0]
+    descendants = sorted(root.pop("descendants"), key=lambda node: (node["parentTopicId"], node["orderPosition"], node["id"]))
+    nodes = [root, *descendants]
+    edges = [models.TopicEdge(sourceTopicId=node["parentTopicId"], targetTopicId=node["id"]) for node in descendants]
+    return models.TopicGraph(nodes=nodes, edges=edges)
+
+# --- Completion rollups ---
+
+# completionPercentage recomputed from the rollup fields after they were incremented
+_COMPLETION_FROM_ROLLUP = {"$set": {"completionPercentage": {
+    "$cond": [{"$gt": ["$leaf_count", 0]}, {"$divide": ["$completion_sum", "$leaf_count"]}, 0.0]
+}}}
+
+async def _add_to_rollups(db: AsyncIOMotorDatabase, workspace_id: ObjectId, deltas: dict[int, tuple[float, int]]):
+    """
+    Adds (completion sum, leaf count) deltas to topics, one update per topic in a single bulk
+    write. Additions commute, so concurrent writers (other processes) can't lose each other's
+    updates; completionPercentage is derived in the same (pipeline) update.
+    """
+    updates = [
+        UpdateOne({"workspace_id": workspace_id, "id": topic_id}, [
+            {"$set": {
+                "completion_sum": {"$add": [{"$ifNull": ["$completion_sum", 0.0]}, completion]},
+                "leaf_count": {"$add": [{"$ifNull": ["$leaf_count", 0]}, leaves]},
+            }},
+            _COMPLETION_FROM_ROLLUP,
+        ])
+        for topic_id, (completion, leaves) in deltas.items() if completion or leaves
+    ]
+    if updates:
+        await db[TOPIC_NODES_COLLECTION].bulk_write(updates, ordered=False)
+
+async def _set_leaf_progress(db: AsyncIOMotorDatabase, workspace_id: ObjectId, topic_id: int, completion: float) -> tuple[List[int], float] | None:
+    """Sets a leaf topic's completion; returns its ancestors and the change, or None if it isn't a leaf topic."""
+    previous = await db[TOPIC_NODES_COLLECTION].find_one_and_update(
+        {"workspace_id": workspace_id, "id": topic_id, "leaf": True},
+        {"$set": {"completion_sum": completion, "completionPercentage": completion}},
+        projection={"_id": 0, "ancestors": 1, "completion_sum": 1}
+    )
+    if previous is None:
+        return None
+    return previous.get("ancestors", []), completion - previous.get("completion_sum", 0.0)
+
+class TopicProgressNotApplied(Exception):
+    """
+    Part of a progress batch wasn't written. Retry with apply_topic_progress(progress, deltas):
+    `progress` holds the leaf completions not set, `deltas` the changes not yet added to their
+    ancestors (leaves already set won't produce them again).
+    """
+    def __init__(self, message: str, progress: dict[int, float], deltas: dict[int, float]):
+        super().__init__(message)
+        self.progress = progress
+        self.deltas = deltas
+
+async def apply_topic_progress(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    progress: dict[int, float],
+    ancestor_deltas: dict[int, float] | None = None
+) -> int:
+    """
+    Records the completion of leaf topics (subsections) and rolls the changes up their parent
+    chains: one update per leaf, then one per distinct ancestor with the summed change, so a
+    batch touching many leaves of the same section updates it (and its guide) once.
+    `ancestor_deltas` are changes left over from a batch that failed (TopicProgressNotApplied).
+    Topics that don't exist or have subtopics are skipped. Returns the number of topics updated.
+    """
+    results = await asyncio.gather(*(
+        _set_leaf_progress(db, workspace_id, topic_id, completion) for topic_id, completion in progress.items()
+    ), return_exceptions=True)
+    deltas: dict[int, float] = dict(ancestor_deltas or {})
+    failed: dict[int, float] = {}
+    error = None
+    applied = 0
+    for (topic_id, completion), result in zip(progress.items(), results):
+        if isinstance(result, Exception):
+            failed[topic_id], error = completion, result
+            continue
+        if result is None:
+            continue
+        applied += 1
+        ancestors, change = result
+        for ancestor in ancestors:
+            deltas[ancestor] = deltas.get(ancestor, 0.0) + change
+    unapplied = {ancestor: change for ancestor, change in deltas.items() if change}
+    try:
+        await _add_to_rollups(db, workspace_id, {ancestor: (change, 0) for ancestor, change in unapplied.items()})
+        unapplied = {}
+    except BulkWriteError as e:
+        # Unordered: the other ancestors were updated; keep only the failed ones (same order as the updates)
+        ancestors = list(unapplied)
+        unapplied = {ancestors[write_error["index"]]: unapplied[ancestors[write_error["index"]]] for write_error in e.details.get("writeErrors", [])}
+        error = e
+    except Exception as e:
+        # Unknown which updates were applied: all are retried (rebuild_topic_rollups repairs a double count)
+        error = e
+    if failed or unapplied:
+        raise TopicProgressNotApplied(
+            f"{len(failed)} topics and {len(unapplied)} ancestor rollups of workspace {workspace_id} not updated: {error}",
+            failed, unapplied
+        ) from error
+    if applied < len(progress):
+        logger.info(f"Skipped progress for {len(progress) - applied} unknown or non-leaf topics of workspace {workspace_id}")
+    return applied
+
+async def rebuild_topic_rollups(db: AsyncIOMotorDatabase, workspace_id: ObjectId) -> int:
+    """
+    Recomputes every topic's rollup fields and completionPercentage from the leaves' progress
+    (repairs drift, e.g. a batch interrupted between the leaf and ancestor updates, and fills in
+    topics created before rollups existed). Returns the number of topics.
+    """
+    nodes = await db[TOPIC_NODES_COLLECTION].find(
+        {"workspace_id": workspace_id}, {"_id": 0, "id": 1, "parentTopicId": 1, "leaf": 1, "completion_sum": 1, "completionPercentage": 1}
+    ).to_list(None)
+    topic_nodes = [
+        models.TopicNode(
+            id=node["id"], name="", x=0.0, y=0.0, parentTopicId=node.get("parentTopicId"),
+            # A leaf's own progress; topics that weren't leaves before have none
+            completionPercentage=node.get("completion_sum", node["completionPercentage"]) if node.get("leaf", True) else 0.0
+        )
+        for node in nodes
+    ]
+    known = {node.id for node in topic_nodes}
+    for node in topic_nodes:
+        if node.parentTopicId not in known:
+            node.parentTopicId = None # Orphaned (e.g. its study guide was deleted): a root of its own
+    if topic_nodes:
+        rollups = _rollup_fields(topic_nodes, {})
+        await db[TOPIC_NODES_COLLECTION].bulk_write([
+            UpdateOne({"workspace_id": workspace_id, "id": node.id}, {"$set": {**rollups[node.id], "completionPercentage": node.completionPercentage}})
+            for node in topic_nodes
+        ], ordered=False)
+    return len(topic_nodes)
+
+# --- Topics derived from study guides ---
+
+async def add_study_guide_to_graph(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    study_guide_id: ObjectId,
+    original_filename: str,
+    sections: List[models.StudyGuideSection]
+) -> tuple[int, int]:
+    """
+    Adds a study guide's topic tree to the workspace graph (guide -> sections -> subsections)
+    plus "related" edges from each new subsection to its most similar subsections of the
+    workspace's other guides. Only the new guide is processed: existing nodes and edges are
+    left as they are. The new topics aren't laid out yet: callers run ensure_topic_layout or
+    schedule_topic_layout. Returns (nodes added, related edges added).
+    """
+    await remove_study_guide_from_graph(db, study_guide_id) # A retried job starts over
+    subsection_count = sum(len(section.subsections) for section in sections)
+    node_count = 1 + len(sections) + subsection_count
+    first_id = await reserve_topic_ids(db, workspace_id, node_count)
+    if first_id is None:
+        return 0, 0
+    topic_ids = iter(range(first_id, first_id + node_count))
+
+    def new_node(name: str, parent_id: int | None, order: int) -> models.TopicNode:
+        return models.TopicNode(
+            id=next(topic_ids), name=name, x=0.0, y=0.0, completionPercentage=0.0,
+            parentTopicId=parent_id, orderPosition=order
+        )
+
+    root = new_node(original_filename, None, 0)
+    nodes, edges, subsection_ids, texts = [root], [], [], []
+    for section_index, section in enumerate(sections):
+        section_node = new_node(section.section_title, root.id, section_index)
+        nodes.append(section_node)
+        edges.append(models.TopicEdge(sourceTopicId=root.id, targetTopicId=section_node.id))
+        for subsection_index, subsection in enumerate(section.subsections):
+            subsection_node = new_node(subsection.subsection_title, section_node.id, subsection_index)
+            nodes.append(subsection_node)
+            edges.append(models.TopicEdge(sourceTopicId=section_node.id, targetTopicId=subsection_node.id))
+            subsection_ids.append(subsection_node.id)
+            texts.append(f"{subsection.subsection_title}\n{subsection.explanation}")
+
+    n_features = settings.TOPIC_SIMILARITY_FEATURES
+    new_vectors = await process_pool.run(hash_term_counts, texts, n_features) if texts else []
+    existing = await db[TOPIC_VECTORS_COLLECTION].find(
+        {"workspace_id": workspace_id, "features": n_features}, {"_id": 0, "topic_id": 1, "terms": 1, "counts": 1}
+    ).to_list(None)
+    related = []
+    if new_vectors and existing:
+        pairs = await process_pool.run(
+            top_k_related,
+            new_vectors,
+            [(vector["terms"], vector["counts"]) for vector in existing],
+            n_features,
+            settings.TOPIC_RELATED_TOP_K,
+            settings.TOPIC_RELATED_MIN_SIMILARITY
+        )
+        related = [
+            models.TopicEdge(
+                sourceTopicId=subsection_ids[new_index], targetTopicId=existing[existing_index]["topic_id"],
+                kind="related", weight=round(similarity, 4)
+            )
+            for new_index, existing_index, similarity in pairs
+        ]
+
+    await insert_topic_nodes(db, workspace_id, nodes, study_guide_id=study_guide_id)
+    await insert_topic_edges(db, workspace_id, edges + related)
+    if new_vectors:
+        await db[TOPIC_VECTORS_COLLECTION].insert_many([
+            {
+                "workspace_id": workspace_id, "study_guide_id": study_guide_id, "topic_id": topic_id,
+                "features": n_features, "terms": terms, "counts": counts
+            }
+            for topic_id, (terms, counts) in zip(subsection_ids, new_vectors)
+        ], ordered=False)
+    logger.info(f"Added {len(nodes)} topics and {len(related)} related edges of study guide {study_guide_id} to workspace {workspace_id}")
+    return len(nodes), len(related)
+
+async def add_missing_study_guides_to_graph(db: AsyncIOMotorDatabase, workspace_id: ObjectId) -> tuple[int, int]:
+    """
+    Adds the workspace's study guides that aren't in its graph yet (e.g. created before the graph
+    existed), one at a time. Returns (study guides added, nodes added).
+    """
+    in_graph = await db[TOPIC_NODES_COLLECTION].distinct("study_guide_id", {"workspace_id": workspace_id})
+    cursor = db[crud.STUDY_GUIDE_COLLECTION].find(
+        {"workspace_id": workspace_id, "_id": {"$nin": in_graph}, "generation_status": {"$nin": ["generating", "failed"]}},
+        {"_id": 1}
+    ).sort("_id", 1)
+    added, node_total = 0, 0
+    async for guide in cursor:
+        document = await crud.get_workspace_study_guide_document(db, workspace_id, guide["_id"])
+        if document is None:
+            continue # Deleted meanwhile
+        study_guide = models.StudyGuideResponse.model_validate(document)
+        nodes, _ = await add_study_guide_to_graph(db, workspace_id, study_guide.id, study_guide.original_filename, study_guide.study_guide)
+        added += 1
+        node_total += nodes
+    if added:
+        schedule_topic_layout(db, workspace_id)
+    return added, node_total
+
+async def remove_study_guide_from_graph(db: AsyncIOMotorDatabase, study_guide_id: ObjectId):
+    """Deletes the topics derived from a study guide, with every edge touching them."""
+    topic_documents = await db[TOPIC_NODES_COLLECTION].find(
+        {"study_guide_id": study_guide_id}, {"_id": 0, "workspace_id": 1, "id": 1}
+    ).to_list(None)
+    if topic_documents:
+        workspace_id = topic_documents[0]["workspace_id"]
+        topic_ids = [document["id"] for document in topic_documents]
+        await db[TOPIC_EDGES_COLLECTION].delete_many({"$or": [
+            {"workspace_id": workspace_id, "sourceTopicId": {"$in": topic_ids}},
+            {"workspace_id": workspace_id, "targetTopicId": {"$in": topic_ids}},
+        ]})
+        await db[TOPIC_NODES_COLLECTION].delete_many({"study_guide_id": study_guide_id})
+        await _bump_graph_version(db, workspace_id)
+        schedule_topic_layout(db, workspace_id) # Nothing moves, but the viewport index drops the topics
+    await db[TOPIC_VECTORS_COLLECTION].delete_many({"study_guide_id": study_guide_id})
+
+# --- Layout ---
+
+# One layout at a time per workspace in this process
+_layout_locks: "weakref.WeakValueDictionary[ObjectId, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+async def ensure_topic_layout(db: AsyncIOMotorDatabase, workspace_id: ObjectId, full: bool = False) -> bool:
+    """
+    Brings the stored node positions up to date with the graph version. Nodes added since the
+    last layout are placed around their pinned neighbours (incremental); `full` relayouts every
+    node. Positions are kept until the graph changes again. Returns whether a layout ran.
+    """
+    lock = _layout_locks.setdefault(workspace_id, asyncio.Lock())
+    async with lock:
+        workspace = await db["workspaces"].find_one(
+            {"_id": workspace_id}, {TOPIC_GRAPH_VERSION_FIELD: 1, TOPIC_LAYOUT_VERSION_FIELD: 1}
+        )
+        if workspace is None:
+            return False
+        version = workspace.get(TOPIC_GRAPH_VERSION_FIELD, 0)
+        if not full and workspace.get(TOPIC_LAYOUT_VERSION_FIELD) == version:
+            return False
+
+        nodes = await db[TOPIC_NODES_COLLECTION].find(
+            {"workspace_id": workspace_id}, {"_id": 0, "id": 1, "x": 1, "y": 1, "laid_out": 1}
+        ).sort("id", 1).to_list(None)
+        edges = await db[TOPIC_EDGES_COLLECTION].find(
+            {"workspace_id": workspace_id}, {"_id": 0, "sourceTopicId": 1, "targetTopicId": 1}
+        ).to_list(None)
+        topic_ids = np.array([node["id"] for node in nodes], dtype=np.int64)
+        placed = np.array([node.get("laid_out", False) for node in nodes], dtype=bool)
+        pinned = placed.copy() if not full else np.zeros(len(nodes), dtype=bool)
+        if pinned.sum() < len(nodes) / 2:
+            pinned[:] = False # Mostly new: lay out everything, starting from the known positions
+
+        ran = not pinned.all()
+        if ran:
+            edge_ids = np.array([(edge["sourceTopicId"], edge["targetTopicId"]) for edge in edges], dtype=np.int64).reshape(-1, 2)
+            edge_index = np.searchsorted(topic_ids, edge_ids).clip(max=max(len(topic_ids) - 1, 0))
+            edge_index = edge_index[(topic_ids[edge_index] == edge_ids).all(axis=1)] if len(topic_ids) else edge_index[:0]
+            positions = np.array([(node["x"], node["y"]) for node in nodes], dtype=np.float64).reshape(-1, 2)
+            positions[~placed] = np.nan
+            positions = await process_pool.run(
+                layout_graph, len(nodes), edge_index, positions, pinned,
+                k=settings.TOPIC_LAYOUT_EDGE_LENGTH,
+                iterations=settings.TOPIC_LAYOUT_ITERATIONS,
+                theta=settings.TOPIC_LAYOUT_THETA
+            )
+            moved = np.flatnonzero(~pinned)
+            await db[TOPIC_NODES_COLLECTION].bulk_write([
+                UpdateOne(
+                    {"workspace_id": workspace_id, "id": int(topic_ids[i])},
+                    {"$set": {"x": float(positions[i, 0]), "y": float(positions[i, 1]), "laid_out": True}}
+                )
+                for i in moved
+            ], ordered=False)
+            logger.info(f"Laid out {len(moved)} of {len(nodes)} topics of workspace {workspace_id} (graph version {version})")
+        # $max: a slower concurrent layout (another process) can't move the version backwards
+        await db["workspaces"].update_one({"_id": workspace_id}, {"$max": {TOPIC_LAYOUT_VERSION_FIELD: version}})
+        return ran
+
+# Background layouts, one task per workspace; a change during a layout runs it once more
+_layout_tasks: dict[ObjectId, asyncio.Task] = {}
+_layout_reruns: set[ObjectId] = set()
+
+def schedule_topic_layout(db: AsyncIOMotorDatabase, workspace_id: ObjectId):
+    """
+    Brings the positions up to date in a background task after the graph changed. Reads never
+    wait for a layout: they serve the last positions (new topics at their stored coordinates,
+    and outside viewports) until it finishes.
+    """
+    if workspace_id in _layout_tasks:
+        _layout_reruns.add(workspace_id)
+        return
+    _layout_tasks[workspace_id] = asyncio.create_task(_layout_in_background(db, workspace_id))
+
+async def _layout_in_background(db: AsyncIOMotorDatabase, workspace_id: ObjectId):
+    try:
+        while True:
+            _layout_reruns.discard(workspace_id)
+            try:
+                await ensure_topic_layout(db, workspace_id)
+            except Exception as e:
+                # Positions are derived data: the next change (or POST .../layout) retries
+                logger.warning(f"Background layout of workspace {workspace_id} failed: {e}")
+            if workspace_id not in _layout_reruns:
+                break
+    finally:
+        _layout_tasks.pop(workspace_id, None)
+
+async def cancel_topic_layouts():
+    """Cancels background layouts still running at shutdown (a later change lays the graph out again)."""
+    tasks = list(_layout_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # A task cancelled before it started never ran its cleanup
+    _layout_tasks.clear()
+    _layout_reruns.clear()
+
+# --- Viewport queries ---
+
+# Spatial index per workspace, with the layout version it was built for (LRU, per process)
+_grid_indexes: "OrderedDict[ObjectId, tuple[int, TopicGridIndex]]" = OrderedDict()
+_grid_locks: "weakref.WeakValueDictionary[ObjectId, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+async def _load_grid_index(db: AsyncIOMotorDatabase, workspace_id: ObjectId) -> TopicGridIndex | None:
+    """The workspace's spatial index, rebuilt only when its layout version changed. None if the workspace doesn't exist."""
+    lock = _grid_locks.setdefault(workspace_id, asyncio.Lock())
+    async with lock:
+        workspace = await db["workspaces"].find_one({"_id": workspace_id}, {TOPIC_GRAPH_VERSION_FIELD: 1, TOPIC_LAYOUT_VERSION_FIELD: 1})
+        if workspace is None:
+            return None
+        version = workspace.get(TOPIC_LAYOUT_VERSION_FIELD, 0)
+        if version != workspace.get(TOPIC_GRAPH_VERSION_FIELD, 0):
+            schedule_topic_layout(db, workspace_id) # E.g. the process laying it out stopped
+        cached = _grid_indexes.get(workspace_id)
+        if cached is not None and cached[0] == version:
+            _grid_indexes.move_to_end(workspace_id)
+            return cached[1]
+
+        nodes = await db[TOPIC_NODES_COLLECTION].find(
+            {"workspace_id": workspace_id, "laid_out": True}, {"_id": 0, "id": 1, "x": 1, "y": 1, "name": 1}
+        ).sort("id", 1).to_list(None)
+        edges = await db[TOPIC_EDGES_COLLECTION].find({"workspace_id": workspace_id}, _EDGE_PROJECTION).to_list(None)
+        topic_ids = np.array([node["id"] for node in nodes], dtype=np.int64)
+        positions = np.array([(node["x"], node["y"]) for node in nodes], dtype=np.float64).reshape(-1, 2)
+        edge_ids = np.array([(edge["sourceTopicId"], edge["targetTopicId"]) for edge in edges], dtype=np.int64).reshape(-1, 2)
+        if len(topic_ids):
+            edge_index = np.searchsorted(topic_ids, edge_ids).clip(max=len(topic_ids) - 1)
+            known = (topic_ids[edge_index] == edge_ids).all(axis=1) # Both ends laid out
+        else:
+            edge_index, known = edge_ids[:0], np.zeros(0, dtype=bool)
+        index = TopicGridIndex(
+            topic_ids, positions, [node["name"] for node in nodes], edge_index[known],
+            [edge.get("kind", "child") for edge, keep in zip(edges, known) if keep],
+            [edge.get("weight") for edge, keep in zip(edges, known) if keep]
+        )
+        _grid_indexes[workspace_id] = (version, index)
+        _grid_indexes.move_to_end(workspace_id)
+        while len(_grid_indexes) > max(settings.TOPIC_VIEWPORT_CACHED_GRAPHS, 1):
+            _grid_indexes.popitem(last=False)
+        return index
+
+async def get_topic_viewport(
+    db: AsyncIOMotorDatabase,
+    workspace_id: ObjectId,
+    min_x: float,
+    min_y: float,
+    max_x: float,
+    max_y: float,
+    max_nodes: int
+) -> models.TopicViewport | None:
+    """
+    The topics inside a box, so the response grows with what is on screen rather than with the
+    graph. Up to `max_nodes` topics are returned as nodes, with the edges touching them and the
+    topics at their other ends (so edges leaving the box can be drawn); beyond that, as about
+    `max_nodes` grid clusters and the edges between them. Node documents are read by id, so
+    completion percentages are current even though the index is cached per layout version.
+    Only laid-out topics are included. Returns None if the workspace doesn't exist.
+    """
+    index = await _load_grid_index(db, workspace_id)
+    if index is None:
+        return None
+    visible = index.query(min_x, min_y, max_x, max_y)
+    viewport = models.TopicViewport(total=len(visible), clustered=len(visible) > max_nodes, bounds=list(index.bounds))
+    if viewport.clustered:
+        centroids, counts, labels, pairs, edge_counts = index.clusters(visible, cluster_cell_size(max_x - min_x, max_y - min_y, max_nodes))
+        viewport.clusters = [
+            models.TopicCluster(x=float(x), y=float(y), count=int(count), topicId=int(index.topic_ids[label]), name=index.names[label])
+            for (x, y), count, label in zip(centroids, counts, labels)
+        ]
+        viewport.clusterEdges = [
+            models.TopicClusterEdge(sourceCluster=int(source), targetCluster=int(target), count=int(count))
+            for (source, target), count in zip(pairs, edge_counts)
+        ]
+        return viewport
+
+    edge_index = index.edges_touching(visible)
+    viewport.edges = [
+        models.TopicEdge(
+            sourceTopicId=int(index.topic_ids[index.edges[i, 0]]), targetTopicId=int(index.topic_ids[index.edges[i, 1]]),
+            kind=index.edge_kinds[i], weight=index.edge_weights[i]
+        )
+        for i in edge_index
+    ]
+    node_ids = np.union1d(index.topic_ids[visible], index.topic_ids[index.edges[edge_index].ravel()])
+    cursor = db[TOPIC_NODES_COLLECTION].find({"workspace_id": workspace_id, "id": {"$in": node_ids.tolist()}}, _NODE_PROJECTION).sort("id", 1)
+    viewport.nodes = [models.TopicNode.model_validate(document) for document in await cursor.to_list(None)]
+    return viewport
+
+async def delete_workspace_graph(db: AsyncIOMotorDatabase, workspace_id: ObjectId):
+    """Deletes all nodes and edges of a workspace."""
+    await db[TOPIC_NODES_COLLECTION].delete_many({"workspace_id": workspace_id})
+    await db[TOPIC_EDGES_COLLECTION].delete_many({"workspace_id": workspace_id})
+    await db[TOPIC_VECTORS_COLLECTION].delete_many({"workspace_id": workspace_id})
+    _grid_indexes.pop(workspace_id, None)
@@ -1,7 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import knowledge_graph, topics, study_guide, workspaces, files
-from .database import connect_to_mongo, close_mongo_connection
+from .routers import knowledge_graph, topics, study_guide, workspaces, files, jobs, metrics
+from .database import connect_to_mongo, close_mongo_connection, db_instance
+from .jobs import job_workers
+from .process_pool import process_pool
+from .study_guide_stream import cancel_streaming_generations
+from .knowledge_graph import cancel_topic_layouts
+from .topic_progress import topic_progress
+from .config import settings
 from contextlib import asynccontextmanager
 
 
@@ -11,9 +17,16 @@ async def lifespan(app: FastAPI):
     # Startup
     try:
         await connect_to_mongo()
+        await job_workers.start(db_instance.db, db_instance.fs, settings.JOB_WORKER_CONCURRENCY)
+        await topic_progress.start(db_instance.db)
         yield
     finally:
         # Shutdown
+        await job_workers.stop()
+        await topic_progress.stop()
+        await cancel_streaming_generations()
+        await cancel_topic_layouts()
+        process_pool.shutdown()
         await close_mongo_connection()
 
 
@@ -36,6 +49,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # Pagination cursor of GET /api/workspaces/
 )
 
 # Include routers
@@ -45,6 +59,8 @@ app.include_router(knowledge_graph.router, prefix="/api", tags=["Knowledge Graph
 app.include_router(topics.router, prefix="/api/topics", tags=["Topics"])
 # app.include_router(study_guide.router, prefix="/api/study-guides", tags=["Study Guides"])
 app.include_router(files.router, prefix="/api/files", tags=["Files"]) # Include files router
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["Metrics"])
 
 @app.get("/")
 async def read_root():
@@ -0,0 +1,24 @@
+# In-process counters exposed at GET /api/metrics (per API process; not aggregated across processes)
+import threading
+from collections import defaultdict
+
+class Counters:
+    """Thread-safe named counters."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[str, int] = defaultdict(int)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._values[name] += amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(sorted(self._values.items()))
+
+# Singleton shared by the whole process
+counters = Counters()
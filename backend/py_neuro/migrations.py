@@ -0,0 +1,92 @@
+# One-off data migrations, run at startup until they have completed once on a database
+# (each is also idempotent: a migrated database matches nothing)
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .crud import STUDY_GUIDE_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "migrations" # {_id: migration name, completed_at, changed}
+_BATCH_SIZE = 500
+
+def _object_id(value):
+    return ObjectId(value) if isinstance(value, str) and ObjectId.is_valid(value) else value
+
+def _converted_images(images: list) -> list:
+    converted = []
+    for image in images:
+        image = {**image, "gridfs_id": _object_id(image.get("gridfs_id"))}
+        if image.get("thumbnails"):
+            image["thumbnails"] = [{**thumbnail, "gridfs_id": _object_id(thumbnail.get("gridfs_id"))} for thumbnail in image["thumbnails"]]
+        converted.append(image)
+    return converted
+
+async def convert_string_object_ids(db: AsyncIOMotorDatabase) -> int:
+    """
+    Study guides stored while PyObjectId serialized to str in model_dump() reference their
+    workspace and GridFS files by string, so ObjectId queries (ownership checks, $lookup,
+    refcount release) don't match them. Rewrites those fields as ObjectIds. Returns the number
+    of study guides converted.
+    """
+    cursor = db[STUDY_GUIDE_COLLECTION].find(
+        {"$or": [
+            {"workspace_id": {"$type": "string"}},
+            {"original_pdf_gridfs_id": {"$type": "string"}},
+            {"extracted_images.gridfs_id": {"$type": "string"}},
+            {"extracted_images.thumbnails.gridfs_id": {"$type": "string"}},
+        ]},
+        {"workspace_id": 1, "original_pdf_gridfs_id": 1, "extracted_images": 1}
+    )
+    converted, updates = 0, []
+    async for document in cursor:
+        fields = {"workspace_id": _object_id(document.get("workspace_id"))}
+        if document.get("original_pdf_gridfs_id") is not None:
+            fields["original_pdf_gridfs_id"] = _object_id(document["original_pdf_gridfs_id"])
+        if document.get("extracted_images"):
+            fields["extracted_images"] = _converted_images(document["extracted_images"])
+        updates.append(UpdateOne({"_id": document["_id"]}, {"$set": fields}))
+        if len(updates) >= _BATCH_SIZE:
+            converted += (await db[STUDY_GUIDE_COLLECTION].bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        converted += (await db[STUDY_GUIDE_COLLECTION].bulk_write(updates, ordered=False)).modified_count
+    if converted:
+        logger.info(f"Converted string ObjectId references of {converted} study guides")
+    return converted
+
+async def drop_workspaces_created_at_index(db: AsyncIOMotorDatabase) -> int:
+    """
+    Workspace listing sorted by created_at pages on `_id` (insertion order; older workspaces
+    have no created_at), so the created_at index was never used but cost every insert.
+    Returns 1 if it was dropped.
+    """
+    if "created_at_1" not in await db["workspaces"].index_information():
+        return 0
+    await db["workspaces"].drop_index("created_at_1")
+    logger.info("Dropped the unused workspaces.created_at index")
+    return 1
+
+# Run in order; names are recorded in MIGRATIONS_COLLECTION, so never rename one
+MIGRATIONS = [
+    ("convert_string_object_ids", convert_string_object_ids),
+    ("drop_workspaces_created_at_index", drop_workspaces_created_at_index),
+]
+
+async def run_migrations(db: AsyncIOMotorDatabase):
+    """
+    Runs the migrations not yet recorded as completed. Their queries scan whole collections
+    (unindexed fields), so this happens once per database rather than on every startup.
+    """
+    for name, migration in MIGRATIONS:
+        if await db[MIGRATIONS_COLLECTION].find_one({"_id": name}, {"_id": 1}) is not None:
+            continue
+        changed = await migration(db)
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": name}, {"$set": {"completed_at": datetime.utcnow(), "changed": changed}}, upsert=True
+        )
+        logger.info(f"Migration {name} completed ({changed} documents changed)")
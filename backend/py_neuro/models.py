@@ -2,7 +2,7 @@
 # from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, Field, GetJsonSchemaHandler
 from pydantic_core import core_schema
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Literal
 from datetime import datetime
 from bson import ObjectId # Import ObjectId
 
@@ -37,7 +37,8 @@ class PyObjectId(ObjectId):
                 core_schema.is_instance_schema(ObjectId),
                 from_input_schema # Reuse validation logic for Python objects
             ]),
-            serialization=core_schema.plain_serializer_function_ser_schema(lambda x: str(x)),
+            # Strings in JSON only; model_dump() keeps ObjectIds so documents written to Mongo reference by _id
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda x: str(x), when_used="json"),
         )
 
     @classmethod
@@ -84,6 +85,17 @@ class Workspace(WorkspaceBase):
             }
         }
 
+# Model for one entry of the paginated workspace listing; study guides as IDs, a count, or left out
+class WorkspaceSummary(WorkspaceBase):
+    id: PyObjectId = Field(alias="_id")
+    created_at: datetime
+    study_guides: Optional[List[PyObjectId]] = None
+    study_guide_count: Optional[int] = None
+
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
+
 # Model for returning workspace with populated study guides
 class WorkspaceWithPopulatedStudyGuides(Workspace):
     # Override study_guides to expect full StudyGuideResponse objects
@@ -105,32 +117,106 @@ class WorkspaceWithPopulatedStudyGuides(Workspace):
          }
 
 
-# --- Topics Models (Keep if still needed, or remove if study guide handles hierarchy) ---
+# Lightweight study guide entry for workspace fetches (GET /api/workspaces/{id} without expand)
+class StudyGuideSummary(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    original_filename: str
+    section_titles: List[str]
+    image_count: int
+    original_pdf_gridfs_id: Optional[PyObjectId] = None
+    generation_status: Optional[str] = None
+
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
+
+class WorkspaceWithStudyGuideSummaries(Workspace):
+    study_guides: Optional[List[StudyGuideSummary]] = Field(default_factory=list)
+
+
+# --- Topics Models (knowledge graph of a workspace, see knowledge_graph.py) ---
 class TopicNode(BaseModel):
-    id: int # Note: This might change if Topics become Mongo documents with ObjectId
+    id: int # Sequential per workspace (knowledge_graph.reserve_topic_ids)
     name: str
     x: float
     y: float
+    # Fraction completed, 0.0 to 1.0 despite the name (a leaf's recorded progress; above it, the mean of the leaves below)
     completionPercentage: float
+    parentTopicId: int | None = None
+    orderPosition: int = 0
 
 class TopicEdge(BaseModel):
-    sourceTopicId: int # Might change if Topic IDs change
-    targetTopicId: int # Might change if Topic IDs change
+    sourceTopicId: int
+    targetTopicId: int
+    kind: Literal["child", "related"] = "child" # "related": similar subsections of different study guides
+    weight: float | None = None # Similarity of a "related" edge
 
 class TopicCreate(BaseModel):
     name: str
-    notebookId: int # Might change to workspaceId (str/ObjectId)
-    parentTopicId: int | None = None # Might change if Topic IDs change
+    workspaceId: PyObjectId
+    parentTopicId: int | None = None
     orderPosition: int
 
+class TopicEdgesCreate(BaseModel):
+    workspaceId: PyObjectId
+    edges: List[TopicEdge]
+
+class TopicProgressEvent(BaseModel):
+    topicId: int # A topic without subtopics (e.g. a study guide subsection)
+    completionPercentage: float = Field(ge=0, le=1) # Fraction completed, like TopicNode.completionPercentage
+
+class TopicProgressCreate(BaseModel):
+    workspaceId: PyObjectId
+    events: List[TopicProgressEvent]
+
+class TopicGraph(BaseModel):
+    # A part of a workspace graph, e.g. a topic's neighbours or subtree
+    nodes: List[TopicNode]
+    edges: List[TopicEdge]
+
+class TopicCluster(BaseModel):
+    # Topics of one grid cell, drawn as a single node when zoomed out
+    x: float # Centroid
+    y: float
+    count: int
+    topicId: int # Most connected topic of the cell, used as its label
+    name: str
+
+class TopicClusterEdge(BaseModel):
+    sourceCluster: int # Indices into TopicViewport.clusters
+    targetCluster: int
+    count: int # Topic edges between the two clusters
+
+class TopicViewport(BaseModel):
+    # The part of a workspace graph inside a bounding box: the topics themselves (with the edges
+    # touching them and the topics at their other ends), or clusters when there are too many
+    total: int # Topics inside the box
+    clustered: bool
+    bounds: List[float] # [min_x, min_y, max_x, max_y] of the whole laid-out graph
+    nodes: List[TopicNode] = []
+    edges: List[TopicEdge] = []
+    clusters: List[TopicCluster] = []
+    clusterEdges: List[TopicClusterEdge] = []
+
 # --- Enhanced Study Guide Models (Hierarchical) ---
 
+class ImageThumbnail(BaseModel):
+    # A downscaled copy of an extracted image, stored in GridFS next to the original
+    size: int # Requested long-edge size (one of THUMBNAIL_SIZES)
+    gridfs_id: PyObjectId
+    width: int
+    height: int
+
 class ExtractedImageInfo(BaseModel):
     # Represents info about an image extracted from the document
     filename: str # The unique filename saved temporarily (e.g., uuid.png)
     # Optional: Add page number if extractable, useful for frontend display
     page_number: int | None = None
     gridfs_id: Optional[PyObjectId] = None # ID of the image file stored in GridFS
+    # Why the image was left out of the study guide (e.g. "too_small", "duplicate"); None if it was kept
+    filter_reason: Optional[str] = None
+    content_hash: Optional[str] = None # SHA-256 of the image bytes, used for deduplication
+    thumbnails: List[ImageThumbnail] = []
 
 class StudyGuideSubsection(BaseModel):
     # Represents one subsection within a main section
@@ -161,8 +247,92 @@ class StudyGuideResponse(BaseModel):
     original_pdf_gridfs_id: Optional[PyObjectId] = None
     # Add field to link this study guide to a workspace
     workspace_id: PyObjectId # This should be required
+    # Images that could not be stored in GridFS (after retries); the guide is saved without them
+    failed_image_uploads: List[str] = []
+    # "generating" while sections are streamed in, then "completed"/"failed"; None for guides created in one go
+    generation_status: Optional[str] = None
+    # "sections" when the sections live in their own collection (STUDY_GUIDE_STORAGE_LAYOUT); None = embedded
+    storage_layout: Optional[str] = None
 
     class Config:
         populate_by_name = True
         arbitrary_types_allowed = True
         # json_encoders is deprecated in V2
+
+# --- Study Guide Table of Contents ---
+
+class StudyGuideTocEntry(BaseModel):
+    # A section without its subsection content
+    section_id: str
+    section_title: str
+    section_overview_description: str
+    subsection_titles: List[str]
+
+class StudyGuideToc(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    original_filename: str
+    generation_status: Optional[str] = None
+    storage_layout: Optional[str] = None
+    sections: List[StudyGuideTocEntry]
+
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
+
+# --- GridFS Batch Models ---
+
+class GridFSBatchRequest(BaseModel):
+    # Either explicit file ids, or a study guide whose extracted images should be returned (or both)
+    file_ids: List[PyObjectId] = []
+    study_guide_id: Optional[PyObjectId] = None
+    format: Literal["json", "zip"] = "json"
+    # JSON only: describe (and inline) each image's thumbnail of this size instead of inlining the originals
+    thumbnail_size: Optional[int] = None
+
+class GridFSFileManifestEntry(BaseModel):
+    id: PyObjectId
+    filename: Optional[str] = None
+    length: int
+    media_type: str
+    etag: str
+    url: str # Single-file endpoint, for files that were not inlined
+    data: Optional[str] = None # Base64 content for small images
+    # With `thumbnail_size`: the thumbnail's URL for images, and its entry once it has been rendered
+    thumbnail_url: Optional[str] = None
+    thumbnail: Optional["GridFSFileManifestEntry"] = None
+
+class GridFSBatchManifest(BaseModel):
+    files: List[GridFSFileManifestEntry]
+    missing: List[PyObjectId] = [] # Requested ids with no GridFS file
+
+# --- Study Guide Job Models ---
+
+class StudyGuideJobStage(BaseModel):
+    # Progress of one pipeline stage (staging, extracting, generating, storing, linking)
+    name: str
+    status: str = "pending" # pending | running | completed | failed
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    detail: Optional[str] = None # Free-form progress/error note for the stage
+
+class StudyGuideJob(BaseModel):
+    # A queued study guide generation request, stored in Mongo so any API process can run it
+    id: PyObjectId = Field(alias="_id")
+    workspace_id: PyObjectId
+    original_filename: str
+    content_type: Optional[str] = None
+    upload_gridfs_id: PyObjectId # The uploaded document, staged in GridFS at enqueue time
+    status: str = "queued" # queued | running | completed | failed
+    stages: List[StudyGuideJobStage] = []
+    progress: float = 0.0 # Fraction of stages completed (0.0 - 1.0)
+    attempts: int = 0
+    error: Optional[str] = None # Also the last transient error of a job queued for a retry
+    run_after: Optional[datetime] = None # A job retried after a transient error isn't claimed before this
+    # Reserved before the guide is stored, so a rerun resumes with it; the guide is complete once the job is
+    study_guide_id: Optional[PyObjectId] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
@@ -0,0 +1,241 @@
+# Study guide generation pipeline stages, shared by the job workers and the API routes
+import os
+import shutil
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import List, NamedTuple
+
+from fastapi import HTTPException, UploadFile
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+
+# Use relative imports
+from . import models
+from .config import settings
+from .process_pool import process_pool
+from .image_filters import filter_relevant_images
+from .extraction import (
+    TEMP_UPLOAD_DIR,
+    IMAGE_OUTPUT_DIR_BASE,
+    extract_text_and_images_pdf,
+    extract_text_and_images_pptx,
+    extract_text_docx,
+    extract_text_txt,
+    get_pdf_page_count,
+    extract_pdf_page_range,
+    merge_pdf_pages,
+    plan_pdf_shards,
+    DocumentSource,
+    describe_source,
+)
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".pptx", ".docx", ".txt")
+
+def get_extension(filename: str) -> str:
+    """Returns the lower-cased extension of an uploaded filename (e.g. '.pdf')."""
+    _, extension = os.path.splitext(filename)
+    return extension.lower()
+
+def validate_extension(filename: str) -> str:
+    """Raises a 400 for file types the pipeline cannot process, otherwise returns the extension."""
+    extension = get_extension(filename)
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise_unsupported_type(extension)
+    return extension
+
+def raise_unsupported_type(extension: str):
+    """Raises the 400 returned for file types the pipeline cannot process."""
+    raise HTTPException(
+        status_code=400,
+        detail=f"Unsupported file type: {extension}. Supported types: .pdf, .pptx, .docx, .txt"
+    )
+
+def create_request_dirs(request_id: str) -> tuple[str, str]:
+    """Creates the per-request temp directories and returns (request_temp_dir, request_image_dir)."""
+    request_temp_dir = os.path.join(TEMP_UPLOAD_DIR, request_id)
+    request_image_dir = os.path.join(IMAGE_OUTPUT_DIR_BASE, request_id)
+    os.makedirs(request_temp_dir, exist_ok=True)
+    os.makedirs(request_image_dir, exist_ok=True)
+    return request_temp_dir, request_image_dir
+
+def cleanup_request_dirs(request_id: str):
+    """Removes the per-request temp directories."""
+    shutil.rmtree(os.path.join(TEMP_UPLOAD_DIR, request_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(IMAGE_OUTPUT_DIR_BASE, request_id), ignore_errors=True)
+    logger.info(f"Cleaned up temporary directories for request {request_id}")
+
+def extract_document(
+    source: DocumentSource,
+    extension: str,
+    request_image_dir: str
+) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """
+    Dispatches to the extractor for the file type. `source` is a path or the document bytes.
+    Returns (text, all extracted images, images that passed pre-filtering).
+    """
+    all_extracted_images_info: List[models.ExtractedImageInfo] = []
+    filtered_images_info: List[models.ExtractedImageInfo] = []
+    if extension == ".pdf":
+        text_content, all_extracted_images_info, filtered_images_info = extract_text_and_images_pdf(source, request_image_dir)
+    elif extension == ".pptx":
+        text_content, all_extracted_images_info, filtered_images_info = extract_text_and_images_pptx(source, request_image_dir)
+    elif extension == ".docx":
+        text_content = extract_text_docx(source) # No images extracted for docx yet
+    elif extension == ".txt":
+        text_content = extract_text_txt(source) # No images for txt
+    else:
+        raise_unsupported_type(extension)
+    return text_content, all_extracted_images_info, filtered_images_info
+
+async def extract_document_in_pool(
+    source: DocumentSource,
+    extension: str,
+    request_image_dir: str,
+    wait: bool = True
+) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """Runs `extract_document` in the extraction process pool so parsing never blocks the event loop."""
+    if extension == ".pdf":
+        extracted = await extract_pdf_in_pool(source, request_image_dir, wait=wait)
+    else:
+        extracted = await process_pool.run(
+            extract_document,
+            source,
+            extension,
+            request_image_dir,
+            timeout=settings.EXTRACTION_TIMEOUT_SECONDS,
+            wait=wait
+        )
+    text_content, all_images_info, filtered_images_info = extracted
+    if settings.IMAGE_FILTER_ENABLED and filtered_images_info:
+        dropped = await process_pool.run(filter_relevant_images, request_image_dir, filtered_images_info, wait=wait)
+        filtered_images_info = apply_image_filter_report(all_images_info, dropped)
+    return text_content, all_images_info, filtered_images_info
+
+def apply_image_filter_report(all_images_info: List[models.ExtractedImageInfo], dropped: dict[str, str]) -> List[models.ExtractedImageInfo]:
+    """Records the relevance filter's drop reasons on the image list and returns the images still kept."""
+    for img_info in all_images_info:
+        if img_info.filename in dropped:
+            img_info.filter_reason = dropped[img_info.filename]
+    return [img_info for img_info in all_images_info if img_info.filter_reason is None]
+
+def summarize_filter_reasons(all_images_info: List[models.ExtractedImageInfo]) -> str:
+    """Human-readable count of why images were dropped, e.g. "3 duplicate, 2 blank"."""
+    counts = Counter(img_info.filter_reason for img_info in all_images_info if img_info.filter_reason)
+    return ", ".join(f"{count} {reason}" for reason, count in counts.most_common())
+
+async def extract_pdf_in_pool(
+    source: DocumentSource,
+    request_image_dir: str,
+    wait: bool = True
+) -> tuple[str, List[models.ExtractedImageInfo], List[models.ExtractedImageInfo]]:
+    """
+    Extracts a PDF in the process pool. Large documents are split into page ranges that
+    are extracted by separate worker processes and merged back in page order.
+    """
+    try:
+        page_count = await process_pool.run(get_pdf_page_count, source, wait=wait)
+        shards = plan_pdf_shards(page_count, process_pool.max_workers)
+        shard_results = await asyncio.gather(*(
+            process_pool.run(extract_pdf_page_range, source, request_image_dir, start_page, end_page, wait=wait)
+            for start_page, end_page in shards
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error extracting data from PDF {describe_source(source)}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF file: {e}")
+
+    pages = [page for shard_pages in shard_results for page in shard_pages]
+    text_content, all_images_info, filtered_images_info = merge_pdf_pages(pages, request_image_dir)
+    logger.info(
+        f"Extracted {page_count} pages in {len(shards)} shard(s), found {len(all_images_info)} total images, "
+        f"kept {len(filtered_images_info)} after filtering from PDF: {describe_source(source)}"
+    )
+    return text_content, all_images_info, filtered_images_info
+
+async def link_study_guide_to_workspace(db: AsyncIOMotorDatabase, workspace_id: str, study_guide_id: ObjectId):
+    """Adds the study guide ID to the workspace's study_guides array."""
+    await db["workspaces"].update_one(
+        {"_id": ObjectId(workspace_id)},
+        {"$addToSet": {"study_guides": study_guide_id}}
+    )
+    logger.info(f"Updated workspace {workspace_id} with new study guide ID {study_guide_id}")
+
+class StagedUpload(NamedTuple):
+    gridfs_id: ObjectId
+    sha256: str
+    size: int
+    source: DocumentSource | None # Bytes or spilled local copy, when a copy was requested
+
+UPLOAD_READ_CHUNK_BYTES = 1024 * 1024
+
+def _spill_threshold_bytes() -> int:
+    return settings.UPLOAD_SPILL_TO_DISK_MB * 1024 * 1024
+
+async def stage_upload_to_gridfs(
+    fs: AsyncIOMotorGridFSBucket,
+    upload: UploadFile,
+    filename: str,
+    content_type: str | None = None,
+    copy_path: str | None = None
+) -> StagedUpload:
+    """
+    Streams an uploaded file into GridFS in a single pass, hashing it on the way
+    (stored as metadata.sha256). With `copy_path`, the same pass also keeps a copy for
+    extraction: in memory up to UPLOAD_SPILL_TO_DISK_MB, otherwise written once to `copy_path`.
+    Reads of uploads Starlette spooled to disk, and writes of the copy, run in a worker thread.
+    """
+    metadata = {"contentType": content_type} if content_type else {}
+    digest = hashlib.sha256()
+    size = 0
+    memory_copy: List[bytes] | None = [] if copy_path else None
+    spill_file = None
+    grid_in = fs.open_upload_stream(filename, metadata=metadata or None)
+    try:
+        while chunk := await upload.read(UPLOAD_READ_CHUNK_BYTES):
+            digest.update(chunk)
+            size += len(chunk)
+            await grid_in.write(chunk)
+            if memory_copy is not None:
+                memory_copy.append(chunk)
+                if size > _spill_threshold_bytes():
+                    # Too large to hold in memory: continue the copy on disk
+                    spill_file = await asyncio.to_thread(open, copy_path, "wb")
+                    await asyncio.to_thread(spill_file.writelines, memory_copy)
+                    memory_copy = None
+            elif spill_file is not None:
+                await asyncio.to_thread(spill_file.write, chunk)
+        await grid_in.close()
+    except BaseException:
+        await grid_in.abort()
+        raise
+    finally:
+        if spill_file is not None:
+            spill_file.close()
+    await grid_in.set("metadata", {**metadata, "sha256": digest.hexdigest()})
+
+    if spill_file is not None:
+        source = copy_path
+    elif memory_copy is not None:
+        source = b"".join(memory_copy)
+    else:
+        source = None
+    logger.info(f"Staged upload {filename} ({size} bytes) in GridFS with ID: {grid_in._id}")
+    return StagedUpload(grid_in._id, digest.hexdigest(), size, source)
+
+async def load_staged_upload(fs: AsyncIOMotorGridFSBucket, gridfs_id: ObjectId, spill_path: str) -> DocumentSource:
+    """
+    Fetches a staged upload for extraction: into memory when it is at most
+    UPLOAD_SPILL_TO_DISK_MB, otherwise streamed to `spill_path` (one write) and returned as a path.
+    """
+    grid_out = await fs.open_download_stream(gridfs_id)
+    if grid_out.length <= _spill_threshold_bytes():
+        return await grid_out.read()
+    with open(spill_path, "wb") as spill_file:
+        while chunk := await grid_out.readchunk():
+            spill_file.write(chunk)
+    return spill_path
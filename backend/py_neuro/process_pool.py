@@ -0,0 +1,169 @@
+# Process pool for CPU-heavy document work (PyMuPDF, python-pptx, python-docx)
+# so that parsing a large file never blocks the event loop of an API process.
+import os
+import math
+import signal
+import asyncio
+import logging
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+
+from .config import settings
+
+try:
+    import resource # Unix only; used to cap worker memory
+except ImportError: # pragma: no cover - e.g. Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+class WorkerTaskError(Exception):
+    """
+    Picklable stand-in for errors raised inside a worker process.
+    FastAPI's HTTPException can't be unpickled, so it is converted to this and back.
+    """
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class _WorkerTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise _WorkerTimeout()
+
+def _init_worker(max_memory_mb: int):
+    """Runs once in each worker process: applies the per-worker memory cap."""
+    if resource is not None and max_memory_mb > 0:
+        limit = max_memory_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not apply {max_memory_mb} MB memory limit in worker {os.getpid()}: {e}")
+
+def _call_in_worker(fn, timeout_seconds: float | None, args: tuple, kwargs: dict):
+    """Runs `fn` inside the worker with a hard timeout enforced by SIGALRM."""
+    use_alarm = bool(timeout_seconds) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(max(1, math.ceil(timeout_seconds)))
+    try:
+        return fn(*args, **kwargs)
+    except _WorkerTimeout:
+        raise WorkerTaskError(504, f"Document processing timed out after {timeout_seconds} seconds") from None
+    except MemoryError:
+        raise WorkerTaskError(413, "Document processing exceeded the worker memory limit") from None
+    except HTTPException as e:
+        raise WorkerTaskError(e.status_code, str(e.detail)) from None
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+class ProcessPool:
+    """
+    Wrapper around a ProcessPoolExecutor with per-task timeouts, a memory cap per
+    worker and a bounded number of in-flight tasks (backpressure).
+    """
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        # Executors whose workers were terminated because a task hung; the other tasks they were running are rerun
+        self._recycled: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+
+    @property
+    def max_workers(self) -> int:
+        return settings.EXTRACTION_MAX_WORKERS or os.cpu_count() or 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned (not forked) workers: forking a process that runs an event loop
+            # and Motor's threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(settings.EXTRACTION_MAX_MEMORY_MB,),
+                max_tasks_per_child=settings.EXTRACTION_MAX_TASKS_PER_CHILD or None,
+            )
+            logger.info(f"Started extraction process pool with {self.max_workers} workers")
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(settings.EXTRACTION_MAX_PENDING)
+        return self._slots
+
+    def is_saturated(self) -> bool:
+        """True when no more tasks can be accepted without waiting."""
+        return self._get_slots().locked()
+
+    async def run(self, fn, *args, timeout: float | None = None, wait: bool = True, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` in a worker process and returns its result.
+        When the pool is saturated, waits for a slot if `wait` is True (job workers),
+        otherwise fails fast with a 503 (request handlers).
+        """
+        if timeout is None:
+            timeout = settings.EXTRACTION_TIMEOUT_SECONDS
+        slots = self._get_slots()
+        if not wait and slots.locked():
+            raise HTTPException(
+                status_code=503,
+                detail="Document processing is at capacity, please retry shortly.",
+                headers={"Retry-After": "5"}
+            )
+        async with slots:
+            loop = asyncio.get_running_loop()
+            name = getattr(fn, "__name__", fn)
+            for attempt in (1, 2):
+                executor = self._get_executor()
+                future = loop.run_in_executor(executor, _call_in_worker, fn, timeout, args, kwargs)
+                try:
+                    # The worker enforces the timeout itself; this is a backstop if it is stuck in C code
+                    return await asyncio.wait_for(future, timeout=timeout + 30 if timeout else None)
+                except WorkerTaskError as e:
+                    raise HTTPException(status_code=e.status_code, detail=e.detail)
+                except asyncio.TimeoutError:
+                    logger.error(f"Worker task {name} did not finish within {timeout}s; recycling pool")
+                    self._reset_executor(executor, hung=True)
+                    raise HTTPException(status_code=504, detail=f"Document processing timed out after {timeout} seconds")
+                except BrokenProcessPool:
+                    if executor in self._recycled and attempt == 1:
+                        # Not this task's fault: another one hung and its pool was recycled
+                        logger.info(f"Rerunning worker task {name} on a fresh pool")
+                        continue
+                    # A worker died (e.g. killed by the OOM killer); start a fresh pool for later tasks
+                    logger.error(f"Worker process crashed while running {name}; recycling pool")
+                    self._reset_executor(executor)
+                    raise HTTPException(status_code=500, detail="Document processing worker crashed")
+
+    def _reset_executor(self, executor: ProcessPoolExecutor, hung: bool = False):
+        """
+        Replaces `executor` (if it is still the current one: several tasks may see the same
+        broken pool) and terminates its workers; shutdown() alone would leave a hung worker
+        running outside the pool's size and memory limits. Its other tasks fail with BrokenProcessPool.
+        """
+        if self._executor is executor:
+            self._executor = None
+        if hung:
+            self._recycled.add(executor)
+        for process in list((executor._processes or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        """Stops the worker processes (called on app shutdown)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Extraction process pool shut down")
+
+# Singleton pool shared by the job workers and request handlers
+process_pool = ProcessPool()
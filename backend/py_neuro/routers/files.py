@@ -1,54 +1,447 @@
+import os
+import base64
 import logging
-from fastapi import APIRouter, HTTPException, Depends
+import zipfile
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from bson import ObjectId
-from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
 import mimetypes # To guess content type
 
 # Use relative import
-from ..database import get_gridfs_bucket
+from .. import models
+from .. import crud
+from ..crud import STUDY_GUIDE_COLLECTION, GRIDFS_FILES_COLLECTION
+from ..config import settings
+from ..database import get_database, get_gridfs_bucket
+from ..file_cache import file_cache, CachedFile, thumbnail_cache_key
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# GridFS files are never modified in place (new content gets a new _id), so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def file_document_etag(file_doc: dict) -> str:
+    """Strong ETag for an fs.files document: the content hash when one was stored, otherwise the (immutable) file id."""
+    metadata = file_doc.get("metadata") or {}
+    if metadata.get("sha256"):
+        return f'"sha256-{metadata["sha256"]}"'
+    md5 = file_doc.get("md5") # Only set by older drivers
+    if md5:
+        return f'"md5-{md5}"'
+    return f'"{file_doc["_id"]}"'
+
+def file_document_media_type(file_doc: dict) -> str:
+    """Content-Type from metadata, else guessed from the filename."""
+    metadata = file_doc.get("metadata") or {}
+    if "contentType" in metadata:
+        return metadata["contentType"]
+    guessed_type, _ = mimetypes.guess_type(file_doc.get("filename") or "")
+    return guessed_type or "application/octet-stream"
+
+def gridfs_etag(grid_out) -> str:
+    return file_document_etag({"_id": grid_out._id, "metadata": grid_out.metadata, "md5": getattr(grid_out, "md5", None)})
+
+def gridfs_media_type(grid_out) -> str:
+    return file_document_media_type({"metadata": grid_out.metadata, "filename": grid_out.filename})
+
+def etag_matches(header_value: str | None, etag: str) -> bool:
+    """True if an If-None-Match / If-Range header lists `etag` (weak comparison) or is "*"."""
+    if not header_value:
+        return False
+    candidates = [candidate.strip() for candidate in header_value.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def parse_range_header(header_value: str, length: int) -> tuple[int, int] | None:
+    """
+    Parses a single "bytes=start-end", "bytes=start-" or "bytes=-suffix" range into an
+    inclusive (start, end) pair. Returns None when the header should be ignored
+    (malformed, end before start, or multiple ranges, which are answered with the full file).
+    Raises HTTPException(416) if the range lies outside the file (including "bytes=-0").
+    """
+    unit, _, ranges = header_value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    try:
+        if start_text == "":
+            suffix_length = int(end_text)
+            if suffix_length < 0:
+                raise ValueError
+            start, end = max(0, length - suffix_length), length - 1
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else length - 1
+            if start < 0 or (end_text and end < start):
+                return None # Syntactically invalid, not unsatisfiable (RFC 9110 14.1.1)
+            end = min(end, length - 1)
+    except ValueError:
+        return None
+    if start < 0 or start > end or start >= length:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"}
+        )
+    return start, end
+
+async def _stream_range(grid_out, start: int, end: int, cache_path: str | None = None, cache_key: str | None = None, cache_entry: tuple | None = None):
+    """
+    Yields bytes [start, end] of a GridFS file, reading from the chunk containing `start` onwards.
+    With `cache_path`, the bytes are also written there and committed to the disk cache once
+    the whole file has been sent.
+    """
+    grid_out.seek(start) # GridOut maps the offset to chunk n = start // chunk_size
+    remaining = end - start + 1
+    cache_file = open(cache_path, "wb") if cache_path else None
+    try:
+        while remaining > 0:
+            data = await grid_out.read(min(remaining, grid_out.chunk_size))
+            if not data:
+                break
+            remaining -= len(data)
+            if cache_file is not None:
+                cache_file.write(data)
+            file_cache.record_served(len(data), from_cache=False)
+            yield data
+    finally:
+        if cache_file is not None:
+            cache_file.close()
+            if remaining == 0:
+                file_cache.commit_disk(cache_key, cache_path, *cache_entry)
+            else:
+                file_cache.discard_temp(cache_path) # Client went away mid-download
+
+async def _stream_cached_file(path: str, start: int, end: int, chunk_size: int = 256 * 1024):
+    """Yields bytes [start, end] of a file in the disk cache."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(remaining, chunk_size))
+            if not data:
+                break
+            remaining -= len(data)
+            file_cache.record_served(len(data), from_cache=True)
+            yield data
+
+def _requested_range(request: Request, etag: str, length: int) -> tuple[int, int] | None:
+    range_header = request.headers.get("range")
+    if not range_header or length == 0:
+        return None
+    if_range = request.headers.get("if-range")
+    # If-Range: only serve the range if the client's copy is still current. Strong comparison:
+    # a weak tag, "*" or a date never matches, so the full file is sent
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    return parse_range_header(range_header, length)
+
+def _response_headers(etag: str, length: int | None, byte_range: tuple[int, int] | None) -> dict:
+    """Caching/range headers; `length` is None for 304 responses, which carry no body."""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if length is None:
+        return headers
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+    else:
+        start, end = byte_range
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return headers
+
+def _cached_response(request: Request, cached: CachedFile, from_cache: bool = True) -> Response:
+    """Serves a file held in memory or in the disk cache without touching MongoDB."""
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=_response_headers(cached.etag, None, None))
+    byte_range = _requested_range(request, cached.etag, cached.length)
+    headers = _response_headers(cached.etag, cached.length, byte_range)
+    status_code = 200 if byte_range is None else 206
+    start, end = byte_range or (0, cached.length - 1)
+    if cached.data is not None:
+        body = cached.data[start:end + 1]
+        file_cache.record_served(len(body), from_cache=from_cache)
+        return Response(body, status_code=status_code, media_type=cached.media_type, headers=headers)
+    return StreamingResponse(_stream_cached_file(cached.path, start, end), status_code=status_code, media_type=cached.media_type, headers=headers)
+
 @router.get("/gridfs/{file_id}")
-async def get_gridfs_file(file_id: str, fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)):
+async def get_gridfs_file(
+    file_id: str,
+    request: Request,
+    size: Optional[int] = Query(None, description="Return the thumbnail with this long edge (one of THUMBNAIL_SIZES) instead of the original"),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)
+):
     """
-    Retrieves a file stored in GridFS by its _id.
+    Retrieves a file stored in GridFS by its _id, or with `size` a thumbnail of an image
+    (rendered and stored on first request if it was not created during ingestion).
+    Supports conditional requests (If-None-Match -> 304) and single byte ranges (Range -> 206,
+    honouring If-Range), so browsers cache images and PDF viewers can seek.
+    Hot files are served from the local file cache without a MongoDB round trip.
     """
     if not ObjectId.is_valid(file_id):
         raise HTTPException(status_code=400, detail="Invalid file ID format")
+    if size is not None and size not in settings.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Thumbnail size must be one of {settings.THUMBNAIL_SIZES}")
 
     oid = ObjectId(file_id)
+    cache_key = str(oid) if size is None else thumbnail_cache_key(oid, size)
+    cached = file_cache.get(cache_key)
+    if cached is not None:
+        return _cached_response(request, cached)
 
-    try:
-        # Find file metadata first to get filename and potentially content type
-        gridfs_file = await fs.find_one({"_id": oid})
-        if not gridfs_file:
+    if size is not None:
+        try:
+            thumbnail = await crud.get_or_create_thumbnail(db, fs, oid, size)
+        except NoFile:
             raise HTTPException(status_code=404, detail="File not found in GridFS")
+        oid = thumbnail.gridfs_id
+
+    try:
+        grid_out = await fs.open_download_stream(oid)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="File not found in GridFS")
+    except Exception as e:
+        logger.error(f"Error retrieving file {file_id} from GridFS: {e}")
+        raise HTTPException(status_code=500, detail=f"Error retrieving file: {e}")
+
+    etag = gridfs_etag(grid_out)
+    length = grid_out.length
+    media_type = gridfs_media_type(grid_out)
+
+    if file_cache.fits_memory(length):
+        # Small file: one read, then every later request (ranges included) is served from memory
+        data = await grid_out.read()
+        file_cache.put_memory(cache_key, data, etag, media_type)
+        return _cached_response(request, CachedFile(length, etag, media_type, data=data), from_cache=False)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=_response_headers(etag, None, None))
 
-        # Determine media type (Content-Type)
-        media_type = None
-        if gridfs_file.metadata and "contentType" in gridfs_file.metadata:
-            media_type = gridfs_file.metadata["contentType"]
+    byte_range = _requested_range(request, etag, length)
+    headers = _response_headers(etag, length, byte_range)
+    if byte_range is None:
+        # Full download of a larger file: copy it into the disk cache on the way through
+        cache_path = file_cache.disk_temp_path(cache_key) if file_cache.fits_disk(length) else None
+        return StreamingResponse(
+            _stream_range(grid_out, 0, length - 1, cache_path, cache_key, (length, etag, media_type)),
+            media_type=media_type,
+            headers=headers
+        )
+
+    start, end = byte_range
+    return StreamingResponse(_stream_range(grid_out, start, end), status_code=206, media_type=media_type, headers=headers)
+
+# --- Batch retrieval ---
+
+GRIDFS_CHUNKS_COLLECTION = "fs.chunks"
+BATCH_CHUNK_CURSOR_SIZE = 16 # fs.chunks documents per cursor batch (~4 MB with the default chunk size)
+
+def _file_url(file_id) -> str:
+    return f"/api/files/gridfs/{file_id}"
+
+async def _resolve_batch_ids(db: AsyncIOMotorDatabase, batch: models.GridFSBatchRequest) -> list[ObjectId]:
+    """Requested file ids plus the study guide's extracted images, de-duplicated in request order."""
+    file_ids = list(batch.file_ids)
+    if batch.study_guide_id is not None:
+        study_guide = await db[STUDY_GUIDE_COLLECTION].find_one(
+            {"_id": batch.study_guide_id}, {"extracted_images.gridfs_id": 1}
+        )
+        if study_guide is None:
+            raise HTTPException(status_code=404, detail=f"Study guide {batch.study_guide_id} not found")
+        file_ids.extend(img["gridfs_id"] for img in study_guide.get("extracted_images", []) if img.get("gridfs_id"))
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) > settings.FILE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.FILE_BATCH_MAX_FILES} files per batch request")
+    return file_ids
+
+async def _read_chunks(db: AsyncIOMotorDatabase, file_ids: list[ObjectId]):
+    """Yields (files_id, data) for the chunks of several GridFS files with one `$in` query, file by file in chunk order."""
+    if not file_ids:
+        return
+    cursor = db[GRIDFS_CHUNKS_COLLECTION].find(
+        {"files_id": {"$in": file_ids}},
+        {"files_id": 1, "n": 1, "data": 1},
+        sort=[("files_id", 1), ("n", 1)] # Served by the bucket's unique files_id_1_n_1 index
+    ).batch_size(BATCH_CHUNK_CURSOR_SIZE)
+    async for chunk in cursor:
+        yield chunk["files_id"], bytes(chunk["data"])
+
+async def _read_small_files(db: AsyncIOMotorDatabase, file_docs: list[dict]) -> dict[ObjectId, bytes]:
+    """Contents of small files, from the file cache where possible and otherwise with one fs.chunks query."""
+    contents: dict[ObjectId, bytes] = {}
+    to_fetch = []
+    for file_doc in file_docs:
+        cached = file_cache.get(str(file_doc["_id"]))
+        if cached is not None and cached.data is not None:
+            contents[file_doc["_id"]] = cached.data
+            file_cache.record_served(cached.length, from_cache=True)
         else:
-            # Guess based on filename if not stored in metadata
-            guessed_type, _ = mimetypes.guess_type(gridfs_file.filename)
-            if guessed_type:
-                media_type = guessed_type
+            to_fetch.append(file_doc)
+    parts: dict[ObjectId, list[bytes]] = {}
+    async for files_id, data in _read_chunks(db, [file_doc["_id"] for file_doc in to_fetch]):
+        parts.setdefault(files_id, []).append(data)
+    for file_doc in to_fetch:
+        data = b"".join(parts.get(file_doc["_id"], []))
+        if len(data) != file_doc["length"]:
+            logger.warning(f"GridFS file {file_doc['_id']} is incomplete ({len(data)} of {file_doc['length']} bytes); not inlined")
+            continue
+        contents[file_doc["_id"]] = data
+        file_cache.record_served(len(data), from_cache=False)
+        file_cache.put_memory(str(file_doc["_id"]), data, file_document_etag(file_doc), file_document_media_type(file_doc))
+    return contents
 
-        # Default if still unknown
-        if not media_type:
-            media_type = "application/octet-stream"
+def _should_inline(file_doc: dict) -> bool:
+    return (
+        file_doc["length"] <= settings.FILE_BATCH_INLINE_MAX_KB * 1024
+        and file_document_media_type(file_doc).startswith("image/")
+    )
 
-        # Open download stream
-        download_stream = await fs.open_download_stream(oid)
+def _zip_entry_name(file_doc: dict) -> str:
+    """Entries are named by file id (filenames are not unique), keeping the original extension."""
+    _, extension = os.path.splitext(file_doc.get("filename") or "")
+    return f"{file_doc['_id']}{extension}"
 
-        # Return as a streaming response
-        return StreamingResponse(download_stream, media_type=media_type)
+class _ZipSink:
+    """Write-only, unseekable target for ZipFile; the zip is streamed out as it is written."""
+    def __init__(self):
+        self._parts: list[bytes] = []
 
-    except Exception as e:
-        logger.error(f"Error retrieving file {file_id} from GridFS: {e}")
-        # Distinguish between file not found and other errors if possible
-        # For now, return 500 for any unexpected error during retrieval
-        raise HTTPException(status_code=500, detail=f"Error retrieving file: {e}")
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+async def _stream_zip(db: AsyncIOMotorDatabase, manifest: models.GridFSBatchManifest, file_docs: list[dict]):
+    """
+    Streams a zip (stored, since images are already compressed) holding manifest.json and one
+    entry per file. Files in the memory/disk cache are copied from there; all others are read
+    with a single fs.chunks cursor.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr("manifest.json", manifest.model_dump_json())
+        yield sink.drain()
+
+        docs_by_id = {file_doc["_id"]: file_doc for file_doc in file_docs}
+        to_fetch = []
+        for file_doc in file_docs:
+            cached = file_cache.get(str(file_doc["_id"]))
+            if cached is None:
+                to_fetch.append(file_doc["_id"])
+                continue
+            with archive.open(_zip_entry_name(file_doc), "w", force_zip64=cached.length >= zipfile.ZIP64_LIMIT) as entry:
+                if cached.data is not None:
+                    entry.write(cached.data)
+                    yield sink.drain()
+                else:
+                    with open(cached.path, "rb") as f:
+                        while data := f.read(256 * 1024):
+                            entry.write(data)
+                            yield sink.drain()
+            file_cache.record_served(cached.length, from_cache=True)
+
+        entry = None
+        entry_id = None
+        try:
+            async for files_id, data in _read_chunks(db, to_fetch):
+                if files_id != entry_id:
+                    if entry is not None:
+                        entry.close()
+                    entry_id = files_id
+                    file_doc = docs_by_id[files_id]
+                    entry = archive.open(_zip_entry_name(file_doc), "w", force_zip64=file_doc["length"] >= zipfile.ZIP64_LIMIT)
+                entry.write(data)
+                file_cache.record_served(len(data), from_cache=False)
+                yield sink.drain()
+        finally:
+            if entry is not None:
+                entry.close()
+    yield sink.drain() # Central directory
+
+@router.post("/gridfs/batch", response_model=models.GridFSBatchManifest)
+async def get_gridfs_files_batch(
+    batch: models.GridFSBatchRequest,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Returns many GridFS files in one request, instead of one GET per image: either the files
+    listed in `file_ids`, the extracted images of `study_guide_id`, or both. Metadata comes
+    from one `$in` query on fs.files.
+
+    - `format="json"`: a manifest with metadata for every file, plus the base64 content of small
+      images (FILE_BATCH_INLINE_MAX_KB); larger files are fetched through `url`. With
+      `thumbnail_size`, each image's thumbnail is described and inlined instead.
+    - `format="zip"`: a streamed zip with `manifest.json` and every file's content.
+    """
+    file_ids = await _resolve_batch_ids(db, batch)
+    file_docs_by_id = {}
+    if file_ids:
+        cursor = db[GRIDFS_FILES_COLLECTION].find(
+            {"_id": {"$in": file_ids}},
+            {"filename": 1, "length": 1, "metadata": 1, "md5": 1}
+        )
+        file_docs_by_id = {file_doc["_id"]: file_doc async for file_doc in cursor}
+    file_docs = [file_docs_by_id[file_id] for file_id in file_ids if file_id in file_docs_by_id]
+    missing = [file_id for file_id in file_ids if file_id not in file_docs_by_id]
+
+    if batch.thumbnail_size is not None and batch.thumbnail_size not in settings.THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Thumbnail size must be one of {settings.THUMBNAIL_SIZES}")
+
+    thumbnail_docs = {}
+    if batch.format == "json" and batch.thumbnail_size is not None and file_docs:
+        cursor = db[GRIDFS_FILES_COLLECTION].find(
+            {"metadata.thumbnail_of": {"$in": [file_doc["_id"] for file_doc in file_docs]}, "metadata.thumbnail_size": batch.thumbnail_size},
+            {"filename": 1, "length": 1, "metadata": 1}
+        )
+        thumbnail_docs = {thumbnail_doc["metadata"]["thumbnail_of"]: thumbnail_doc async for thumbnail_doc in cursor}
+
+    inline_data = {}
+    if batch.format == "json":
+        # Thumbnails replace the originals as inline content when they were asked for
+        to_inline = list(thumbnail_docs.values()) if batch.thumbnail_size is not None else file_docs
+        inline_data = await _read_small_files(db, [file_doc for file_doc in to_inline if _should_inline(file_doc)])
+
+    def manifest_entry(file_doc: dict, url: str) -> models.GridFSFileManifestEntry:
+        return models.GridFSFileManifestEntry(
+            id=file_doc["_id"],
+            filename=file_doc.get("filename"),
+            length=file_doc["length"],
+            media_type=file_document_media_type(file_doc),
+            etag=file_document_etag(file_doc),
+            url=url,
+            data=base64.b64encode(inline_data[file_doc["_id"]]).decode("ascii") if file_doc["_id"] in inline_data else None
+        )
+
+    entries = []
+    for file_doc in file_docs:
+        entry = manifest_entry(file_doc, _file_url(file_doc["_id"]))
+        if batch.thumbnail_size is not None and file_document_media_type(file_doc).startswith("image/"):
+            # A thumbnail that was not rendered yet is rendered and stored by the first GET of its URL
+            entry.thumbnail_url = f"{_file_url(file_doc['_id'])}?size={batch.thumbnail_size}"
+            if file_doc["_id"] in thumbnail_docs:
+                entry.thumbnail = manifest_entry(thumbnail_docs[file_doc["_id"]], entry.thumbnail_url)
+        entries.append(entry)
+    manifest = models.GridFSBatchManifest(files=entries, missing=missing)
+    logger.info(f"Batch request for {len(file_ids)} GridFS files: {len(file_docs)} found, {len(inline_data)} inlined ({batch.format})")
+
+    if batch.format == "zip":
+        return StreamingResponse(
+            _stream_zip(db, manifest, file_docs),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="files.zip"'}
+        )
+    return manifest
@@ -0,0 +1,27 @@
+import logging
+from fastapi import APIRouter, HTTPException, Depends
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# Use relative imports
+from .. import models
+from .. import jobs
+from ..database import get_database
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# GET: api/jobs/123
+@router.get("/{job_id}", response_model=models.StudyGuideJob)
+async def get_study_guide_job(job_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Retrieves the status of a study guide job, including per-stage progress.
+    Once `status` is "completed", `study_guide_id` points to the created study guide.
+    """
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+
+    job = await jobs.get_job(db=db, job_id=job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
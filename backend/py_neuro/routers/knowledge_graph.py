@@ -1,41 +1,92 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import List
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from .. import models # Relative import
+from .. import knowledge_graph
+from ..config import settings
+from ..database import get_database
 
 router = APIRouter()
 
-# Dummy data - replace with actual database logic later
-dummy_nodes = [
-    models.TopicNode(id=1, name="Introduction", x=100, y=100, completionPercentage=0.8),
-    models.TopicNode(id=2, name="Core Concepts", x=300, y=100, completionPercentage=0.6),
-    models.TopicNode(id=3, name="Advanced Topics", x=500, y=100, completionPercentage=0.2),
-    models.TopicNode(id=4, name="Applications", x=300, y=300, completionPercentage=0.0),
-]
-
-dummy_edges = [
-    models.TopicEdge(sourceTopicId=1, targetTopicId=2),
-    models.TopicEdge(sourceTopicId=2, targetTopicId=3),
-    models.TopicEdge(sourceTopicId=2, targetTopicId=4),
-]
-
-@router.get("/topicNodes/{notebook_id}", response_model=List[models.TopicNode])
-async def get_topic_nodes(notebook_id: int):
+def _workspace_oid(workspace_id: str) -> ObjectId:
+    if not ObjectId.is_valid(workspace_id):
+        raise HTTPException(status_code=400, detail="Invalid workspace ID format")
+    return ObjectId(workspace_id)
+
+@router.get("/topicNodes/{workspace_id}", response_model=List[models.TopicNode])
+async def get_topic_nodes(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Retrieves the topic nodes of a workspace, at their last computed positions (the layout runs in the background after changes)."""
+    return await knowledge_graph.get_topic_nodes(db, _workspace_oid(workspace_id))
+
+@router.get("/topicEdges/{workspace_id}", response_model=List[models.TopicEdge])
+async def get_topic_edges(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Retrieves the topic edges (connections) of a workspace."""
+    return await knowledge_graph.get_topic_edges(db, _workspace_oid(workspace_id))
+
+@router.get("/topicGraph/{workspace_id}/viewport", response_model=models.TopicViewport)
+async def get_topic_viewport(
+    workspace_id: str,
+    min_x: float,
+    min_y: float,
+    max_x: float,
+    max_y: float,
+    max_nodes: int = Query(settings.TOPIC_VIEWPORT_MAX_NODES, ge=1, le=20000, description="Topics returned before switching to clusters"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
     """
-    Retrieves the list of topic nodes for a specific notebook.
-    (Currently returns dummy data)
+    The part of the topic graph inside a bounding box (layout coordinates): its topics and their
+    edges, or clusters of topics when more than `max_nodes` are inside (zoomed out).
     """
-    # In a real implementation, you would query the database based on notebook_id
-    # Note: notebook_id might need to be ObjectId if linked to Workspaces
-    print(f"Fetching nodes for notebook_id: {notebook_id}")
-    return dummy_nodes
+    if min_x > max_x or min_y > max_y:
+        raise HTTPException(status_code=400, detail="Invalid bounding box: min must not exceed max")
+    viewport = await knowledge_graph.get_topic_viewport(db, _workspace_oid(workspace_id), min_x, min_y, max_x, max_y, max_nodes)
+    if viewport is None:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    return viewport
+
+@router.get("/topicNodes/{workspace_id}/{topic_id}/neighbours", response_model=models.TopicGraph)
+async def get_topic_neighbours(workspace_id: str, topic_id: int, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """The topics connected to a topic (in either direction) and the connecting edges."""
+    return await knowledge_graph.get_topic_neighbours(db, _workspace_oid(workspace_id), topic_id)
+
+@router.get("/topicNodes/{workspace_id}/{topic_id}/subtree", response_model=models.TopicGraph)
+async def get_topic_subtree(
+    workspace_id: str,
+    topic_id: int,
+    depth: int | None = Query(None, ge=1, description="Levels below the topic; all by default"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """A topic with its subtopics (recursively) and the parent-child edges between them."""
+    subtree = await knowledge_graph.get_topic_subtree(db, _workspace_oid(workspace_id), topic_id, depth)
+    if subtree is None:
+        raise HTTPException(status_code=404, detail="Topic not found")
+    return subtree
 
-@router.get("/topicEdges/{notebook_id}", response_model=List[models.TopicEdge])
-async def get_topic_edges(notebook_id: int):
+@router.post("/topicGraph/{workspace_id}/study-guides")
+async def add_study_guides_to_graph(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
-    Retrieves the list of topic edges (connections) for a specific notebook.
-    (Currently returns dummy data)
+    Adds the workspace's study guides that aren't in its topic graph yet (new guides are
+    added when they are generated; this backfills guides created earlier).
     """
-    # In a real implementation, you would query the database based on notebook_id
-    # Note: notebook_id might need to be ObjectId if linked to Workspaces
-    print(f"Fetching edges for notebook_id: {notebook_id}")
-    return dummy_edges
+    study_guides, nodes = await knowledge_graph.add_missing_study_guides_to_graph(db, _workspace_oid(workspace_id))
+    return {"study_guides_added": study_guides, "topics_added": nodes}
+
+@router.post("/topicGraph/{workspace_id}/completion/rebuild")
+async def rebuild_topic_completion(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Recomputes every topic's completion from the recorded subsection progress (normally kept up to
+    date incrementally; this repairs interrupted updates and graphs created before rollups).
+    """
+    topics = await knowledge_graph.rebuild_topic_rollups(db, _workspace_oid(workspace_id))
+    return {"topics": topics}
+
+@router.post("/topicGraph/{workspace_id}/layout")
+async def layout_topic_graph(
+    workspace_id: str,
+    full: bool = Query(False, description="Recompute every position instead of only placing new topics"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Computes the topic positions now and waits for them (otherwise done in the background after the graph changed)."""
+    laid_out = await knowledge_graph.ensure_topic_layout(db, _workspace_oid(workspace_id), full=full)
+    return {"laid_out": laid_out}
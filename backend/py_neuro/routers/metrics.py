@@ -0,0 +1,15 @@
+import logging
+from fastapi import APIRouter
+
+# Use relative imports
+from ..metrics import counters
+from ..file_cache import file_cache
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# GET: api/metrics
+@router.get("")
+async def get_metrics():
+    """Returns this API process's counters (e.g. study guide cache hits and misses) and cache statistics."""
+    return {"counters": counters.snapshot(), "file_cache": file_cache.stats()}
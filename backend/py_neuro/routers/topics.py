@@ -1,48 +1,50 @@
-import random
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from .. import models # Relative import
+from .. import knowledge_graph
+from ..database import get_database
+from ..topic_progress import topic_progress
 
 router = APIRouter()
 
-# In-memory storage for dummy data (replace with DB later)
-# We need this to potentially find parent topics if needed, though not used in POST yet
-# Also needed to generate unique IDs for the dummy response
-dummy_nodes_store: List[models.TopicNode] = [
-    models.TopicNode(id=1, name="Introduction", x=100, y=100, completionPercentage=0.8),
-    models.TopicNode(id=2, name="Core Concepts", x=300, y=100, completionPercentage=0.6),
-    models.TopicNode(id=3, name="Advanced Topics", x=500, y=100, completionPercentage=0.2),
-    models.TopicNode(id=4, name="Applications", x=300, y=300, completionPercentage=0.0),
-]
-next_topic_id = 5 # Simple counter for new dummy IDs
-
 @router.post("/add", response_model=models.TopicNode, status_code=201)
-async def add_topic(topic_data: models.TopicCreate):
+async def add_topic(topic_data: models.TopicCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
-    Creates a new topic (section).
-    (Currently returns dummy data and doesn't persist)
+    Creates a new topic (section) in a workspace, linked to its parent topic if given.
     """
-    global next_topic_id
-    print(f"Received topic data to add: {topic_data}")
+    try:
+        new_topic = await knowledge_graph.create_topic(db, topic_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if new_topic is None:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    return new_topic
 
-    # Simulate creation - generate a dummy response
-    # In a real app, you'd insert into DB and get the real ID, x, y, etc.
-    new_topic = models.TopicNode(
-        id=next_topic_id,
-        name=topic_data.name,
-        x=random.uniform(50, 550), # Assign random position for dummy
-        y=random.uniform(50, 350),
-        completionPercentage=0.0 # New topics start at 0%
-        # We ignore parentTopicId and orderPosition for the dummy response for now
+@router.post("/edges", status_code=201)
+async def add_topic_edges(edges_data: models.TopicEdgesCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Adds edges between existing topics in one bulk write; edges that already exist are skipped.
+    """
+    topic_ids = {edge.sourceTopicId for edge in edges_data.edges} | {edge.targetTopicId for edge in edges_data.edges}
+    found = await db[knowledge_graph.TOPIC_NODES_COLLECTION].count_documents(
+        {"workspace_id": edges_data.workspaceId, "id": {"$in": list(topic_ids)}}
     )
-    next_topic_id += 1
-    # dummy_nodes_store.append(new_topic) # Add to dummy store if needed later
+    if found != len(topic_ids):
+        raise HTTPException(status_code=400, detail="Edges reference topics that don't exist in this workspace")
+    inserted = await knowledge_graph.insert_topic_edges(db, edges_data.workspaceId, edges_data.edges)
+    if inserted:
+        knowledge_graph.schedule_topic_layout(db, edges_data.workspaceId)
+    return {"inserted": inserted}
 
-    print(f"Simulated creation, returning: {new_topic}")
-    return new_topic
-
-# Placeholder for future GET endpoints for topics if needed
-# @router.get("/notebook/{notebook_id}", response_model=List[models.TopicNode])
-# async def get_topics_for_notebook(notebook_id: int):
-#     # Logic to retrieve topics for a notebook
-#     pass
+@router.post("/progress", status_code=202)
+async def record_topic_progress(progress_data: models.TopicProgressCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Records study progress (completionPercentage as a fraction, 0 to 1) on topics without
+    subtopics (subsections). Events are buffered and written in batches, rolling each change up
+    the topic's parent chain; events for topics that don't exist or have subtopics are dropped then.
+    """
+    try:
+        await topic_progress.record(db, progress_data.workspaceId, progress_data.events)
+    except knowledge_graph.TopicProgressNotApplied as e:
+        raise HTTPException(status_code=503, detail=f"Progress not fully recorded, retry: {e}")
+    return {"queued": len(progress_data.events)}
@@ -1,45 +1,142 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Response
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Response, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional, Union
 from bson import ObjectId
+from bson.errors import InvalidId
 from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
-import os
-import shutil
+import json
+import base64
+import binascii
 import logging
-import uuid
-from .. import crud # Relative import
-from .utils import extract_text_and_images_pdf, extract_text_and_images_pptx, extract_text_docx, extract_text_txt, generate_hierarchical_study_guide # Corrected relative import
+from .. import jobs # Relative import
+from .. import crud
+from .. import knowledge_graph
+from ..pipeline import validate_extension
+from ..process_pool import process_pool
+from ..study_guide_stream import start_streaming_study_guide
+from ..config import settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Import the new response model
-from ..models import Workspace, WorkspaceCreate, WorkspaceUpdate, StudyGuideResponse, ExtractedImageInfo, WorkspaceWithPopulatedStudyGuides
+from ..models import (
+    Workspace, WorkspaceCreate, WorkspaceUpdate, WorkspaceSummary, WorkspaceWithPopulatedStudyGuides,
+    WorkspaceWithStudyGuideSummaries, StudyGuideJob, StudyGuideResponse, StudyGuideSection, StudyGuideToc
+)
 from ..database import get_database, get_gridfs_bucket # Relative import
 
 router = APIRouter()
 
-# --- Configuration ---
-# load_dotenv() # Removed - handled by config.py
-# GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") # Removed - use settings
-TEMP_UPLOAD_DIR = "temp_uploads"
-IMAGE_OUTPUT_DIR_BASE = os.path.join(TEMP_UPLOAD_DIR, "images")
-MIN_IMAGE_WIDTH = 50  # Pixels - adjust as needed for pre-filtering
-MIN_IMAGE_HEIGHT = 50 # Pixels - adjust as needed for pre-filtering
-
+def _stored_sections_lookup(section_pipeline: list) -> list:
+    """
+    Stages that fill `study_guide` of guides stored with the sections layout (crud.SECTIONS_LAYOUT)
+    from their own collection; embedded guides keep theirs.
+    """
+    return [
+        {
+            "$lookup": {
+                "from": crud.STUDY_GUIDE_SECTIONS_COLLECTION,
+                "localField": "_id",
+                "foreignField": "study_guide_id",
+                "pipeline": [{"$sort": {"index": 1}}, *section_pipeline],
+                "as": "stored_sections"
+            }
+        },
+        {"$set": {"study_guide": {"$cond": [{"$eq": ["$storage_layout", crud.SECTIONS_LAYOUT]}, "$stored_sections", "$study_guide"]}}},
+        {"$project": {"stored_sections": 0}},
+    ]
 
+# Fields of a study guide returned by workspace fetches without expand
+STUDY_GUIDE_SUMMARY_PROJECTION = {
+    "original_filename": 1,
+    "original_pdf_gridfs_id": 1,
+    "generation_status": 1,
+    "section_titles": "$study_guide.section_title",
+    "image_count": {"$size": {"$ifNull": ["$extracted_images", []]}},
+}
 
 # Note: The dependency Depends(get_database) should return the *database* object,
 # not the collection directly. We access the collection within the endpoint.
 
+# --- Workspace listing (keyset pagination) ---
+WORKSPACE_PAGE_MAX_LIMIT = 100
+# Sort key -> indexed fields; `_id` is the tie-breaker. "created_at" pages on `_id` alone: ObjectIds
+# grow with insertion time, and workspaces created before created_at was stored don't have it
+WORKSPACE_SORT_FIELDS = {"created_at": ["_id"], "title": ["title", "_id"]}
+
+def _encode_cursor(sort: str, order: str, document: dict) -> str:
+    values = [document.get(field) for field in WORKSPACE_SORT_FIELDS[sort]]
+    payload = json.dumps([sort, order, [str(value) if isinstance(value, ObjectId) else value for value in values]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str, sort: str, order: str) -> list:
+    try:
+        cursor_sort, cursor_order, values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if (cursor_sort, cursor_order) != (sort, order) or len(values) != len(WORKSPACE_SORT_FIELDS[sort]):
+            raise ValueError
+        values[-1] = ObjectId(values[-1])
+        return values
+    except (ValueError, TypeError, binascii.Error, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor (it must come from X-Next-Cursor of the same sort and order)")
+
+def _keyset_filter(fields: List[str], values: list, operator: str) -> dict:
+    """Documents after (values) in (fields) order: f1 > v1 OR (f1 == v1 AND f2 > v2) ..."""
+    clauses = []
+    for i, field in enumerate(fields):
+        clause = {prev_field: values[j] for j, prev_field in enumerate(fields[:i])}
+        clause[field] = {operator: values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
 # GET: api/workspaces
-@router.get("/", response_model=List[Workspace])
-async def get_workspaces(db: AsyncIOMotorDatabase = Depends(get_database)):
-    """Get list of all workspaces."""
+@router.get("/", response_model=List[WorkspaceSummary], response_model_exclude_none=True)
+async def get_workspaces(
+    response: Response,
+    limit: int = Query(50, ge=1, le=WORKSPACE_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
+    sort: Literal["created_at", "title"] = Query("created_at", description="created_at is insertion (_id) order"),
+    order: Literal["asc", "desc"] = "asc",
+    study_guides: Literal["ids", "count", "none"] = Query("ids", description="Study guide IDs, just their number, or neither"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Get one page of workspaces. Pages are keyset-paginated on the (indexed) sort key and `_id`,
+    so every page costs the same however many workspaces exist. When more workspaces follow,
+    the X-Next-Cursor response header holds the cursor for the next page.
+    `sort=created_at` is insertion order: it pages on `_id` (whose timestamp is the creation
+    second), not on the stored created_at field.
+    """
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection not available")
-    workspaces_cursor = db["workspaces"].find() # Access collection here
-    workspaces = await workspaces_cursor.to_list(None) # Fetch all
+    fields = WORKSPACE_SORT_FIELDS[sort]
+    direction = 1 if order == "asc" else -1
+    query = {}
+    if cursor:
+        query = _keyset_filter(fields, _decode_cursor(cursor, sort, order), "$gt" if direction == 1 else "$lt")
+
+    projection = {"title": 1, "description": 1, "created_at": 1}
+    if study_guides == "ids":
+        projection["study_guides"] = 1
+    elif study_guides == "count":
+        projection["study_guide_count"] = {"$size": {"$ifNull": ["$study_guides", []]}}
+
+    # One extra document tells whether there is a next page
+    workspaces_cursor = db["workspaces"].aggregate([
+        {"$match": query},
+        {"$sort": {field: direction for field in fields}},
+        {"$limit": limit + 1},
+        {"$project": projection},
+    ])
+    workspaces = await workspaces_cursor.to_list(limit + 1)
+    if len(workspaces) > limit:
+        workspaces = workspaces[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(sort, order, workspaces[-1])
+    for workspace in workspaces:
+        workspace.setdefault("created_at", workspace["_id"].generation_time) # Workspaces created before it was stored
+        if study_guides == "ids":
+            workspace.setdefault("study_guides", [])
     return workspaces
 
 # POST: api/workspaces
@@ -48,8 +145,8 @@ async def create_workspace(workspace: WorkspaceCreate, db: AsyncIOMotorDatabase
     """Create a new workspace."""
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection not available")
-    # Use model_dump() for Pydantic v2
-    workspace_dict = workspace.model_dump()
+    # Use model_dump() for Pydantic v2; via Workspace so created_at and study_guides are stored too
+    workspace_dict = Workspace(**workspace.model_dump()).model_dump(by_alias=True)
     result = await db["workspaces"].insert_one(workspace_dict)
     created_workspace = await db["workspaces"].find_one({"_id": result.inserted_id})
     if created_workspace is None:
@@ -57,46 +154,50 @@ async def create_workspace(workspace: WorkspaceCreate, db: AsyncIOMotorDatabase
     return created_workspace
 
 # GET: api/workspaces/123
-# Use the new response model that includes populated study guides
-@router.get("/{workspace_id}", response_model=WorkspaceWithPopulatedStudyGuides)
-async def get_workspace(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    """Get a specific workspace by ID, populating study guides."""
+# Study guide summaries by default; full study guides with expand=true
+@router.get("/{workspace_id}", response_model=Union[WorkspaceWithPopulatedStudyGuides, WorkspaceWithStudyGuideSummaries])
+async def get_workspace(
+    workspace_id: str,
+    expand: bool = Query(False, description="Include full study guide content instead of summaries"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Get a specific workspace by ID with its study guides, in one aggregation.
+    By default each study guide is summarised (filename, section titles, image count) inside the
+    $lookup, so sections and explanations never leave the database; `expand=true` returns them in full.
+    """
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection not available")
     if not ObjectId.is_valid(workspace_id):
         raise HTTPException(status_code=400, detail="Invalid workspace ID format")
 
-    workspace = await db["workspaces"].find_one({"_id": ObjectId(workspace_id)})
-    if workspace is None:
-        raise HTTPException(status_code=404, detail="Workspace not found")
-    # Use aggregation to populate study_guides
+    study_guide_pipeline = [{"$sort": {"_id": 1}}] # Upload order
+    if expand:
+        study_guide_pipeline += _stored_sections_lookup([{"$project": {"_id": 0, "study_guide_id": 0, "index": 0}}])
+    else:
+        study_guide_pipeline += _stored_sections_lookup([{"$project": {"_id": 0, "section_title": 1}}])
+        study_guide_pipeline.append({"$project": STUDY_GUIDE_SUMMARY_PROJECTION})
     pipeline = [
         {"$match": {"_id": ObjectId(workspace_id)}},
         {
+            # Correlated form (localField + pipeline, MongoDB 5.0+): matched through the _id index, projected before returning
             "$lookup": {
-                "from": "study_guides", # The name of the study guides collection
-                "localField": "study_guides", # The field in the workspaces collection (contains list of ObjectIds)
-                "foreignField": "_id", # The field in the study_guides collection to match against
-                "as": "populated_study_guides" # The name of the new array field to add
+                "from": crud.STUDY_GUIDE_COLLECTION,
+                "localField": "study_guides",
+                "foreignField": "_id",
+                "pipeline": study_guide_pipeline,
+                "as": "study_guides"
             }
         }
     ]
     result_cursor = db["workspaces"].aggregate(pipeline)
-    populated_workspace = await result_cursor.to_list(length=1) # Should be only one result
-
+    populated_workspace = await result_cursor.to_list(length=1)
     if not populated_workspace:
         raise HTTPException(status_code=404, detail="Workspace not found")
 
-    # Replace the list of IDs with the populated documents
-    # Note: The response model might need adjustment if it strictly expects only IDs.
-    # For now, let's assume the frontend can handle the populated structure.
-    # We might need a different response model later if validation fails.
-    final_workspace = populated_workspace[0]
-    final_workspace["study_guides"] = final_workspace.pop("populated_study_guides", []) # Rename field for consistency
-
-    # The response_model=WorkspaceWithPopulatedStudyGuides handles validation.
-    # FastAPI will automatically validate the final_workspace dict against the model.
-    return final_workspace
+    if expand:
+        return WorkspaceWithPopulatedStudyGuides.model_validate(populated_workspace[0])
+    return WorkspaceWithStudyGuideSummaries.model_validate(populated_workspace[0])
 
 
 # PUT: api/workspaces/123
@@ -130,130 +231,177 @@ async def update_workspace(
 
 # DELETE: api/workspaces/123
 @router.delete("/{workspace_id}", status_code=204)
-async def delete_workspace(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    """Delete a workspace."""
+async def delete_workspace(
+    workspace_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)
+):
+    """Delete a workspace together with its study guides (releasing their GridFS files)."""
     if db is None:
         raise HTTPException(status_code=503, detail="Database connection not available")
     if not ObjectId.is_valid(workspace_id):
         raise HTTPException(status_code=400, detail="Invalid workspace ID format")
 
-    result = await db["workspaces"].delete_one({"_id": ObjectId(workspace_id)})
+    workspace = await db["workspaces"].find_one_and_delete({"_id": ObjectId(workspace_id)})
 
-    if result.deleted_count == 0:
+    if workspace is None:
         raise HTTPException(status_code=404, detail="Workspace not found")
+    for study_guide_id in workspace.get("study_guides") or []:
+        await crud.delete_study_guide(db=db, fs=fs, study_guide_id=study_guide_id)
+    await knowledge_graph.delete_workspace_graph(db, workspace["_id"])
     # No content to return on successful delete
     return None # Or return Response(status_code=204)
 
 
 # POST: api/workspaces/123/study-guides
-@router.post("/{workspace_id}/study-guides", response_model=StudyGuideResponse)
+@router.post("/{workspace_id}/study-guides", response_model=StudyGuideJob, status_code=202)
 async def upload_and_create_study_guide(
     workspace_id: str, # Add workspace_id path parameter
+    response: Response,
     file: UploadFile = File(...),
     db: AsyncIOMotorDatabase = Depends(get_database),
     fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)
 ):
     """
-    Uploads a document for a specific workspace, extracts text/images,
+    Uploads a document for a specific workspace and queues a job that extracts text/images
     and generates a hierarchical study guide using Gemini multimodal capabilities.
+    Returns the job straight away; poll GET /api/jobs/{job_id} for progress.
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided.")
+    if not ObjectId.is_valid(workspace_id):
+        raise HTTPException(status_code=400, detail="Invalid workspace ID format")
+    validate_extension(file.filename) # Reject unsupported types before queueing anything
 
-    request_id = str(uuid.uuid4())
-    request_temp_dir = os.path.join(TEMP_UPLOAD_DIR, request_id)
-    request_image_dir = os.path.join(IMAGE_OUTPUT_DIR_BASE, request_id)
-    os.makedirs(request_temp_dir, exist_ok=True)
-    os.makedirs(request_image_dir, exist_ok=True)
+    if await db["workspaces"].count_documents({"_id": ObjectId(workspace_id)}, limit=1) == 0:
+        raise HTTPException(status_code=404, detail="Workspace not found")
 
-    _, extension = os.path.splitext(file.filename)
-    extension = extension.lower()
-    temp_file_path = os.path.join(request_temp_dir, f"upload{extension}")
+    # Backpressure: refuse new work while the queue is already deep
+    if await jobs.count_queued_jobs(db) >= settings.JOB_QUEUE_MAX_PENDING:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many study guides are being generated, please retry shortly.",
+            headers={"Retry-After": "30"}
+        )
 
     try:
         logger.info(f"Receiving file: {file.filename}, size: {file.size}, type: {file.content_type}")
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"Saved temporary file: {temp_file_path}")
+        job = await jobs.enqueue_study_guide_job(db=db, fs=fs, workspace_id=workspace_id, file=file)
     except Exception as e:
-        logger.error(f"Failed to save temporary file {temp_file_path}: {e}")
-        shutil.rmtree(request_temp_dir, ignore_errors=True)
-        shutil.rmtree(request_image_dir, ignore_errors=True)
-        raise HTTPException(status_code=500, detail=f"Could not save uploaded file: {e}")
+        logger.error(f"Failed to queue study guide job for {file.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not queue uploaded file: {e}")
     finally:
         await file.close()
 
-    text_content = ""
-    # Keep track of *all* extracted images before filtering for the final response
-    all_extracted_images_info: List[ExtractedImageInfo] = []
-    # Keep track of images that pass filtering to send to Gemini
-    filtered_images_info: List[ExtractedImageInfo] = []
-    try:
-        if extension == ".pdf":
-            # Update to capture both lists from extraction function
-            text_content, all_extracted_images_info, filtered_images_info = extract_text_and_images_pdf(temp_file_path, request_image_dir)
-        elif extension == ".pptx":
-             # Update to capture both lists from extraction function
-            text_content, all_extracted_images_info, filtered_images_info = extract_text_and_images_pptx(temp_file_path, request_image_dir)
-        elif extension == ".docx":
-            text_content = extract_text_docx(temp_file_path)
-            # No images extracted for docx yet
-        elif extension == ".txt":
-            text_content = extract_text_txt(temp_file_path)
-            # No images for txt
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported file type: {extension}. Supported types: .pdf, .pptx, .docx, .txt"
-            )
-
-        if not text_content.strip():
-            raise HTTPException(status_code=400, detail="Extracted text content is empty.")
-
-        # Generate study guide sections using Gemini with filtered images
-        # Use the correct function name and expect hierarchical structure
-        study_guide_main_sections = await generate_hierarchical_study_guide(text_content, filtered_images_info, request_image_dir)
-
-        # Format the final response using the correct model
-        response_data = StudyGuideResponse(
-            original_filename=file.filename,
-            extracted_images=all_extracted_images_info, # Return info for all originally extracted images
-            study_guide=study_guide_main_sections, # Hierarchical study guide
-            workspace_id=ObjectId(workspace_id) # Add workspace_id to the model data
-        )
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return job
 
-        # Construct paths for the filtered images that were actually processed and potentially sent to Gemini
-        filtered_image_paths = [os.path.join(request_image_dir, img_info.filename) for img_info in filtered_images_info]
+# POST: api/workspaces/123/study-guides/stream
+@router.post("/{workspace_id}/study-guides/stream")
+async def upload_and_stream_study_guide(
+    workspace_id: str,
+    file: UploadFile = File(...),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)
+):
+    """
+    Uploads a document and streams the study guide back as NDJSON while Gemini generates it.
+    Events, one JSON object per line:
+      {"event": "started", "study_guide": {...}}   - study guide created (no sections yet) and linked
+      {"event": "section", "index": n, "section": {...}} - section n is new or has been extended
+      {"event": "completed", "study_guide_id": ..., "sections": n}
+      {"event": "error", "detail": ..., "study_guide_id": ...}
+    Each section is saved before it is sent, so the guide is complete even if the client disconnects.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No filename provided.")
+    if not ObjectId.is_valid(workspace_id):
+        raise HTTPException(status_code=400, detail="Invalid workspace ID format")
+    validate_extension(file.filename)
 
-        # Save the generated study guide metadata and upload files to GridFS
-        saved_study_guide = await crud.create_study_guide(
-            db=db,
-            fs=fs, # Pass GridFS bucket
-            study_guide_data=response_data,
-            original_pdf_path=temp_file_path, # Pass path to original PDF
-            image_paths=filtered_image_paths # Pass paths of filtered images
+    if await db["workspaces"].count_documents({"_id": ObjectId(workspace_id)}, limit=1) == 0:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+
+    # Errors after the response has started can only be reported in-stream, so check capacity up front
+    if process_pool.is_saturated():
+        raise HTTPException(
+            status_code=503,
+            detail="Document processing is at capacity, please retry shortly.",
+            headers={"Retry-After": "10"}
         )
 
-        # Update the workspace to include this study guide ID
-        if saved_study_guide and saved_study_guide.id:
-            # Add the new study guide ID to the workspace's study_guides array
-            await db["workspaces"].update_one(
-                {"_id": ObjectId(workspace_id)},
-                {"$addToSet": {"study_guides": saved_study_guide.id}}
-            )
-            logger.info(f"Updated workspace {workspace_id} with new study guide ID {saved_study_guide.id}")
-        
-        # Return the saved data (which includes the _id and GridFS IDs)
-        return saved_study_guide
-
-    except HTTPException as http_exc:
-        raise http_exc
+    try:
+        logger.info(f"Receiving file for streaming generation: {file.filename}, size: {file.size}, type: {file.content_type}")
+        lines = await start_streaming_study_guide(db=db, fs=fs, workspace_id=workspace_id, file=file)
     except Exception as e:
-        logger.error(f"Unexpected error processing file {file.filename}: {e}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+        logger.error(f"Failed to start streaming study guide generation for {file.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not process uploaded file: {e}")
     finally:
-        shutil.rmtree(request_temp_dir, ignore_errors=True)
-        # Only remove image dir if it exists and is not needed anymore
-        if os.path.exists(request_image_dir):
-             shutil.rmtree(request_image_dir, ignore_errors=True)
-        logger.info(f"Cleaned up temporary directories for request {request_id}")
+        await file.close()
+
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+# DELETE: api/workspaces/123/study-guides/456
+@router.delete("/{workspace_id}/study-guides/{study_guide_id}", status_code=204)
+async def delete_study_guide(
+    workspace_id: str,
+    study_guide_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    fs: AsyncIOMotorGridFSBucket = Depends(get_gridfs_bucket)
+):
+    """Delete a study guide; images shared with other study guides are kept until their last reference goes."""
+    if not ObjectId.is_valid(workspace_id) or not ObjectId.is_valid(study_guide_id):
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+    owned = await db[crud.STUDY_GUIDE_COLLECTION].count_documents(
+        {"_id": ObjectId(study_guide_id), "workspace_id": ObjectId(workspace_id)}, limit=1
+    )
+    if not owned or not await crud.delete_study_guide(db=db, fs=fs, study_guide_id=ObjectId(study_guide_id)):
+        raise HTTPException(status_code=404, detail="Study guide not found")
+    await knowledge_graph.remove_study_guide_from_graph(db, ObjectId(study_guide_id))
+    return None
+
+# GET: api/workspaces/123/study-guides/456
+@router.get("/{workspace_id}/study-guides/{study_guide_id}", response_model=StudyGuideResponse)
+async def get_study_guide(workspace_id: str, study_guide_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Get one study guide in full, e.g. after listing the workspace's summaries."""
+    if not ObjectId.is_valid(workspace_id) or not ObjectId.is_valid(study_guide_id):
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+    document = await crud.get_workspace_study_guide_document(db, ObjectId(workspace_id), ObjectId(study_guide_id))
+    if document is None:
+        raise HTTPException(status_code=404, detail="Study guide not found")
+    return document
+
+# GET: api/workspaces/123/study-guides/456/toc
+@router.get("/{workspace_id}/study-guides/{study_guide_id}/toc", response_model=StudyGuideToc)
+async def get_study_guide_toc(workspace_id: str, study_guide_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """Table of contents of a study guide: section titles, overviews and subsection titles, without subsection content."""
+    if not ObjectId.is_valid(workspace_id) or not ObjectId.is_valid(study_guide_id):
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+    toc = await crud.get_study_guide_toc(db, ObjectId(workspace_id), ObjectId(study_guide_id))
+    if toc is None:
+        raise HTTPException(status_code=404, detail="Study guide not found")
+    return toc
+
+# GET: api/workspaces/123/study-guides/456/sections/abc
+@router.get("/{workspace_id}/study-guides/{study_guide_id}/sections/{section_id}", response_model=StudyGuideSection)
+async def get_study_guide_section(
+    workspace_id: str,
+    study_guide_id: str,
+    section_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """One section of a study guide with its subsections, for loading the reader progressively."""
+    if not ObjectId.is_valid(workspace_id) or not ObjectId.is_valid(study_guide_id):
+        raise HTTPException(status_code=400, detail="Invalid ID format")
+    section = await crud.get_study_guide_section(db, ObjectId(workspace_id), ObjectId(study_guide_id), section_id)
+    if section is None:
+        raise HTTPException(status_code=404, detail="Section not found")
+    return section
+
+# GET: api/workspaces/123/study-guide-jobs
+@router.get("/{workspace_id}/study-guide-jobs", response_model=List[StudyGuideJob])
+async def list_study_guide_jobs(workspace_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """List the study guide jobs of a workspace, newest first."""
+    if not ObjectId.is_valid(workspace_id):
+        raise HTTPException(status_code=400, detail="Invalid workspace ID format")
+    return await jobs.get_jobs_for_workspace(db=db, workspace_id=workspace_id)
@@ -0,0 +1,140 @@
+# Content-addressed cache of Gemini study guide results.
+# The same document uploaded to several workspaces extracts to the same text and images,
+# so the generated sections can be reused instead of calling the model again.
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from . import models
+from .config import settings
+from .metrics import counters
+from .extraction import hash_image_bytes
+from .generation import STUDY_GUIDE_PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+STUDY_GUIDE_CACHE_COLLECTION = "study_guide_cache"
+
+def compute_cache_key(
+    text_content: str,
+    images_info: List[models.ExtractedImageInfo],
+    request_image_dir: str
+) -> str:
+    """
+    Hashes everything that determines the model's output: the extracted text, the filtered
+    images (content hash and the filename the model refers to them by), the prompt version,
+    the model name, the image preprocessing settings and the chunk size.
+    """
+    images = []
+    for img_info in images_info:
+        content_hash = img_info.content_hash
+        if content_hash is None:
+            with open(os.path.join(request_image_dir, img_info.filename), "rb") as f:
+                content_hash = hash_image_bytes(f.read())
+        images.append([img_info.filename, content_hash])
+    key_material = {
+        "prompt_version": STUDY_GUIDE_PROMPT_VERSION,
+        "model": settings.GEMINI_MODEL_NAME,
+        "image_preprocessing": [settings.GEMINI_IMAGE_MAX_EDGE, settings.GEMINI_IMAGE_FORMAT.upper(), settings.GEMINI_IMAGE_QUALITY],
+        "chunk_max_chars": settings.GEMINI_CHUNK_MAX_CHARS, # Chunking changes what each request sees
+        "text_sha256": hashlib.sha256(text_content.encode("utf-8")).hexdigest(),
+        "images": images,
+    }
+    return hashlib.sha256(json.dumps(key_material, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _with_new_section_ids(raw_sections: List[dict]) -> List[models.StudyGuideSection]:
+    """Section IDs must be unique per study guide, so a cached result gets fresh ones."""
+    return [
+        models.StudyGuideSection(**{**section, "section_id": str(uuid.uuid4())})
+        for section in raw_sections
+    ]
+
+class StudyGuideCache:
+    """
+    Two tiers: an optional in-process LRU (STUDY_GUIDE_CACHE_MEMORY_ENTRIES) in front of a
+    Mongo collection shared by all API processes. Mongo entries expire
+    STUDY_GUIDE_CACHE_TTL_DAYS after they were last read (TTL index on last_accessed).
+    """
+    def __init__(self):
+        self._memory: OrderedDict[str, List[dict]] = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def _remember(self, key: str, raw_sections: List[dict]):
+        max_entries = settings.STUDY_GUIDE_CACHE_MEMORY_ENTRIES
+        if max_entries <= 0:
+            return
+        async with self._lock:
+            self._memory[key] = raw_sections
+            self._memory.move_to_end(key)
+            while len(self._memory) > max_entries:
+                self._memory.popitem(last=False)
+
+    async def get(self, db: AsyncIOMotorDatabase, key: str) -> List[models.StudyGuideSection] | None:
+        """Returns the cached sections (with new section IDs) or None on a miss."""
+        if not settings.STUDY_GUIDE_CACHE_ENABLED:
+            return None
+
+        async with self._lock:
+            raw_sections = self._memory.get(key)
+            if raw_sections is not None:
+                self._memory.move_to_end(key)
+        if raw_sections is not None:
+            counters.increment("study_guide_cache.memory_hits")
+            # Keep the shared entry alive too, so other processes benefit from this access
+            await db[STUDY_GUIDE_CACHE_COLLECTION].update_one(
+                {"_id": key}, {"$set": {"last_accessed": datetime.utcnow()}, "$inc": {"hits": 1}}
+            )
+            return _with_new_section_ids(raw_sections)
+
+        document = await db[STUDY_GUIDE_CACHE_COLLECTION].find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_accessed": datetime.utcnow()}, "$inc": {"hits": 1}},
+            projection={"sections": 1}
+        )
+        if document is None:
+            counters.increment("study_guide_cache.misses")
+            return None
+
+        counters.increment("study_guide_cache.mongo_hits")
+        await self._remember(key, document["sections"])
+        return _with_new_section_ids(document["sections"])
+
+    async def put(self, db: AsyncIOMotorDatabase, key: str, sections: List[models.StudyGuideSection]):
+        """Stores generated sections under `key`. Failures are logged, never raised."""
+        if not settings.STUDY_GUIDE_CACHE_ENABLED:
+            return
+        raw_sections = [section.model_dump(exclude={"section_id"}) for section in sections]
+        now = datetime.utcnow()
+        try:
+            await db[STUDY_GUIDE_CACHE_COLLECTION].update_one(
+                {"_id": key},
+                {
+                    "$set": {"sections": raw_sections, "last_accessed": now},
+                    "$setOnInsert": {
+                        "prompt_version": STUDY_GUIDE_PROMPT_VERSION,
+                        "model": settings.GEMINI_MODEL_NAME,
+                        "created_at": now,
+                        "hits": 0,
+                    },
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Could not store study guide in cache ({key}): {e}")
+            return
+        counters.increment("study_guide_cache.stores")
+        await self._remember(key, raw_sections)
+
+    def clear_memory(self):
+        self._memory.clear()
+
+# Singleton shared by all job workers in the process
+study_guide_cache = StudyGuideCache()
@@ -0,0 +1,177 @@
+# Streaming study guide generation: sections are persisted and sent to the client (NDJSON)
+# as soon as Gemini has produced them, instead of after the whole guide is finished.
+import os
+import json
+import asyncio
+import logging
+from typing import AsyncIterator, Set
+
+from fastapi import HTTPException, UploadFile
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+
+# Use relative imports
+from . import models
+from . import crud
+from . import pipeline
+from . import knowledge_graph
+from .image_processing import prepare_images_for_gemini
+from .study_guide_cache import study_guide_cache, compute_cache_key
+from .chunked_generation import stream_study_guide_chunked
+
+logger = logging.getLogger(__name__)
+
+# Generation tasks outlive the HTTP response if the client disconnects; keep references so
+# they are not garbage collected and can be cancelled on shutdown
+_running_generations: Set[asyncio.Task] = set()
+
+def _event(event: str, **payload) -> dict:
+    return {"event": event, **payload}
+
+async def _generate_streaming(
+    db: AsyncIOMotorDatabase,
+    fs: AsyncIOMotorGridFSBucket,
+    workspace_id: str,
+    original_filename: str,
+    upload_gridfs_id: ObjectId,
+    request_id: str,
+    document_source: pipeline.DocumentSource,
+    events: asyncio.Queue
+):
+    """
+    Extracts the document, creates an empty study guide linked to the workspace, then
+    appends each section as it is generated. Progress is reported as events on `events`;
+    None marks the end of the stream.
+    """
+    extension = pipeline.get_extension(original_filename)
+    _, request_image_dir = pipeline.create_request_dirs(request_id)
+    study_guide_id = None
+    sections_saved = 0
+    try:
+        text_content, all_extracted_images_info, filtered_images_info = await pipeline.extract_document_in_pool(
+            document_source, extension, request_image_dir
+        )
+        if not text_content.strip():
+            raise HTTPException(status_code=400, detail="Extracted text content is empty.")
+
+        response_data = models.StudyGuideResponse(
+            original_filename=original_filename,
+            extracted_images=all_extracted_images_info,
+            study_guide=[],
+            workspace_id=ObjectId(workspace_id),
+            generation_status="generating"
+        )
+        filtered_image_paths = [os.path.join(request_image_dir, img_info.filename) for img_info in filtered_images_info]
+        saved_study_guide = await crud.create_study_guide(
+            db=db,
+            fs=fs,
+            study_guide_data=response_data,
+            original_pdf_path=None,
+            image_paths=filtered_image_paths,
+            original_gridfs_id=upload_gridfs_id
+        )
+        study_guide_id = saved_study_guide.id
+        await pipeline.link_study_guide_to_workspace(db, workspace_id, study_guide_id)
+        events.put_nowait(_event("started", study_guide=saved_study_guide.model_dump(mode="json", by_alias=True)))
+
+        cache_key = compute_cache_key(text_content, filtered_images_info, request_image_dir)
+        cached_sections = await study_guide_cache.get(db, cache_key)
+        if cached_sections is not None:
+            section_stream = _enumerate_cached(cached_sections)
+        else:
+            prepared_images, _ = await prepare_images_for_gemini(request_image_dir, filtered_images_info)
+            section_stream = stream_study_guide_chunked(text_content, filtered_images_info, prepared_images)
+
+        sections: list[models.StudyGuideSection] = []
+        async for index, section in section_stream:
+            await crud.save_study_guide_section(db, study_guide_id, index, section, saved_study_guide.storage_layout)
+            if index == len(sections):
+                sections.append(section)
+            else:
+                sections[index] = section
+            sections_saved = len(sections)
+            events.put_nowait(_event("section", index=index, section=section.model_dump(mode="json")))
+
+        await crud.set_study_guide_generation_status(db, study_guide_id, "completed")
+        if cached_sections is None:
+            await study_guide_cache.put(db, cache_key, sections)
+        events.put_nowait(_event("completed", study_guide_id=str(study_guide_id), sections=len(sections)))
+        logger.info(f"Streamed study guide {study_guide_id} with {len(sections)} sections for {original_filename}")
+        try:
+            await knowledge_graph.add_study_guide_to_graph(db, ObjectId(workspace_id), study_guide_id, original_filename, sections)
+            knowledge_graph.schedule_topic_layout(db, ObjectId(workspace_id))
+        except Exception as e:
+            # The graph is derived data; the study guide itself is complete
+            logger.warning(f"Could not add study guide {study_guide_id} to the knowledge graph: {e}")
+
+    except asyncio.CancelledError:
+        if study_guide_id is not None:
+            await crud.set_study_guide_generation_status(db, study_guide_id, "failed")
+        raise
+    except Exception as e:
+        detail = str(e.detail) if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Streaming study guide generation for {original_filename} failed: {detail}")
+        try:
+            if study_guide_id is None:
+                await fs.delete(upload_gridfs_id) # Nothing references the staged upload
+            elif sections_saved == 0:
+                await crud.delete_study_guide(db=db, fs=fs, study_guide_id=study_guide_id)
+            else:
+                # Keep the sections that were generated; the client already has them
+                await crud.set_study_guide_generation_status(db, study_guide_id, "failed")
+        except Exception as cleanup_err:
+            logger.warning(f"Cleanup after failed streaming generation of {original_filename} failed: {cleanup_err}")
+        events.put_nowait(_event("error", detail=detail, study_guide_id=str(study_guide_id) if sections_saved else None))
+    finally:
+        pipeline.cleanup_request_dirs(request_id)
+        events.put_nowait(None)
+
+async def _enumerate_cached(sections: list[models.StudyGuideSection]) -> AsyncIterator[tuple[int, models.StudyGuideSection]]:
+    for index, section in enumerate(sections):
+        yield index, section
+
+async def start_streaming_study_guide(
+    db: AsyncIOMotorDatabase,
+    fs: AsyncIOMotorGridFSBucket,
+    workspace_id: str,
+    file: UploadFile
+) -> AsyncIterator[bytes]:
+    """
+    Stages the upload (GridFS + an in-memory or spilled copy for extraction), starts generation in a
+    background task and returns an async iterator of NDJSON lines for the response body.
+    Generation continues, and sections keep being saved, if the client disconnects.
+    """
+    request_id = str(ObjectId())
+    request_temp_dir, _ = pipeline.create_request_dirs(request_id)
+    try:
+        # One pass over the request body: GridFS, hash and the copy extraction works from
+        staged = await pipeline.stage_upload_to_gridfs(
+            fs=fs,
+            upload=file,
+            filename=file.filename,
+            content_type=file.content_type,
+            copy_path=os.path.join(request_temp_dir, f"upload{pipeline.get_extension(file.filename)}")
+        )
+    except Exception:
+        pipeline.cleanup_request_dirs(request_id)
+        raise
+
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_generate_streaming(
+        db, fs, workspace_id, file.filename, staged.gridfs_id, request_id, staged.source, events
+    ))
+    _running_generations.add(task)
+    task.add_done_callback(_running_generations.discard)
+
+    async def ndjson_lines() -> AsyncIterator[bytes]:
+        while (event := await events.get()) is not None:
+            yield (json.dumps(event) + "\n").encode("utf-8")
+
+    return ndjson_lines()
+
+async def cancel_streaming_generations():
+    """Cancels generations still running at shutdown."""
+    tasks = list(_running_generations)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,113 @@
+# Write-behind buffer for study progress events: bursts are coalesced per topic in memory and
+# written (with their completion rollups) in batches
+import asyncio
+import logging
+from typing import List
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from . import models
+from . import knowledge_graph
+from .config import settings
+from .metrics import counters
+
+logger = logging.getLogger(__name__)
+
+class TopicProgressBuffer:
+    """
+    Keeps the latest completion per (workspace, topic) until the next flush, every
+    TOPIC_PROGRESS_FLUSH_SECONDS or as soon as TOPIC_PROGRESS_MAX_PENDING topics are waiting.
+    Many events for the same subsection cost one write, and the ancestors shared by a batch are
+    updated once. Events received while the buffer isn't running are written immediately.
+    Ancestor changes a failed write didn't apply are kept per workspace and added by the next one.
+    """
+    def __init__(self):
+        self._pending: dict[tuple[ObjectId, int], float] = {}
+        self._pending_deltas: dict[ObjectId, dict[int, float]] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._stopping = False
+        self._db: AsyncIOMotorDatabase | None = None
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Starts the flush loop on the running event loop."""
+        self._db = db
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Started topic progress buffer")
+
+    async def stop(self):
+        """Stops the flush loop (letting a flush in progress finish) and writes what is still pending."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        logger.info("Stopped topic progress buffer")
+
+    def _keep_deltas(self, workspace_id: ObjectId, deltas: dict[int, float]):
+        kept = self._pending_deltas.setdefault(workspace_id, {})
+        for ancestor, change in deltas.items():
+            kept[ancestor] = kept.get(ancestor, 0.0) + change
+
+    def _keep_unapplied(self, workspace_id: ObjectId, error: knowledge_graph.TopicProgressNotApplied):
+        """Queues what a failed write didn't apply, unless newer events for the same topics arrived meanwhile."""
+        for topic_id, completion in error.progress.items():
+            self._pending.setdefault((workspace_id, topic_id), completion)
+        self._keep_deltas(workspace_id, error.deltas)
+
+    async def record(self, db: AsyncIOMotorDatabase, workspace_id: ObjectId, events: List[models.TopicProgressEvent]):
+        """Queues progress events (the last event per topic wins)."""
+        counters.increment("topic_progress.events", len(events))
+        if self._task is None or settings.TOPIC_PROGRESS_FLUSH_SECONDS <= 0:
+            progress = {event.topicId: event.completionPercentage for event in events}
+            try:
+                await knowledge_graph.apply_topic_progress(db, workspace_id, progress, self._pending_deltas.pop(workspace_id, None))
+            except knowledge_graph.TopicProgressNotApplied as e:
+                # The caller retries the events; the ancestor changes they no longer produce are kept here
+                self._keep_deltas(workspace_id, e.deltas)
+                raise
+            return
+        for event in events:
+            self._pending[(workspace_id, event.topicId)] = event.completionPercentage
+        if len(self._pending) >= settings.TOPIC_PROGRESS_MAX_PENDING:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Writes the pending progress, one batch per workspace. Returns the number of topics written."""
+        if not (self._pending or self._pending_deltas) or self._db is None:
+            return 0
+        batch, self._pending = self._pending, {}
+        leftover_deltas, self._pending_deltas = self._pending_deltas, {}
+        by_workspace: dict[ObjectId, dict[int, float]] = {workspace_id: {} for workspace_id in leftover_deltas}
+        for (workspace_id, topic_id), completion in batch.items():
+            by_workspace.setdefault(workspace_id, {})[topic_id] = completion
+        written = 0
+        for workspace_id, progress in by_workspace.items():
+            deltas = leftover_deltas.get(workspace_id)
+            try:
+                written += await knowledge_graph.apply_topic_progress(self._db, workspace_id, progress, deltas)
+            except knowledge_graph.TopicProgressNotApplied as e:
+                logger.error(f"Could not write all progress of workspace {workspace_id}, retrying with the next flush: {e}")
+                self._keep_unapplied(workspace_id, e)
+            except Exception as e:
+                logger.error(f"Could not write progress of {len(progress)} topics of workspace {workspace_id}: {e}")
+                self._keep_unapplied(workspace_id, knowledge_graph.TopicProgressNotApplied(str(e), progress, deltas or {}))
+        counters.increment("topic_progress.flushes")
+        counters.increment("topic_progress.topics_written", written)
+        return written
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.TOPIC_PROGRESS_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+# Singleton buffer, started and stopped by the app lifespan
+topic_progress = TopicProgressBuffer()
@@ -0,0 +1,100 @@
+# Hashed TF-IDF similarity between topic texts (run in the process pool)
+import re
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]{2,}")
+_STOP_WORDS = frozenset(
+    "an and are as at be by can for from has have in is it its of on or that the this to was were which with".split()
+)
+# Bounds the (stored entries x new documents) products computed at once (~32 MB of float32)
+_SCORE_BLOCK_CELLS = 1 << 23
+
+# A document's term counts: (hashed term indices as int32 bytes, counts as uint16 bytes)
+TermCounts = Tuple[bytes, bytes]
+
+def hash_term_counts(texts: List[str], n_features: int) -> List[TermCounts]:
+    """
+    Tokenizes each text and counts its terms, hashed into `n_features` buckets (crc32, so
+    stable across processes). Counts are stored raw: IDF weights depend on the whole workspace
+    and are applied at scoring time.
+    """
+    vectors = []
+    for text in texts:
+        tokens = [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOP_WORDS]
+        hashes = np.fromiter((zlib.crc32(token.encode()) for token in tokens), dtype=np.uint32, count=len(tokens))
+        terms, counts = np.unique(hashes % n_features, return_counts=True)
+        vectors.append((terms.astype(np.int32).tobytes(), np.minimum(counts, 65535).astype(np.uint16).tobytes()))
+    return vectors
+
+def _unpack(vectors: List[TermCounts]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR form of a list of term count vectors: (row offsets, term indices, counts)."""
+    terms = [np.frombuffer(t, dtype=np.int32) for t, _ in vectors]
+    counts = [np.frombuffer(c, dtype=np.uint16) for _, c in vectors]
+    offsets = np.zeros(len(vectors) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in terms], out=offsets[1:])
+    empty_i, empty_c = np.empty(0, np.int32), np.empty(0, np.uint16)
+    return offsets, np.concatenate(terms or [empty_i]), np.concatenate(counts or [empty_c]).astype(np.float32)
+
+def _tfidf_weights(offsets: np.ndarray, terms: np.ndarray, counts: np.ndarray, idf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Row of every entry and its L2-normalized TF-IDF weight (sublinear tf: 1 + log(count))."""
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    weights = (1.0 + np.log(counts)) * idf[terms]
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(offsets) - 1)).astype(np.float32)
+    return rows, weights / np.maximum(norms[rows], 1e-12)
+
+def top_k_related(
+    new_vectors: List[TermCounts],
+    existing_vectors: List[TermCounts],
+    n_features: int,
+    top_k: int,
+    min_similarity: float
+) -> List[Tuple[int, int, float]]:
+    """
+    For every new document, its `top_k` most similar existing documents by TF-IDF cosine
+    similarity (IDF over new + existing), keeping pairs scoring at least `min_similarity`.
+    Stored entries are scored block by block against the new documents' (dense) vocabulary.
+    Returns (new index, existing index, similarity) tuples.
+    """
+    if not new_vectors or not existing_vectors or top_k <= 0:
+        return []
+    new_offsets, new_terms, new_counts = _unpack(new_vectors)
+    old_offsets, old_terms, old_counts = _unpack(existing_vectors)
+
+    document_count = len(new_vectors) + len(existing_vectors)
+    document_frequency = np.bincount(np.concatenate([new_terms, old_terms]), minlength=n_features)
+    idf = (np.log((1 + document_count) / (1 + document_frequency)) + 1.0).astype(np.float32) # Smoothed, as in scikit-learn
+
+    # Only terms of the new documents contribute to the dot products: the queries are dense over
+    # that vocabulary, and the stored entries are reduced to it before multiplying
+    new_rows, new_weights = _tfidf_weights(new_offsets, new_terms, new_counts, idf)
+    vocabulary = np.unique(new_terms)
+    if not len(vocabulary):
+        return []
+    queries = np.zeros((len(vocabulary), len(new_vectors)), dtype=np.float32)
+    queries[np.searchsorted(vocabulary, new_terms), new_rows] = new_weights
+
+    old_rows, old_weights = _tfidf_weights(old_offsets, old_terms, old_counts, idf)
+    positions = np.minimum(np.searchsorted(vocabulary, old_terms), len(vocabulary) - 1)
+    shared = vocabulary[positions] == old_terms
+    old_rows, old_weights, positions = old_rows[shared], old_weights[shared], positions[shared]
+
+    scores = np.zeros((len(existing_vectors), len(new_vectors)), dtype=np.float32)
+    block = max(1, _SCORE_BLOCK_CELLS // len(new_vectors))
+    for start in range(0, len(old_rows), block):
+        rows = old_rows[start:start + block]
+        products = queries[positions[start:start + block]] * old_weights[start:start + block, None]
+        present, first = np.unique(rows, return_index=True) # Entries are grouped by row
+        scores[present] += np.add.reduceat(products, first, axis=0)
+    scores = scores.T
+
+    k = min(top_k, scores.shape[1])
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    new_index, rank = np.nonzero(candidate_scores >= min_similarity)
+    return [
+        (int(i), int(candidates[i, r]), float(candidate_scores[i, r]))
+        for i, r in zip(new_index, rank)
+    ]
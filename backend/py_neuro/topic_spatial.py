@@ -0,0 +1,97 @@
+# Uniform grid index over laid-out topic positions, for viewport queries and clustered
+# (level-of-detail) views of large topic graphs
+import math
+from typing import List
+
+import numpy as np
+
+# Average topics per grid cell; a viewport query visits the cells it overlaps
+_NODES_PER_CELL = 4
+
+class TopicGridIndex:
+    """
+    Topic positions bucketed into square cells and sorted by (row, column), so the topics of a
+    box are a few contiguous slices (one per row of cells it overlaps). Also holds the edges
+    (as node indices) and every topic's degree, used to pick a cluster's label.
+    """
+    def __init__(self, topic_ids: np.ndarray, positions: np.ndarray, names: List[str], edges: np.ndarray, edge_kinds: List[str], edge_weights: List[float | None]):
+        count = len(topic_ids)
+        self.origin = positions.min(axis=0) if count else np.zeros(2)
+        corner = positions.max(axis=0) if count else np.zeros(2)
+        self.bounds = (*self.origin.tolist(), *corner.tolist())
+        extent = corner - self.origin
+        self.cell_size = max(math.sqrt(float(extent[0] * extent[1]) * _NODES_PER_CELL / max(count, 1)), float(extent.max()) / 4096, 1e-6)
+        self.columns = int(extent[0] // self.cell_size) + 1
+        self.rows = int(extent[1] // self.cell_size) + 1
+
+        order = np.argsort(self._keys(positions), kind="stable")
+        self.keys = self._keys(positions)[order]
+        self.topic_ids = topic_ids[order]
+        self.positions = positions[order]
+        self.names = [names[i] for i in order]
+        rank = np.empty(count, dtype=np.int64)
+        rank[order] = np.arange(count)
+        self.edges = rank[edges] if len(edges) else edges.reshape(0, 2)
+        self.edge_kinds = edge_kinds
+        self.edge_weights = edge_weights
+        self.degree = np.bincount(self.edges.ravel(), minlength=count)
+
+    def _cells(self, positions: np.ndarray) -> np.ndarray:
+        cells = ((positions - self.origin) // self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, [self.columns - 1, self.rows - 1])
+
+    def _keys(self, positions: np.ndarray) -> np.ndarray:
+        cells = self._cells(positions)
+        return cells[:, 1] * self.columns + cells[:, 0]
+
+    def query(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """Indices of the topics inside the box (edges included), in O(cells overlapped + result)."""
+        if not len(self.keys) or min_x > self.bounds[2] or min_y > self.bounds[3] or max_x < self.bounds[0] or max_y < self.bounds[1]:
+            return np.zeros(0, dtype=np.int64)
+        (first_column, first_row), (last_column, last_row) = self._cells(np.array([[min_x, min_y], [max_x, max_y]]))
+        row_keys = np.arange(first_row, last_row + 1) * self.columns
+        starts = np.searchsorted(self.keys, row_keys + first_column, side="left")
+        ends = np.searchsorted(self.keys, row_keys + last_column, side="right")
+        lengths = ends - starts
+        # Concatenated ranges [start, end) of every row, without a Python loop
+        candidates = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        x, y = self.positions[candidates, 0], self.positions[candidates, 1]
+        return candidates[(x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)]
+
+    def edges_touching(self, nodes: np.ndarray) -> np.ndarray:
+        """Indices of the edges with at least one end in `nodes`."""
+        inside = np.zeros(len(self.keys), dtype=bool)
+        inside[nodes] = True
+        return np.flatnonzero(inside[self.edges[:, 0]] | inside[self.edges[:, 1]])
+
+    def clusters(self, nodes: np.ndarray, cell_size: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Groups `nodes` by square cells of `cell_size`, aligned to the layout origin (0, 0) so a
+        topic stays in the same cluster while the viewport pans. Returns per cluster: centroid
+        (c, 2), topic count, label (index of its most connected topic); then the edges between
+        clusters (pairs of cluster indices) and how many topic edges each one stands for.
+        """
+        cells = np.floor(self.positions[nodes] / cell_size).astype(np.int64)
+        _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        cluster = cluster.ravel()
+        centroids = np.stack([
+            np.bincount(cluster, weights=self.positions[nodes, axis], minlength=len(counts)) for axis in (0, 1)
+        ], axis=1) / counts[:, None]
+        by_degree = np.lexsort((-self.degree[nodes], cluster)) # Most connected first within each cluster
+        labels = nodes[by_degree[np.searchsorted(cluster[by_degree], np.arange(len(counts)))]]
+
+        cluster_of = np.full(len(self.keys), -1, dtype=np.int64)
+        cluster_of[nodes] = cluster
+        ends = cluster_of[self.edges] if len(self.edges) else np.zeros((0, 2), dtype=np.int64)
+        ends = ends[(ends >= 0).all(axis=1) & (ends[:, 0] != ends[:, 1])]
+        ends.sort(axis=1) # Undirected at this level of detail
+        pairs, edge_counts = np.unique(ends, axis=0, return_counts=True) if len(ends) else (ends, np.zeros(0, dtype=np.int64))
+        return centroids, counts, labels, pairs, edge_counts
+
+def cluster_cell_size(width: float, height: float, max_clusters: int) -> float:
+    """
+    Cell size giving at most about `max_clusters` cells over a width x height viewport, rounded up to a
+    power of two so zooming in and out steps through a fixed set of cluster levels.
+    """
+    raw = max(math.sqrt(max(width, 1e-9) * max(height, 1e-9) / max(max_clusters, 1)), 1e-9)
+    return 2.0 ** math.ceil(math.log2(raw))
@@ -0,0 +1,6 @@
+import pytest
+
+@pytest.fixture
+def anyio_backend():
+    # The app runs on asyncio (Motor); @pytest.mark.anyio tests use it too
+    return "asyncio"
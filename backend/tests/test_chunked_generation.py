@@ -0,0 +1,81 @@
+"""Chunk planning and merging of map-reduce study guide generation (chunked_generation)."""
+from py_neuro import models
+from py_neuro.chunked_generation import PAGE_BREAK, plan_chunks, merge_chunk_sections
+
+def _image(filename: str, page_number: int | None = None) -> models.ExtractedImageInfo:
+    return models.ExtractedImageInfo(filename=filename, page_number=page_number)
+
+def _section(title: str, subsections: list[str]) -> models.StudyGuideSection:
+    return models.StudyGuideSection(
+        section_id=title.lower(),
+        section_title=title,
+        section_overview_description=f"Overview of {title}",
+        subsection_titles=subsections,
+        subsections=[
+            models.StudyGuideSubsection(subsection_title=subsection, explanation=f"{subsection} explained", associated_image_filenames=[])
+            for subsection in subsections
+        ],
+    )
+
+def test_short_document_is_one_chunk():
+    text = PAGE_BREAK.join(["page one", "page two"]) + PAGE_BREAK
+    chunks = plan_chunks(text, [_image("a.png", 2)], max_chars=1000)
+    assert len(chunks) == 1
+    assert (chunks[0].first_page, chunks[0].last_page) == (1, 2)
+    assert [image.filename for image in chunks[0].images] == ["a.png"]
+
+def test_pages_are_packed_and_images_follow_their_page():
+    pages = [f"page {number} " + "x" * 40 for number in range(1, 6)]
+    images = [_image("p1.png", 1), _image("p4.png", 4), _image("nowhere.png"), _image("bad_page.png", 99)]
+    chunks = plan_chunks(PAGE_BREAK.join(pages), images, max_chars=100)
+    assert [(chunk.first_page, chunk.last_page) for chunk in chunks] == [(1, 2), (3, 4), (5, 5)]
+    assert all(len(chunk.text) <= 100 for chunk in chunks)
+    assert chunks[1].text == "\n".join(pages[2:4])
+    # Images without a (valid) page go to the first chunk
+    assert [image.filename for image in chunks[0].images] == ["nowhere.png", "bad_page.png", "p1.png"]
+    assert [image.filename for image in chunks[1].images] == ["p4.png"]
+    assert chunks[2].images == []
+
+def test_oversized_page_is_split_at_a_heading():
+    first = "Introduction\n" + "word " * 30 + "\n"
+    second = "# Chapter Two\n" + "word " * 30
+    chunks = plan_chunks(first + second, [_image("a.png", 1)], max_chars=len(first) + 20)
+    assert [chunk.text for chunk in chunks] == [first, second]
+    assert all((chunk.first_page, chunk.last_page) == (1, 1) for chunk in chunks)
+    # A page's images go with its first piece
+    assert [image.filename for image in chunks[0].images] == ["a.png"] and chunks[1].images == []
+
+def test_short_lines_are_headings_only_in_capitals():
+    body = "\n".join(["Some text about cells"] * 4) + "\n"
+    for line, is_heading in (("PHOTOSYNTHESIS\n", True), ("Photosynthesis\n", False)):
+        chunks = plan_chunks(body + line + body, [], max_chars=len(body) + 30)
+        assert chunks[1].text.startswith(line) is is_heading
+
+def test_oversized_page_without_headings_is_split_on_spaces():
+    text = "word " * 100
+    chunks = plan_chunks(text, [], max_chars=60)
+    assert "".join(chunk.text for chunk in chunks) == text
+    assert all(len(chunk.text) <= 60 for chunk in chunks)
+    assert all(chunk.text.endswith(" ") for chunk in chunks[:-1]) # No word is cut
+
+def test_unbreakable_text_is_cut_at_the_limit():
+    chunks = plan_chunks("x" * 250, [], max_chars=100)
+    assert [len(chunk.text) for chunk in chunks] == [100, 100, 50]
+
+def test_merge_joins_a_section_split_across_chunks():
+    merged = merge_chunk_sections([
+        [_section("Cells", ["Membranes"]), _section("Photosynthesis", ["Light reactions"])],
+        [_section(" photosynthesis ", ["Calvin cycle"]), _section("Respiration", ["Glycolysis"])],
+        [_section("Respiration", ["Krebs cycle"]), _section("Cells", ["Nucleus"])],
+    ])
+    assert [section.section_title for section in merged] == ["Cells", "Photosynthesis", "Respiration", "Cells"]
+    assert merged[1].subsection_titles == ["Light reactions", "Calvin cycle"]
+    assert [subsection.subsection_title for subsection in merged[1].subsections] == ["Light reactions", "Calvin cycle"]
+    assert merged[2].subsection_titles == ["Glycolysis", "Krebs cycle"]
+    # Only a chunk's first section continues the previous chunk
+    assert merged[3].subsection_titles == ["Nucleus"]
+
+def test_merge_of_empty_chunks():
+    assert merge_chunk_sections([]) == []
+    sections = merge_chunk_sections([[], [_section("Cells", ["Membranes"])], []])
+    assert [section.section_title for section in sections] == ["Cells"]
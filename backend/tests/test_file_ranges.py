@@ -0,0 +1,89 @@
+"""
+Conditional and partial GET of stored files (routers/files.py): ETag matching, parsing of the
+Range header and If-Range, which decide whether a 200, 206, 304 or 416 is sent.
+"""
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from py_neuro.routers.files import etag_matches, parse_range_header, _requested_range, _response_headers
+
+ETAG = '"sha256-abc"'
+
+def _request(**headers: str) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/", "query_string": b"",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    (f'W/{ETAG}', True),
+    (f'"other", {ETAG}', True),
+    ("*", True),
+    ('"sha256-abd"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, ETAG) is expected
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-19", (10, 19)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-1000", (0, 99)), # Suffix longer than the file: all of it
+    ("bytes=50-1000", (50, 99)), # End clamped to the last byte
+    ("bytes=99-99", (99, 99)),
+    ("Bytes = 0-0", (0, 0)),
+])
+def test_parse_range(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+@pytest.mark.parametrize("header", [
+    "items=0-9", # Other unit
+    "bytes=0-9,20-29", # Multiple ranges are answered with the full file
+    "bytes=5-3", # End before start: invalid, not unsatisfiable
+    "bytes=abc-",
+    "bytes=-",
+    "bytes=--5",
+    "bytes=0-x",
+    "bytes",
+])
+def test_ignored_ranges(header):
+    assert parse_range_header(header, 100) is None
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(HTTPException) as raised:
+        parse_range_header(header, 100)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == "bytes */100"
+
+def test_requested_range():
+    assert _requested_range(_request(range="bytes=0-9"), ETAG, 100) == (0, 9)
+    assert _requested_range(_request(), ETAG, 100) is None
+    # An empty file has no satisfiable range; it is sent whole
+    assert _requested_range(_request(range="bytes=0-9"), ETAG, 0) is None
+
+@pytest.mark.parametrize("if_range, expected", [
+    (ETAG, (0, 9)),
+    (f" {ETAG} ", (0, 9)),
+    ('"sha256-old"', None), # The client's copy changed: full file
+    (f"W/{ETAG}", None), # If-Range needs a strong match
+    ("*", None),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", None), # Dates aren't validated; full file
+])
+def test_if_range(if_range, expected):
+    assert _requested_range(_request(range="bytes=0-9", if_range=if_range), ETAG, 100) == expected
+
+def test_response_headers():
+    full = _response_headers(ETAG, 100, None)
+    assert full["Content-Length"] == "100" and "Content-Range" not in full
+    assert full["Accept-Ranges"] == "bytes" and full["ETag"] == ETAG
+    partial = _response_headers(ETAG, 100, (90, 99))
+    assert partial["Content-Length"] == "10"
+    assert partial["Content-Range"] == "bytes 90-99/100"
+    not_modified = _response_headers(ETAG, None, None)
+    assert "Content-Length" not in not_modified and not_modified["ETag"] == ETAG
@@ -0,0 +1,63 @@
+"""Force-directed layout of the topic graph (graph_layout.layout_graph), full and incremental."""
+import numpy as np
+import pytest
+
+from py_neuro.graph_layout import layout_graph, exact_repulsion, _QuadTree
+
+K = 80.0
+
+def _chain(count: int) -> np.ndarray:
+    return np.array([[index, index + 1] for index in range(count - 1)])
+
+def _edge_lengths(positions: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(positions[edges[:, 0]] - positions[edges[:, 1]], axis=1)
+
+def test_full_layout():
+    edges = _chain(10)
+    positions = layout_graph(10, edges, k=K)
+    assert positions.shape == (10, 2) and np.isfinite(positions).all()
+    # Connected nodes end up about one ideal edge length apart
+    assert np.all((_edge_lengths(positions, edges) > 0.5 * K) & (_edge_lengths(positions, edges) < 2 * K))
+    # Deterministic for a seed
+    assert np.array_equal(positions, layout_graph(10, edges, k=K))
+    assert layout_graph(0, np.zeros((0, 2))).shape == (0, 2)
+
+def test_pinned_nodes_keep_their_positions():
+    edges = _chain(10)
+    previous = layout_graph(10, edges, k=K)
+    # Two new nodes: one attached to node 0, one to the first new node
+    edges = np.vstack([edges, [[0, 10], [10, 11]]])
+    positions = np.vstack([previous, np.full((2, 2), np.nan)])
+    pinned = np.ones(12, dtype=bool)
+
+    result = layout_graph(12, edges, positions, pinned, k=K)
+    assert np.array_equal(result[:10], previous)
+    assert np.isfinite(result[10:]).all()
+    # New nodes grow out from their neighbours instead of landing anywhere
+    assert _edge_lengths(result, np.array([[0, 10], [10, 11]])).max() < 3 * K
+
+def test_unpinned_nodes_move_and_unplaced_pins_are_ignored():
+    edges = _chain(6)
+    previous = layout_graph(6, edges, k=K)
+    positions = previous.copy()
+    positions[5] = np.nan # Pinned but never placed: laid out like a new node
+    pinned = np.array([True, True, True, False, False, True])
+
+    result = layout_graph(6, edges, positions, pinned, k=K)
+    assert np.array_equal(result[:3], previous[:3])
+    assert np.isfinite(result).all()
+    assert not np.array_equal(result[3:], previous[3:])
+
+def test_all_pinned_is_unchanged():
+    previous = layout_graph(5, _chain(5), k=K)
+    assert np.array_equal(layout_graph(5, _chain(5), previous, np.ones(5, dtype=bool), k=K), previous)
+
+@pytest.mark.parametrize("theta", [0.5, 0.8])
+def test_quadtree_repulsion_approximates_exact(theta):
+    # Jittered grid: few points share a leaf cell, so the error is the opening criterion's
+    grid = np.stack(np.meshgrid(np.arange(20), np.arange(20)), axis=-1).reshape(-1, 2) * K
+    points = grid + np.random.default_rng(0).uniform(-K / 4, K / 4, grid.shape)
+    exact = exact_repulsion(points, K)
+    approximate = _QuadTree(points).repulsion(points, np.arange(len(points)), K, theta)
+    relative_error = np.linalg.norm(approximate - exact, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(relative_error) < 0.02
@@ -0,0 +1,62 @@
+"""Relevance filtering of extracted images (image_filters.filter_relevant_images)."""
+import numpy as np
+import pytest
+from PIL import Image
+
+from py_neuro import models
+from py_neuro.config import settings
+from py_neuro.image_filters import filter_relevant_images
+
+def _stripes(width: int = 300, height: int = 200, period: int = 10) -> np.ndarray:
+    row = ((np.arange(width) // period) % 2 * 255).astype(np.uint8)
+    return np.repeat(np.tile(row, (height, 1))[:, :, None], 3, axis=2)
+
+def _images() -> dict[str, np.ndarray]:
+    dot = np.full((200, 300, 3), 255, dtype=np.uint8)
+    dot[100:102, 150:152] = 0
+    gradient = np.tile(np.linspace(0, 255, 300).astype(np.uint8), (200, 1))
+    return {
+        "stripes.png": _stripes(),
+        "blank.png": np.full((200, 300, 3), 250, dtype=np.uint8),
+        "dot.png": dot,
+        "gradient.png": np.repeat(gradient[:, :, None], 3, axis=2),
+        "noise.png": np.random.default_rng(0).integers(0, 256, (200, 300, 3), dtype=np.uint8),
+        "stripes_again.png": np.clip(_stripes().astype(np.int16) - 8, 0, 255).astype(np.uint8), # Slightly darker copy
+    }
+
+def _write(directory, images: dict[str, np.ndarray]) -> list[models.ExtractedImageInfo]:
+    for filename, pixels in images.items():
+        Image.fromarray(pixels).save(directory / filename)
+    return [models.ExtractedImageInfo(filename=filename) for filename in images]
+
+def test_drops_irrelevant_images(tmp_path):
+    images_info = _write(tmp_path, _images())
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    images_info.append(models.ExtractedImageInfo(filename="broken.png"))
+
+    dropped = filter_relevant_images(str(tmp_path), images_info)
+    assert dropped == {
+        "blank.png": "blank",
+        "dot.png": "low_entropy",
+        "gradient.png": "smooth",
+        "stripes_again.png": "near_duplicate", # The first occurrence is kept
+        "broken.png": "unreadable",
+    }
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["noise.png", "stripes.png"]
+
+def test_keeps_the_most_detailed_images_over_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_FILTER_MAX_IMAGES", 1)
+    images = _images()
+    images_info = _write(tmp_path, {"noise.png": images["noise.png"], "stripes.png": images["stripes.png"]})
+    assert filter_relevant_images(str(tmp_path), images_info) == {"noise.png": "over_limit"}
+    assert [path.name for path in tmp_path.iterdir()] == ["stripes.png"]
+
+@pytest.mark.parametrize("max_images", [0, 2])
+def test_no_limit_when_it_is_not_exceeded(tmp_path, monkeypatch, max_images):
+    monkeypatch.setattr(settings, "IMAGE_FILTER_MAX_IMAGES", max_images)
+    images = _images()
+    images_info = _write(tmp_path, {"noise.png": images["noise.png"], "stripes.png": images["stripes.png"]})
+    assert filter_relevant_images(str(tmp_path), images_info) == {}
+
+def test_no_images(tmp_path):
+    assert filter_relevant_images(str(tmp_path), []) == {}
@@ -0,0 +1,250 @@
+"""
+Keeps indexes.query_shapes() in step with the queries the application actually issues, and
+checks that none of them falls back to a collection scan.
+
+* test_queried_collections_have_query_shapes: every collection accessed as db[...] in py_neuro
+  has at least one query shape (static; catches new collections).
+* test_recorded_queries_are_covered: runs the CRUD, job, cache and topic graph code against an
+  in-memory MongoDB (mongomock) that records every filter sent, and checks each recorded filter
+  is covered by a shape (a shape on the same collection whose fields it constrains).
+* test_no_collection_scans: explains the shapes and the recorded filters on a real mongod after
+  ensure_indexes. Needs MONGODB_TEST_URL (e.g. mongodb://localhost:27017); skipped otherwise.
+
+Needs the test dependencies (py_neuro/requirements-dev.txt). Run from the backend/ directory:
+python -m pytest -q
+"""
+import os
+import re
+import uuid
+import importlib
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import mongomock_motor
+from bson import ObjectId
+
+from py_neuro import crud, jobs, knowledge_graph, models
+from py_neuro.config import settings
+from py_neuro.indexes import ensure_indexes, query_shapes, assert_no_collection_scans, QueryShape
+from py_neuro.study_guide_cache import study_guide_cache
+
+PACKAGE_DIR = Path(__file__).resolve().parents[1] / "py_neuro"
+_COLLECTION_ACCESS = re.compile(r"\bdb\[\s*(?:\"([^\"]+)\"|([A-Za-z_][\w.]*))\s*\]")
+
+# --- Static check ---
+
+def _queried_collections() -> dict[str, set[str]]:
+    """Collection name -> modules accessing it as db["name"] or db[CONSTANT] (constants resolved by import)."""
+    found: dict[str, set[str]] = {}
+    for path in sorted(PACKAGE_DIR.rglob("*.py")):
+        relative = path.relative_to(PACKAGE_DIR)
+        if relative.parts[0] == "benchmarks":
+            continue
+        module = importlib.import_module("py_neuro." + ".".join(relative.with_suffix("").parts))
+        for literal, name in _COLLECTION_ACCESS.findall(path.read_text()):
+            value = literal
+            if name:
+                value = module
+                for part in name.split("."):
+                    value = getattr(value, part, None)
+                if not isinstance(value, str):
+                    continue # A variable (e.g. ensure_indexes iterating over the registry)
+            found.setdefault(value, set()).add(str(relative))
+    return found
+
+def test_queried_collections_have_query_shapes():
+    shaped = {shape.collection for shape in query_shapes()}
+    missing = {name: sorted(modules) for name, modules in _queried_collections().items() if name not in shaped}
+    assert not missing, f"Collections queried without a QueryShape in indexes.query_shapes(): {missing}"
+
+# --- Recorded queries ---
+
+# Methods whose first argument (or keyword) is a filter
+_FILTER_METHODS = {
+    "find", "find_one", "count_documents", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+    "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+}
+
+class _RecordingCollection:
+    """Wraps a collection and records (collection, filter) for every read/update/delete."""
+    def __init__(self, collection, name: str, log: list):
+        self._collection, self._name, self._log = collection, name, log
+
+    def __getattr__(self, attribute):
+        method = getattr(self._collection, attribute)
+        if attribute in _FILTER_METHODS:
+            def call(*args, **kwargs):
+                self._log.append((self._name, args[0] if args else kwargs.get("filter", {})))
+                return method(*args, **kwargs)
+            return call
+        if attribute == "distinct":
+            def call(key, filter=None, **kwargs):
+                self._log.append((self._name, filter or {}))
+                return method(key, filter, **kwargs)
+            return call
+        if attribute == "aggregate":
+            def call(pipeline, **kwargs):
+                first = pipeline[0] if pipeline else {}
+                self._log.append((self._name, first.get("$match", {})))
+                return method(pipeline, **kwargs)
+            return call
+        if attribute == "bulk_write":
+            async def call(requests, **kwargs):
+                # mongomock's bulk_write doesn't accept this pymongo's operations; apply them one by one
+                for request in requests:
+                    self._log.append((self._name, request._filter))
+                    await self._collection.update_one(request._filter, request._doc)
+            return call
+        return method
+
+class _RecordingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.log: list[tuple[str, dict]] = []
+
+    def __getitem__(self, name: str):
+        return _RecordingCollection(self._db[name], name, self.log)
+
+    def __getattr__(self, attribute):
+        return getattr(self._db, attribute)
+
+class _MemoryGridFS:
+    """The GridFS bucket calls crud makes, on top of the (recorded) fs.files collection."""
+    def __init__(self, db):
+        self._db = db
+
+    async def upload_from_stream(self, filename, source, metadata=None):
+        document = {"filename": filename, "length": len(source if isinstance(source, bytes) else source.read())}
+        if metadata:
+            document["metadata"] = metadata
+        return (await self._db[crud.GRIDFS_FILES_COLLECTION].insert_one(document)).inserted_id
+
+    async def delete(self, file_id):
+        await self._db[crud.GRIDFS_FILES_COLLECTION].delete_one({"_id": file_id})
+
+def _sections(topics: list[str]) -> list[models.StudyGuideSection]:
+    return [
+        models.StudyGuideSection(
+            section_id=str(uuid.uuid4()),
+            section_title=topic,
+            section_overview_description=f"Overview of {topic}",
+            subsection_titles=[f"{topic} basics", f"{topic} in depth"],
+            subsections=[
+                models.StudyGuideSubsection(
+                    subsection_title=title, explanation=f"{title}: {topic} explained with examples", associated_image_filenames=[]
+                )
+                for title in (f"{topic} basics", f"{topic} in depth")
+            ],
+        )
+        for topic in topics
+    ]
+
+async def _exercise(db, fs):
+    """Runs the application's query paths that work on mongomock."""
+    workspace_id = (await db["workspaces"].insert_one({"title": "Biology", "study_guides": []})).inserted_id
+
+    # Study guides: store (content-addressed images), read, delete
+    sections = _sections(["Cells", "Photosynthesis"])
+    guide = await crud.create_study_guide(
+        db, fs,
+        models.StudyGuideResponse(
+            original_filename="bio.pdf", workspace_id=workspace_id, study_guide=sections,
+            extracted_images=[models.ExtractedImageInfo(filename="a.png"), models.ExtractedImageInfo(filename="b.png")]
+        ),
+        original_pdf_path=None, image_paths=[], image_buffers={"a.png": b"same", "b.png": b"same"}, original_data=b"%PDF"
+    )
+    await crud.get_workspace_study_guide_document(db, workspace_id, guide.id)
+    await crud.get_study_guide_toc(db, workspace_id, guide.id)
+    await crud.get_study_guide_section(db, workspace_id, guide.id, sections[0].section_id)
+
+    # Topic graph
+    await knowledge_graph.add_study_guide_to_graph(db, workspace_id, guide.id, "bio.pdf", sections)
+    other_id = ObjectId()
+    await knowledge_graph.add_study_guide_to_graph(db, workspace_id, other_id, "more.pdf", _sections(["Photosynthesis", "Respiration"]))
+    await knowledge_graph.ensure_topic_layout(db, workspace_id)
+    await knowledge_graph.get_topic_nodes(db, workspace_id)
+    await knowledge_graph.get_topic_edges(db, workspace_id)
+    await knowledge_graph.get_topic_viewport(db, workspace_id, -1e6, -1e6, 1e6, 1e6, 1000)
+    await knowledge_graph.get_topic_viewport(db, workspace_id, -1e6, -1e6, 1e6, 1e6, 2)
+    await knowledge_graph.get_topic_neighbours(db, workspace_id, 2)
+    await knowledge_graph.get_topic_subtree(db, workspace_id, 1, 1)
+    topic = await knowledge_graph.create_topic(db, models.TopicCreate(name="Notes", workspaceId=workspace_id, parentTopicId=3, orderPosition=0))
+    await knowledge_graph.apply_topic_progress(db, workspace_id, {topic.id: 0.5, 4: 1.0})
+    await knowledge_graph.rebuild_topic_rollups(db, workspace_id)
+    await knowledge_graph.remove_study_guide_from_graph(db, other_id)
+
+    # Jobs
+    now = datetime.utcnow()
+    await db[jobs.JOBS_COLLECTION].insert_one({
+        "workspace_id": workspace_id, "original_filename": "bio.pdf", "upload_gridfs_id": ObjectId(), "status": "queued",
+        "stages": [], "progress": 0.0, "attempts": 0, "created_at": now, "updated_at": now,
+    })
+    await jobs.count_queued_jobs(db)
+    await jobs.fail_exhausted_jobs(db)
+    await jobs.claim_next_job(db, "test-worker")
+    await jobs.get_jobs_for_workspace(db, str(workspace_id))
+
+    # Study guide cache
+    cache_key = "0" * 64
+    await study_guide_cache.put(db, cache_key, sections)
+    study_guide_cache._memory.clear()
+    await study_guide_cache.get(db, cache_key)
+
+    await crud.delete_study_guide(db, fs, guide.id)
+    await knowledge_graph.delete_workspace_graph(db, workspace_id)
+    await knowledge_graph.cancel_topic_layouts()
+
+async def _record_queries(monkeypatch) -> list[tuple[str, dict]]:
+    async def run_inline(function, *args, **kwargs):
+        return function(*args, **kwargs)
+    monkeypatch.setattr(knowledge_graph.process_pool, "run", run_inline)
+    monkeypatch.setattr(settings, "THUMBNAIL_ON_INGEST", False)
+    monkeypatch.setattr(settings, "STUDY_GUIDE_CACHE_ENABLED", True)
+    db = _RecordingDatabase(mongomock_motor.AsyncMongoMockClient()["query_plans"])
+    await _exercise(db, _MemoryGridFS(db))
+    return db.log
+
+def _covered(collection: str, query: dict, shapes: list[QueryShape]) -> bool:
+    """
+    A query is covered by a shape on its collection whose top-level fields it all constrains
+    (extra conditions don't stop the planner from using the shape's index); an $or is covered
+    when each branch is.
+    """
+    fields = set(query)
+    if any(shape.collection == collection and set(shape.filter) <= fields for shape in shapes):
+        return True
+    if "$or" in query:
+        rest = {field: value for field, value in query.items() if field != "$or"}
+        return all(_covered(collection, {**rest, **branch}, shapes) for branch in query["$or"])
+    return False
+
+@pytest.mark.anyio
+async def test_recorded_queries_are_covered(monkeypatch):
+    recorded = await _record_queries(monkeypatch)
+    assert recorded, "No queries were recorded"
+    shapes = query_shapes()
+    uncovered = sorted({f"{collection}: {sorted(query)}" for collection, query in recorded if not _covered(collection, query, shapes)})
+    assert not uncovered, f"Queries with no matching QueryShape in indexes.query_shapes(): {uncovered}"
+
+# --- Real query plans ---
+
+@pytest.mark.anyio
+async def test_no_collection_scans(monkeypatch):
+    url = os.environ.get("MONGODB_TEST_URL")
+    if not url:
+        pytest.skip("MONGODB_TEST_URL is not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    recorded = await _record_queries(monkeypatch)
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=5000)
+    db = client[f"query_plans_{uuid.uuid4().hex[:8]}"]
+    try:
+        await ensure_indexes(db)
+        shapes = query_shapes() + [
+            QueryShape(f"recorded query #{index}", collection, query)
+            for index, (collection, query) in enumerate(recorded) if query
+        ]
+        await assert_no_collection_scans(db, shapes)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
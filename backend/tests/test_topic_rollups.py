@@ -0,0 +1,192 @@
+"""
+Completion rollups of the topic graph: apply_topic_progress keeps every ancestor's
+completionPercentage equal to the mean of its leaves, and TopicProgressBuffer retries what a
+failed write didn't apply (leaf values and ancestor changes) without counting anything twice.
+
+Runs on mongomock; its bulk_write doesn't accept pymongo's operations, so they are applied
+one by one.
+"""
+import asyncio
+
+import pytest
+import mongomock.collection
+import mongomock_motor
+from bson import ObjectId
+
+from py_neuro import knowledge_graph, models
+from py_neuro.config import settings
+from py_neuro.topic_progress import TopicProgressBuffer
+
+class _BulkWriteResult:
+    def __init__(self, count: int):
+        self.matched_count = self.modified_count = count
+
+def _bulk_write_one_by_one(self, requests, ordered=True, **kwargs):
+    return _BulkWriteResult(sum(self.update_one(request._filter, request._doc).matched_count for request in requests))
+
+@pytest.fixture
+async def graph(monkeypatch):
+    """A workspace with root -> section -> three leaves; yields (db, workspace_id, root, section, leaves)."""
+    async def run_inline(function, *args, **kwargs):
+        return function(*args, **kwargs)
+    monkeypatch.setattr(knowledge_graph.process_pool, "run", run_inline)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", _bulk_write_one_by_one)
+    db = mongomock_motor.AsyncMongoMockClient()["topic_rollups"]
+    workspace_id = (await db["workspaces"].insert_one({"title": "Biology"})).inserted_id
+    create = lambda name, parent, position: knowledge_graph.create_topic(
+        db, models.TopicCreate(name=name, workspaceId=workspace_id, parentTopicId=parent, orderPosition=position)
+    )
+    root = await create("Biology", None, 0)
+    section = await create("Cells", root.id, 0)
+    leaves = [await create(f"Cells {index}", section.id, index) for index in range(3)]
+    yield db, workspace_id, root, section, leaves
+    await knowledge_graph.cancel_topic_layouts()
+
+async def _completion(db, workspace_id: ObjectId, topic_id: int) -> float:
+    node = await db[knowledge_graph.TOPIC_NODES_COLLECTION].find_one({"workspace_id": workspace_id, "id": topic_id})
+    return node["completionPercentage"]
+
+def _fail_once(monkeypatch, name: str, when=lambda *args: True, before_raising=None):
+    """Makes knowledge_graph.<name> raise the first time `when(*args)` holds."""
+    original = getattr(knowledge_graph, name)
+    remaining = [1]
+    async def failing(*args):
+        if remaining[0] and when(*args):
+            remaining[0] -= 1
+            if before_raising is not None:
+                await before_raising()
+            raise RuntimeError(f"{name} unavailable")
+        return await original(*args)
+    monkeypatch.setattr(knowledge_graph, name, failing)
+
+@pytest.fixture
+async def buffer(graph, monkeypatch):
+    """A started buffer whose flush loop never fires on its own (tests call flush())."""
+    monkeypatch.setattr(settings, "TOPIC_PROGRESS_FLUSH_SECONDS", 3600.0)
+    progress_buffer = TopicProgressBuffer()
+    await progress_buffer.start(graph[0])
+    yield progress_buffer
+    await progress_buffer.stop()
+
+def _events(progress: dict[int, float]) -> list[models.TopicProgressEvent]:
+    return [models.TopicProgressEvent(topicId=topic_id, completionPercentage=completion) for topic_id, completion in progress.items()]
+
+@pytest.mark.anyio
+async def test_ancestors_are_the_mean_of_their_leaves(graph):
+    db, workspace_id, root, section, leaves = graph
+    applied = await knowledge_graph.apply_topic_progress(db, workspace_id, {leaves[0].id: 0.3, leaves[1].id: 0.6, leaves[2].id: 0.9})
+    assert applied == 3
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.6)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.6)
+
+    # Updating a leaf adds only the change
+    await knowledge_graph.apply_topic_progress(db, workspace_id, {leaves[2].id: 0.0})
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.3)
+
+    # Unknown and non-leaf topics are skipped
+    assert await knowledge_graph.apply_topic_progress(db, workspace_id, {section.id: 1.0, 999: 1.0}) == 0
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.3)
+
+    # The incremental rollups agree with a full recomputation
+    await knowledge_graph.rebuild_topic_rollups(db, workspace_id)
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.3)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.3)
+
+@pytest.mark.anyio
+async def test_failed_rollup_reports_unapplied_deltas(graph, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    _fail_once(monkeypatch, "_add_to_rollups")
+    with pytest.raises(knowledge_graph.TopicProgressNotApplied) as raised:
+        await knowledge_graph.apply_topic_progress(db, workspace_id, {leaves[0].id: 0.6})
+    # The leaf was set, its ancestors weren't
+    assert raised.value.progress == {}
+    assert raised.value.deltas == {root.id: pytest.approx(0.6), section.id: pytest.approx(0.6)}
+    assert await _completion(db, workspace_id, leaves[0].id) == pytest.approx(0.6)
+    assert await _completion(db, workspace_id, section.id) == 0.0
+
+    # Retrying with the deltas completes the rollup; repeating the leaf value adds nothing
+    await knowledge_graph.apply_topic_progress(db, workspace_id, {leaves[0].id: 0.6}, raised.value.deltas)
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.2)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.2)
+
+@pytest.mark.anyio
+async def test_flush_keeps_unapplied_deltas_for_the_next_flush(graph, buffer, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    _fail_once(monkeypatch, "_add_to_rollups")
+    await buffer.record(db, workspace_id, _events({leaf.id: 0.6 for leaf in leaves}))
+    await buffer.flush()
+    assert await _completion(db, workspace_id, section.id) == 0.0
+    assert not buffer._pending
+    assert buffer._pending_deltas == {workspace_id: {root.id: pytest.approx(1.8), section.id: pytest.approx(1.8)}}
+
+    # No new events: the next flush writes the kept deltas alone
+    await buffer.flush()
+    assert not buffer._pending_deltas
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.6)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.6)
+
+@pytest.mark.anyio
+async def test_flush_retries_failed_leaves_once(graph, buffer, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    _fail_once(monkeypatch, "_set_leaf_progress", when=lambda db, workspace_id, topic_id, completion: topic_id == leaves[2].id)
+    await buffer.record(db, workspace_id, _events({leaf.id: 0.6 for leaf in leaves}))
+    await buffer.flush()
+    # The two leaves written are rolled up; the failed one waits for the next flush
+    assert buffer._pending == {(workspace_id, leaves[2].id): 0.6}
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.4)
+
+    await buffer.flush()
+    assert not buffer._pending and not buffer._pending_deltas
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.6)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.6)
+
+@pytest.mark.anyio
+async def test_newer_event_wins_over_a_failed_write(graph, buffer, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    # A newer event for the same leaf arrives while its write is failing
+    record_newer = lambda: buffer.record(db, workspace_id, _events({leaves[0].id: 0.9}))
+    _fail_once(monkeypatch, "_set_leaf_progress", before_raising=record_newer)
+    await buffer.record(db, workspace_id, _events({leaves[0].id: 0.3}))
+    await buffer.flush()
+    assert buffer._pending == {(workspace_id, leaves[0].id): 0.9}
+
+    await buffer.flush()
+    assert await _completion(db, workspace_id, leaves[0].id) == pytest.approx(0.9)
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.3)
+
+@pytest.mark.anyio
+async def test_unbuffered_record_keeps_deltas_for_the_next_write(graph, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    progress_buffer = TopicProgressBuffer() # Not started: events are written immediately
+    _fail_once(monkeypatch, "_add_to_rollups")
+    with pytest.raises(knowledge_graph.TopicProgressNotApplied):
+        await progress_buffer.record(db, workspace_id, _events({leaves[0].id: 0.6}))
+    assert progress_buffer._pending_deltas == {workspace_id: {root.id: pytest.approx(0.6), section.id: pytest.approx(0.6)}}
+
+    # The caller retries; the leaf is unchanged, the kept deltas are added
+    await progress_buffer.record(db, workspace_id, _events({leaves[0].id: 0.6}))
+    assert not progress_buffer._pending_deltas
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.2)
+
+@pytest.mark.anyio
+async def test_stop_lets_a_running_flush_finish(graph, monkeypatch):
+    db, workspace_id, root, section, leaves = graph
+    monkeypatch.setattr(settings, "TOPIC_PROGRESS_FLUSH_SECONDS", 0.01)
+    add_to_rollups = knowledge_graph._add_to_rollups
+    flushing = asyncio.Event()
+    async def slow_add_to_rollups(*args):
+        flushing.set()
+        await asyncio.sleep(0.05)
+        return await add_to_rollups(*args)
+    monkeypatch.setattr(knowledge_graph, "_add_to_rollups", slow_add_to_rollups)
+
+    progress_buffer = TopicProgressBuffer()
+    await progress_buffer.start(db)
+    await progress_buffer.record(db, workspace_id, _events({leaves[0].id: 0.9}))
+    await asyncio.wait_for(flushing.wait(), timeout=5)
+    await progress_buffer.record(db, workspace_id, _events({leaves[1].id: 0.6})) # Arrives during the flush
+    await progress_buffer.stop()
+
+    assert not progress_buffer._pending and not progress_buffer._pending_deltas
+    assert await _completion(db, workspace_id, section.id) == pytest.approx(0.5)
+    assert await _completion(db, workspace_id, root.id) == pytest.approx(0.5)
@@ -51,13 +51,23 @@ interface StudyGuideResponse {
   workspace_id: string; // Assuming PyObjectId serializes to string
 }
 
+// Study guide summary returned with the workspace (backend StudyGuideSummary)
+interface StudyGuideSummary {
+  _id: string;
+  original_filename: string;
+  section_titles: string[];
+  image_count: number;
+  original_pdf_gridfs_id?: string | null;
+  generation_status?: string | null;
+}
+
 // Interface for the workspace data fetched from the API
 interface WorkspaceData {
   _id: string; // Assuming PyObjectId serializes to string
   title: string;
   created_at: string; // Assuming datetime serializes to string
   // REMOVED: files: any[]; // This field is not in the backend model WorkspaceWithPopulatedStudyGuides
-  study_guides: StudyGuideResponse[]; // Updated to use renamed interface
+  study_guides: StudyGuideSummary[]; // Summaries only; full guides are fetched one at a time
 }
 
 // Define props to receive workspaceId directly
@@ -72,6 +82,7 @@ export default function Overview({ workspaceId }: OverviewProps) {
   const effectiveWorkspaceId = workspaceId || (typeof params.workspaceId === 'string' ? params.workspaceId : null);
 
   const [workspace, setWorkspace] = useState<WorkspaceData | null>(null);
+  const [studyGuide, setStudyGuide] = useState<StudyGuideResponse | null>(null);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
@@ -116,6 +127,7 @@ export default function Overview({ workspaceId }: OverviewProps) {
       setIsLoading(true);
       setError(null);
       setWorkspace(null); // Clear previous data
+      setStudyGuide(null);
       const apiUrl = process.env.NEXT_PUBLIC_API_URL;
 
       if (!apiUrl) {
@@ -143,8 +155,19 @@ export default function Overview({ workspaceId }: OverviewProps) {
         }
         const data: WorkspaceData = await response.json();
         setWorkspace(data);
+        // The workspace only carries summaries; load the content of the guide we display
+        const firstGuide = data.study_guides?.[0];
+        if (firstGuide) {
+          const guideResponse = await fetch(
+            `${apiUrl}/api/workspaces/${effectiveWorkspaceId}/study-guides/${firstGuide._id}`,
+            { cache: 'no-store' }
+          );
+          if (!guideResponse.ok) {
+            throw new Error(`HTTP error! status: ${guideResponse.status} - ${await guideResponse.text()}`);
+          }
+          setStudyGuide(await guideResponse.json());
+        }
         // TODO: Fetch quiz data separately if it's not part of the workspace data
-        // For now, we assume study_guides are included in the workspace fetch
       } catch (e: any) {
         console.error("Failed to fetch workspace data:", e);
         setError(`Failed to load workspace: ${e.message}`);
@@ -185,9 +208,7 @@ export default function Overview({ workspaceId }: OverviewProps) {
     );
   }
 
-  // Assuming we display the first study guide found, or a message if none exist
-  const studyGuide = workspace.study_guides?.[0];
-
+  // We display the first study guide (loaded above), or a message if none exist
   return (
     <div className="flex p-6 w-full mx-auto"> {/* Keep padding here */}
       <div className="flex-1">
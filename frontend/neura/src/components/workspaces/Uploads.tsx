@@ -13,13 +13,19 @@ import { formatFileSize } from "@/lib/utils";
 import { MultiStepLoader as Loader } from "@/components/ui/multistep-loader";
 import { IconSquareRoundedX } from "@tabler/icons-react";
 
-// Define expected response structure (based on backend/py_neuro/models.py StudyGuideResponse)
+// Define expected response structure (based on backend/py_neuro/models.py StudyGuideJob)
 interface UploadResponse {
-  _id: string; // The ID of the created study guide document
+  _id: string; // The ID of the queued study guide job
   original_filename: string;
+  status: "queued" | "running" | "completed" | "failed";
+  progress: number;
+  error: string | null;
+  study_guide_id: string | null; // Set once the job has completed
   // Include other fields if needed
 }
 
+const JOB_POLL_INTERVAL_MS = 2000;
+
 const loadingStates = [
   {
     text: "Uploading Materials",
@@ -112,15 +118,27 @@ export default function Uploads({ workspaceId }: { workspaceId: string }) {
           throw new Error(`Upload failed: ${response.status} ${errorText}`);
         }
 
-        const result: UploadResponse = await response.json();
-        studyGuideId = result._id; // Use _id from response
+        // The upload is processed in the background; poll the job until it finishes
+        let job: UploadResponse = await response.json();
+        while (job.status === "queued" || job.status === "running") {
+          await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+          const jobResponse = await fetch(`${BASE_URL}/api/jobs/${job._id}`, {
+            cache: "no-store",
+          });
+          if (!jobResponse.ok) {
+            const errorText = await jobResponse.text();
+            throw new Error(`Checking upload status failed: ${jobResponse.status} ${errorText}`);
+          }
+          job = await jobResponse.json();
+        }
+        if (job.status === "failed") {
+          throw new Error(`Study guide generation failed: ${job.error ?? "unknown error"}`);
+        }
+        studyGuideId = job.study_guide_id;
         clearFiles(); // Clear files from store on successful upload
 
-        // Add a longer delay before redirecting to allow DB update to settle
-        setTimeout(() => {
-          // Force a full page navigation to ensure fresh data load
-          window.location.href = `/w/${workspaceId}/overview`;
-        }, 2000); // Increased to 2000ms (2 seconds) to ensure backend has time to update the workspace
+        // Force a full page navigation to ensure fresh data load
+        window.location.href = `/w/${workspaceId}/overview`;
 
       } else {
         // This case should ideally not be reached due to checks above
@@ -4,6 +4,7 @@ import Link from "next/link";
 import { useState, useEffect } from "react";
 import CreateButton from "./CreateButton";
 import WorkspaceCard from "./WorkspaceCard";
+import { Button } from "@/components/ui/button";
 
 // Define an interface for the workspace data fetched from the backend
 // Match the backend model (models.py -> WorkspaceBase)
@@ -15,41 +16,53 @@ interface Workspace {
   // Add other fields if needed, e.g., files, study_guides
 }
 
+// Workspaces per request; the backend pages with a cursor returned in the X-Next-Cursor header
+const PAGE_SIZE = 50;
+
 export default function Workspaces() {
   const [workspaces, setWorkspaces] = useState<Workspace[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
-  useEffect(() => {
-    const fetchWorkspaces = async () => {
-      setIsLoading(true);
-      setError(null);
-      const apiUrl = process.env.NEXT_PUBLIC_API_URL;
-      if (!apiUrl) {
-        setError("API URL is not configured.");
-        setIsLoading(false);
-        return;
+  const fetchWorkspaces = async (cursor: string | null) => {
+    const apiUrl = process.env.NEXT_PUBLIC_API_URL;
+    if (!apiUrl) {
+      setError("API URL is not configured.");
+      return;
+    }
+    try {
+      // The cards don't show study guides, so don't download their IDs
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE), study_guides: "none" });
+      if (cursor) params.set("cursor", cursor);
+      const response = await fetch(`${apiUrl}/api/workspaces/?${params}`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
       }
-      try {
-        const response = await fetch(`${apiUrl}/api/workspaces`);
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data: Workspace[] = await response.json();
-        // Convert _id to string if it's not already (though FastAPI should handle this)
-        // Also format date if needed
-        setWorkspaces(data.map(ws => ({ ...ws, _id: String(ws._id) })));
-      } catch (e: any) {
-        console.error("Failed to fetch workspaces:", e);
-        setError(`Failed to load workspaces: ${e.message}`);
-      } finally {
-        setIsLoading(false);
-      }
-    };
+      const data: Workspace[] = await response.json();
+      // Convert _id to string if it's not already (though FastAPI should handle this)
+      const page = data.map(ws => ({ ...ws, _id: String(ws._id) }));
+      setWorkspaces(previous => (cursor ? [...previous, ...page] : page));
+      setNextCursor(response.headers.get("X-Next-Cursor"));
+    } catch (e: any) {
+      console.error("Failed to fetch workspaces:", e);
+      setError(`Failed to load workspaces: ${e.message}`);
+    }
+  };
 
-    fetchWorkspaces();
+  useEffect(() => {
+    setIsLoading(true);
+    setError(null);
+    fetchWorkspaces(null).finally(() => setIsLoading(false));
   }, []); // Empty dependency array means this runs once on mount
 
+  const loadMore = async () => {
+    setIsLoadingMore(true);
+    await fetchWorkspaces(nextCursor);
+    setIsLoadingMore(false);
+  };
+
   return (
     <div className="container mx-auto p-6">
       <div className="flex justify-between items-center mb-6">
@@ -79,6 +92,14 @@ export default function Workspaces() {
           )}
         </div>
       )}
+
+      {!isLoading && !error && nextCursor && (
+        <div className="flex justify-center mt-6">
+          <Button variant="outline" onClick={loadMore} disabled={isLoadingMore}>
+            {isLoadingMore ? "Loading..." : "Load more"}
+          </Button>
+        </div>
+      )}
     </div>
   );
 }